@@ -1,202 +1,154 @@
-import cv2
-import numpy as np
 import time
-import itertools
-import serial
-import threading
 import sys
 
+from frame_change import FrameChangeDetector
+from frame_context import FrameContext
+from layout_profile import get_layout
+from template_registry import get_template_registry
+from screen_capture import ScreenCapture, get_capture_pipeline
+from screen_wait import template_visible, wait_until
+from template_matching import configure_pyramid_matching, get_template_image_position
+from touch_controller import SERIAL_PORT, TouchController
+
 
 # キャプチャの設定
 WINDOW_NAME = "rpiplay"
 WINDOW_ID = "0x2a00002"
 WINDOW_WIDTH = 1728#2532
 WINDOW_HEIGHT = 798#1170
-IMAGE_WIDTH = 1823  # 960
-IMAGE_HEIGHT = 842  # 540
 
-# 画面判別処理を中断するまでの回数
-MAX_ERROR_COUNT = 5000
+# 処理する画像の大きさ（キャプチャした大きさのまま処理する）
+# テンプレート画像・座標はレイアウト（layout_profile.py参照）を基準に起動時に拡大縮小する
+WORKING_WIDTH = WINDOW_WIDTH
+WORKING_HEIGHT = WINDOW_HEIGHT
+layout = get_layout("iphone_x", (WORKING_WIDTH, WORKING_HEIGHT))
+transform = layout.transform
 
+# 新しい画像がキャプチャされるまで待つ時間の上限(秒)
+CAPTURE_TIMEOUT = 5
 
-class TouchController:
-    def __init__(self):
-        self.ser = serial.Serial("/dev/ttyUSB0", 115200, timeout=None)
-
-    def __del__(self):
-        self.ser.close()
+# 画面判別処理を中断するまでの回数
+MAX_ERROR_COUNT = 5000
 
-    def send_message(self, message):
-        self.ser.write(bytes(message, "UTF-8"))
-        time.sleep(0.2)
+# ボタンが表示されるまで待つ時間の上限(秒)
+BUTTON_TIMEOUT = 5
 
-    def home(self):
-        self.send_message("HOME\n")
-
-    def tap(self):
-        self.send_message("TAP\n")
-
-    def move(self, destination_image_coordinate):
-        x, y = destination_image_coordinate
-        message = "MOVE," + str(x) + "," + str(y) + "\n"
-        self.send_message(message)
-
-
-class ScreenCapture(threading.Thread):
-    def __init__(self):
-        super(ScreenCapture, self).__init__()
-
-        # キャプチャの初期設定
-        self.video_source = cv2.VideoCapture(
-            # f"ximagesrc xname={WINDOW_NAME} ! videoconvert ! videoscale ! video/x-raw,width={WINDOW_WIDTH},height={WINDOW_HEIGHT} ! appsink"
-            f"ximagesrc xid={WINDOW_ID} ! videoconvert ! videoscale ! video/x-raw,width={WINDOW_WIDTH},height={WINDOW_HEIGHT} ! appsink"
-        )
-
-    def stop(self):
-        self.stop = True
-
-    def run(self):
-        self.stop = False
-
-        while not self.stop:
-            ret, image_original = self.video_source.read()
-
-            if ret:
-                # キャプチャした画像をリサイズして更新
-                self.image_color = cv2.resize(
-                    image_original, (IMAGE_WIDTH, IMAGE_HEIGHT)
-                )
-                # キャプチャした画像を表示
-                #cv2.imshow("fgo_auto", self.image_color)
-                #cv2.waitKey(1)
-
-    def get_image(self):
-        return self.image_color
-
-
-##### 任意画像の位置の認識 #####
-def get_template_image_position(image_color, image_name, roi=None, debug_mode=False):
-    THRESHOLD = 0.80  # 一致度の閾値; 一致度の最大値がこの閾値以上であれば、テンプレートと一致したとみなす
-    TEMPLATE_IMAGE_PATH = "./pict/" + image_name + ".png"
-
-    # キャプチャ画像のグレースケール化
-    image_gray = cv2.cvtColor(image_color, cv2.COLOR_BGR2GRAY)
-
-    # ROIの設定
-    if roi is not None:
-        image_gray = image_gray[
-            roi["top_y"] : roi["bottom_y"], roi["top_x"] : roi["bottom_x"]
-        ]
-
-    # テンプレートの画像をグレースケールで読み込む
-    template = cv2.imread(TEMPLATE_IMAGE_PATH, 0)
-
-    # テンプレートマッチング処理
-    result = cv2.matchTemplate(image_gray, template, cv2.TM_CCOEFF_NORMED)
-
-    # 一致度の最大値と位置を取得
-    _, max_val, _, max_loc = cv2.minMaxLoc(result)
-    top_x, top_y = max_loc
-    if roi is not None:
-        top_x += roi["top_x"]
-        top_y += roi["top_y"]
-    width, height = template.shape[::-1]
-
-    if debug_mode:
-        result = image_color.copy()
-        # 検出領域を四角で囲む
-        cv2.rectangle(
-            result, (top_x, top_y), (top_x + width, top_y + height), (255, 0, 0), 2
-        )
-
-        # 結果を出力
-        cv2.imwrite("./debug/" + image_name + ".jpg", result)
-        print(
-            "image_name:",
-            image_name,
-            "    max_val:",
-            max_val,
-            "    max_loc:",
-            (top_x, top_y),
-        )
-
-    # 一致度が閾値以上：一致するエリアの中心座標を返す
-    # 一致度が閾値以下：Noneを返す
-    if max_val > THRESHOLD:
-        # タップの位置を求める
-        tap_position = np.array([top_x + int(width / 2), top_y + int(height / 2)])
-        return tap_position
-    else:
-        return None
+# テンプレートマッチングの精度と速度のバランス（template_matching.configure_pyramid_matching参照）
+PYRAMID_LEVELS = 3  # ピラミッドの段数; 1なら縮小せずに全体を探索する
+PYRAMID_CANDIDATES = 3  # 原寸で詳細に探索する候補数
 
 
-if __name__ == "__main__":
-    # 画面制御のインスタンスを作成
-    tc = TouchController()
-
-    # 画面キャプチャのインスタンスを生成
-    sc = ScreenCapture()
-    sc.start()
-    time.sleep(1)
-
+##### 箱を開け続ける #####
+# "開ける"ボタンがあればタップし、箱が空になったらリセットする
+# 画面判別処理を繰り返してもボタンが見つからず、中断して終了を選んだ場合に戻る
+# tc: TouchController, sc: ScreenCapture（開始済みのもの）
+def open_boxes(tc, sc):
     # ポインタを初期位置に戻す
     tc.home()
 
-    try:
-        error_counter = 0
-        while True:
-            # ポインタを初期位置に戻す
-            tc.home()
-
-            # 画像をキャプチャ
-            image_color = sc.get_image()
-
+    # ボタンが見つからなかった画面から変化していない間は画面判別処理を省略する
+    # 箱を開けるアニメーション中もタップを続けるため、動いている最中の判定は行わない
+    frame_change = FrameChangeDetector(motion_threshold=None)
+
+    error_counter = 0
+    while True:
+        # ポインタを初期位置に戻す
+        tc.home()
+
+        # 前回の処理が終わった後にキャプチャされた画像を取得する
+        captured = sc.get_next_frame(sc.latest_seq, CAPTURE_TIMEOUT)
+        if captured is None:
+            print("キャプチャできませんでした")
+            continue
+        frame = FrameContext(captured.image)
+
+        skip, _ = frame_change.lookup(frame)
+        if skip:
+            # ボタンが見つからなかった画面から変化していない → 判別処理を省略する
+            error_counter += 1
+        else:
             # 次のアクションを決める
-            tap_position = get_template_image_position(image_color, "open_box")
+            tap_position = get_template_image_position(frame, "open_box")
             if tap_position is not None:
                 tc.move(tap_position)
                 for i in range(5):
                     tc.tap()
                     time.sleep(0.1)
+                frame_change.reset()
                 print("回転します")
             else:
-                tap_position = get_template_image_position(image_color, "リセット")
+                tap_position = get_template_image_position(frame, "リセット")
                 if tap_position is not None:
                     tc.move(tap_position)
                     tc.tap()
-                    time.sleep(2)
+                    frame_change.reset()
                     print("箱をリセットします")
 
-                    image_color = sc.get_image()
-                    tap_position = get_template_image_position(image_color, "実行する")
-                    print(tap_position)
-                    tc.move(tap_position)
-                    tc.tap()
-                    image_color = sc.get_image()
-                    time.sleep(2)
-
-                    image_color = sc.get_image()
-                    tap_position = get_template_image_position(image_color, "閉じる")
-                    tc.move(tap_position)
-                    tc.tap()
-                    print("箱をリセットしました")
+                    # "実行する"ボタンが表示されるまで待つ
+                    frame = wait_until(sc, template_visible("実行する"), BUTTON_TIMEOUT)
+                    if frame is not None:
+                        tap_position = get_template_image_position(frame, "実行する")
+                        print(tap_position)
+                        tc.move(tap_position)
+                        tc.tap()
+
+                        # "閉じる"ボタンが表示されるまで待つ
+                        frame = wait_until(sc, template_visible("閉じる"), BUTTON_TIMEOUT)
+                        if frame is not None:
+                            tap_position = get_template_image_position(frame, "閉じる")
+                            tc.move(tap_position)
+                            tc.tap()
+                            print("箱をリセットしました")
                 else:
+                    # ボタンが見つからなかった画面を記録する
+                    frame_change.store(frame, None)
                     error_counter += 1
 
-            # 画面判別処理を繰り返してもフェーズが判別不明の場合
-            if error_counter >= MAX_ERROR_COUNT:
-                print("エラー：現在のフェーズが判別できませんでした")
-                while True:
-                    print("中断します(rで再開, eで終了): ", end="")
-                    s = input()
-                    if s == "r":
-                        error_counter = 0
-                        break
-                    elif s == "e":
-                        sys.exit()
-                        break
-            time.sleep(0.2)
+        # 画面判別処理を繰り返してもフェーズが判別不明の場合
+        if error_counter >= MAX_ERROR_COUNT:
+            print("エラー：現在のフェーズが判別できませんでした")
+            while True:
+                print("中断します(rで再開, eで終了): ", end="")
+                s = input()
+                if s == "r":
+                    error_counter = 0
+                    break
+                elif s == "e":
+                    return
+        time.sleep(0.2)
 
-    except KeyboardInterrupt:
-        print("プログラムを終了します")
+
+if __name__ == "__main__":
+    # 使い方: python box_opener.py [--window-id ウィンドウID] [--port シリアルポート]
+    window_id = WINDOW_ID
+    if "--window-id" in sys.argv:
+        window_id = sys.argv[sys.argv.index("--window-id") + 1]
+    port = SERIAL_PORT
+    if "--port" in sys.argv:
+        port = sys.argv[sys.argv.index("--port") + 1]
+
+    # テンプレート画像を読み込み、処理する画像の大きさに合わせて拡大縮小する
+    get_template_registry().set_scale(*layout.template_scale)
+    configure_pyramid_matching(PYRAMID_LEVELS, PYRAMID_CANDIDATES)
+
+    # 画面制御のインスタンスを作成
+    tc = TouchController(port, transform, legacy_move_wait=0.0)
+
+    # 画面キャプチャのインスタンスを生成
+    # 処理する画像の大きさでキャプチャし、キャプチャ後のリサイズは行わない
+    sc = ScreenCapture(
+        get_capture_pipeline(WORKING_WIDTH, WORKING_HEIGHT, window_id=window_id)
+    )
+    sc.start()
+
+    # 最初の画像がキャプチャされるまで待つ
+    captured = sc.get_next_frame(0, CAPTURE_TIMEOUT)
+    if captured is None:
+        print("キャプチャできませんでした")
         sys.exit()
+
+    try:
+        open_boxes(tc, sc)
+    except KeyboardInterrupt:
+        pass
+    print("プログラムを終了します")
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+##### 座標変換 #####
+# 基準の画像サイズで定義した座標（タップ位置・ROI）を、処理する画像サイズの座標に変換する
+# 起動時に一度だけ変換しておけば、キャプチャした画像を毎回リサイズする必要がなくなる
+class CoordinateTransform:
+    def __init__(self, reference_size, working_size):
+        self.reference_size = reference_size  # 座標を定義した画像の大きさ(幅, 高さ)
+        self.working_size = working_size  # 処理する画像の大きさ(幅, 高さ)
+        self.scale_x = working_size[0] / reference_size[0]
+        self.scale_y = working_size[1] / reference_size[1]
+
+    @property
+    def is_identity(self):
+        return self.scale_x == 1.0 and self.scale_y == 1.0
+
+    # 座標(x, y)の配列を変換する（最後の次元が(x, y)であれば形は問わない）
+    def points(self, points):
+        points = np.asarray(points)
+        scale = np.array([self.scale_x, self.scale_y])
+        return np.rint(points * scale).astype(int)
+
+    def point(self, point):
+        return self.points(point)
+
+    # 長さ(pixel)を横方向の倍率で変換する
+    def length(self, length):
+        return int(round(length * self.scale_x))
+
+    # ROIを変換する
+    def roi(self, roi):
+        return {
+            "top_x": int(round(roi["top_x"] * self.scale_x)),
+            "top_y": int(round(roi["top_y"] * self.scale_y)),
+            "bottom_x": int(round(roi["bottom_x"] * self.scale_x)),
+            "bottom_y": int(round(roi["bottom_y"] * self.scale_y)),
+        }
+
+    # ROIのリスト（入れ子も可）を変換する
+    def rois(self, rois):
+        if isinstance(rois, dict):
+            return self.roi(rois)
+        return [self.rois(roi) for roi in rois]
+
+    # 処理する画像の座標を基準の画像サイズの座標に戻す（タップ位置の送信用）
+    def to_reference(self, point):
+        x, y = point
+        return np.array(
+            [int(round(x / self.scale_x)), int(round(y / self.scale_y))]
+        )
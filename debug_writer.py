@@ -0,0 +1,169 @@
+import cv2
+import numpy as np
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+# デバッグ用の画像を保存する場所
+DEBUG_DIRECTORY = "./debug"
+
+QUEUE_SIZE = 16  # 保存待ちの画像の上限; 超えた分は保存せずに捨てる
+MIN_INTERVAL = 2.0  # 同じ名前の画像を保存する最小の間隔(秒)
+SAMPLE_EVERY = 1  # 同じ名前の画像をこの回数に1回だけ保存する
+JPEG_QUALITY = 80  # JPEGの画質(0～100)
+IMAGE_SCALE = 0.5  # 画面全体の画像を保存するときの縮小率
+
+PLOT_SIZE = (640, 360)  # グラフの画像の大きさ(幅, 高さ)
+PLOT_COLORS = [(255, 0, 0), (0, 160, 0), (0, 0, 255), (0, 160, 160), (160, 0, 160)]
+
+
+##### デバッグ用の画像の非同期保存 #####
+# 画像認識の処理からは保存したい画像と注釈（検出した領域など）をキューに入れるだけで、すぐに戻る
+# 注釈の描画・縮小・JPEGへの変換・ファイルへの書き込みは専用のスレッドで行う
+# 同じ名前の画像はMIN_INTERVAL秒に1回、SAMPLE_EVERY回に1回だけ保存し、キューが一杯なら捨てる
+# 画像は書き換えられないことを前提に、コピーせずにキューに入れる（FrameContextの画像など）
+class DebugWriter(threading.Thread):
+    def __init__(
+        self,
+        directory=DEBUG_DIRECTORY,
+        queue_size=QUEUE_SIZE,
+        min_interval=MIN_INTERVAL,
+        sample_every=SAMPLE_EVERY,
+        jpeg_quality=JPEG_QUALITY,
+    ):
+        super(DebugWriter, self).__init__(daemon=True)
+        self.directory = directory
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.min_interval = min_interval
+        self.sample_every = sample_every
+        self.jpeg_quality = jpeg_quality
+        self.last_saved = {}  # 画像の名前 → 最後にキューに入れた時刻
+        self.requests = {}  # 画像の名前 → 保存を要求された回数
+        self.dropped = 0  # キューが一杯で捨てた数
+        self.lock = threading.Lock()
+
+    # 保存するかを判定する（保存する場合は最後に保存した時刻を更新する）
+    def accept(self, name):
+        now = time.time()
+        with self.lock:
+            count = self.requests.get(name, 0)
+            self.requests[name] = count + 1
+            if count % self.sample_every != 0:
+                return False
+            if now - self.last_saved.get(name, -np.inf) < self.min_interval:
+                return False
+            self.last_saved[name] = now
+            return True
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    # 画像を保存する
+    # rectangles: 画像に描く四角形(top_x, top_y, bottom_x, bottom_y)のリスト
+    # scale: 保存するときの縮小率
+    # timestamped: Trueならファイル名に日時を付ける（Falseなら同じ名前のファイルに上書きする）
+    # 戻り値
+    #   キューに入れたか（間引いた・キューが一杯の場合はFalse）
+    def save_image(self, name, image, rectangles=(), scale=1.0, timestamped=False):
+        if not self.accept(name):
+            return False
+        filename = name
+        if timestamped:
+            filename += "_" + datetime.now().strftime("%Y%m%d_%H%M%S")
+        return self.put(("image", filename, image, list(rectangles), scale))
+
+    # 数値の系列を折れ線グラフの画像にして保存する
+    # series: 系列のリスト（各系列は1次元の配列）
+    def save_plot(self, name, series, labels=None):
+        if not self.accept(name):
+            return False
+        series = [np.array(values, dtype=np.float64) for values in series]
+        return self.put(("plot", name, series, labels, None))
+
+    # 保存待ちの画像をすべて保存したらスレッドを終了する
+    def close(self, timeout=5.0):
+        if self.is_alive():
+            self.queue.put((None, None, None, None, None))
+            self.join(timeout)
+
+    def run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            kind, name, data, option, scale = self.queue.get()
+            if kind is None:
+                break
+            try:
+                if kind == "image":
+                    image = self.render_image(data, option, scale)
+                else:
+                    image = self.render_plot(data, option)
+                cv2.imwrite(
+                    os.path.join(self.directory, name + ".jpg"),
+                    image,
+                    [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality],
+                )
+            except Exception as e:
+                print("デバッグ用の画像を保存できませんでした：", name, e)
+
+    @staticmethod
+    def render_image(image, rectangles, scale):
+        if rectangles:
+            image = image.copy()
+            for top_x, top_y, bottom_x, bottom_y in rectangles:
+                cv2.rectangle(
+                    image, (top_x, top_y), (bottom_x, bottom_y), (255, 0, 0), 2
+                )
+        if scale != 1.0:
+            image = cv2.resize(
+                image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+        return image
+
+    @staticmethod
+    def render_plot(series, labels):
+        width, height = PLOT_SIZE
+        margin = 20
+        image = np.full((height, width, 3), 255, dtype=np.uint8)
+
+        maximum = max((np.max(values) for values in series if len(values)), default=0)
+        maximum = max(float(maximum), 1.0)
+        for i, values in enumerate(series):
+            if len(values) < 2:
+                continue
+            color = PLOT_COLORS[i % len(PLOT_COLORS)]
+            x = margin + np.linspace(0, width - 2 * margin, len(values))
+            y = height - margin - values / maximum * (height - 2 * margin)
+            points = np.stack([x, y], axis=1).astype(np.int32)
+            cv2.polylines(image, [points], False, color, 2)
+            if labels is not None:
+                cv2.putText(
+                    image,
+                    labels[i],
+                    (width - 200, margin + 20 * (i + 1)),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.5,
+                    color,
+                    1,
+                )
+        return image
+
+
+# 全モジュールで共有するデバッグ用の画像の保存インスタンス（初回要求時にスレッドを開始する）
+_debug_writer = None
+_debug_writer_lock = threading.Lock()
+
+
+def get_debug_writer():
+    global _debug_writer
+    with _debug_writer_lock:
+        if _debug_writer is None:
+            _debug_writer = DebugWriter()
+            _debug_writer.start()
+        return _debug_writer
@@ -1,79 +1,167 @@
 import cv2
 import numpy as np
 import time
-import random
 from enum import IntEnum
 import itertools
 import sys
-from datetime import datetime
-import serial
-import threading
 
-import matplotlib.pyplot as plt
+from debug_writer import IMAGE_SCALE as DEBUG_IMAGE_SCALE, get_debug_writer
+from frame_change import FrameChangeDetector
+from frame_context import FrameContext
+from layout_profile import get_layout
+from template_registry import get_template_registry
+from roi_learner import RoiLearner
+from screen_capture import ScreenCapture, get_capture_pipeline
+from session_stats import SESSION_LOG_PATH, SessionRecorder
+from skill_scanner import SkillPanelScanner, SkillState
+from stage_timer import get_stage_timer, span, timed
+from screen_wait import (
+    all_of,
+    any_of,
+    screen_changed,
+    screen_settled,
+    template_visible,
+    wait_until,
+)
+from phase_classifier import PhaseClassifier, get_worker_pool
+from phase_transition import PHASE_TRANSITION_PATH, PhaseTransitionModel
+from preview import PreviewWindow
+from template_matching import (
+    add_match_listener,
+    configure_pyramid_matching,
+    get_template_image_position,
+    get_template_match,
+    set_roi_learner,
+)
+from touch_controller import SERIAL_PORT, AsyncTouchController
 
 # キャプチャの設定
 WINDOW_NAME = "rpiplay"
 WINDOW_ID = "0x3a00002"
 WINDOW_WIDTH = 1728#2532
 WINDOW_HEIGHT = 798#1170
-IMAGE_WIDTH = 1823  # 960
-IMAGE_HEIGHT = 842  # 540
 
-# カードをタップする位置
-ARQ_CARD_TAP_POSITION = np.array(
-    [[1525, 552], [1211, 552], [911, 552], [615, 552], [310, 552]]
-)  # Ars, Quick, Busterカードのタップする位置
+# 画面のレイアウト（layout_profile.py参照）
+# タップ位置・ROIは正規化座標で定義したレイアウトを、起動時に一度だけ処理する画像の大きさに変換する
+# (set_layout参照; 起動時に--layoutで変更できる)
+LAYOUT_PROFILE = "iphone_x"
+
+NP_BRIGHTNESS_THRESHOLD = 6  # 明度の閾値; 閾値以上のpixelはNPゲージのバーが伸びている
+# オーバーチャージ中(100%以上)のバーの色相の範囲(OpenCVのHSV; 赤は0と179をまたぐ)
+# 満タンの通常のバー（オレンジ）の色相は19前後なので含めない
+NP_OVERCHARGE_HUE_RANGES = [(0, 10), (170, 179)]
+NP_OVERCHARGE_MIN_SATURATION = 100  # 彩度がこれ未満のpixelはオーバーチャージの色とみなさない
+
+CARD_PAIRS = list(itertools.combinations(range(5), 2))  # 2枚のカードの組
+CARD_GROUPS = np.array(list(itertools.combinations(range(5), 3)))  # 3枚のカードの組
+
+# 色によるカード種別の判定（get_card_type_by_color参照）
+# 色相の範囲はpict/のarts, quick, busterの画像の色相の分布に合わせている
+# （カードの枠の金色(15～22前後)はどの範囲にも含めない）
+CARD_HUE_RANGES = [
+    [(85, 120)],  # Arts: 青
+    [(35, 65)],  # Quick: 緑
+    [(0, 12), (165, 180)],  # Buster: 赤
+]  # カード種別ごとの色相の範囲(OpenCVのHSV; 0～179)
+CARD_COLOR_MIN_SATURATION = 100  # 彩度がこれ未満のpixelは色の判定に使わない
+CARD_COLOR_MIN_VALUE = 80  # 明度がこれ未満のpixelは色の判定に使わない
+CARD_COLOR_MIN_COVERAGE = 0.05  # 判定に使えるpixelの割合がこれ未満なら判定しない
+CARD_COLOR_CONFIDENCE = 0.7  # 確信度がこれ未満ならテンプレートマッチングで判定し直す
+CARD_COLOR_MAX_UNCERTAIN = 2  # 色で判定できないカードがこれより多ければカード選択画面ではないとみなす
+
+# 新しい画像がキャプチャされるまで待つ時間の上限(秒)
+CAPTURE_TIMEOUT = 5
 
-NOBLE_PHANTASM_TAP_POSITION = np.array(
-    [[1186, 215], [911, 215], [647, 215]]
-)  # 宝具カードのタップする位置
+# 画面判別処理を中断するまでの回数
+MAX_ERROR_COUNT = 5000
 
-SKILL_ICON_TAP_POSITION = np.array(
-    [
-        [[885, 652], [988, 652], [1094, 652]],
-        [[512, 652], [617, 652], [721, 652]],
-        [[142, 652], [248, 652], [354, 652]],
-    ]
-)  # スキルアイコンのタップする位置
+# 画面が切り替わるまで待つ時間の上限(秒)
+NOBLE_PHANTASM_TIMEOUT = 3  # 宝具カードが選択可能になるまで
+SKILL_ANIMATION_TIMEOUT = 10  # スキル発動のアニメーションが終わるまで
+CARD_SELECT_TIMEOUT = 5  # Attackボタンを押してからカード選択画面が表示されるまで
+SUPPORTER_SELECT_TIMEOUT = 30  # サポート選択後、スキル選択画面が表示されるまで
+RESULT_TAP_TIMEOUT = 2  # リザルト画面をタップしてから画面が切り替わるまで
+END_PROCESS_TIMEOUT = 5  # 連続出撃ボタンを押してから次の画面が表示されるまで
+USE_APPLE_TIMEOUT = 3  # 果実の選択画面が切り替わるまで
+AP_RECOVERY_TIMEOUT = 15  # APを回復してからサポート選択画面が表示されるまで
+
+# 画面判別処理で先に順番に判定する、次に来る可能性が高いフェーズの数と確率の下限
+LIKELY_PHASE_COUNT = 2
+LIKELY_PHASE_MIN_PROBABILITY = 0.25
+
+# テンプレートマッチングの精度と速度のバランス（template_matching.configure_pyramid_matching参照）
+PYRAMID_LEVELS = 3  # ピラミッドの段数; 1なら縮小せずに全体を探索する
+PYRAMID_CANDIDATES = 3  # 原寸で詳細に探索する候補数
+
+# プレビューの表示回数の上限(回/秒)
+PREVIEW_FPS = 10
+
+
+##### レイアウトの設定 #####
+# レイアウトを処理する画像の大きさ(幅, 高さ)に変換し、タップ位置・ROIを設定する
+# 処理する画像の大きさはキャプチャした大きさのまま（キャプチャ後のリサイズは行わない）
+def set_layout(profile_name, working_size):
+    global layout, transform, WORKING_WIDTH, WORKING_HEIGHT
+    global ARQ_CARD_TAP_POSITION, NOBLE_PHANTASM_TAP_POSITION, SKILL_ICON_TAP_POSITION
+    global SKILL_LETTER_POSITION, SKILL_ICON_TOP_FRAME
+    global NP_POSITION, NP_GAUGE_MARGIN, CHARACTOR_POSITION, CARD_POSITION
+    global SUPPORTER_TAP_POSITION, SKILL_TARGET_TAP_POSITION, RESULT_TAP_POSITION
+    global APPLE_TAP_POSITION, APPLE_DECIDE_TAP_POSITION
+    global skill_scanner
+
+    # 足りない座標・ROIがあれば、現在のレイアウトを変えずにKeyErrorを送出する
+    compiled = get_layout(profile_name, working_size)
+    compiled.require(
+        points=[
+            "arq_card_tap",
+            "noble_phantasm_tap",
+            "skill_icon_tap",
+            "skill_target_tap",
+            "supporter_tap",
+            "result_tap",
+            "apple_tap",
+            "apple_decide_tap",
+        ],
+        rois=["skill_letter", "skill_icon_top_frame", "np_gauge", "charactor", "card"],
+        lengths=["np_gauge_margin"],
+    )
+    layout = compiled
+    WORKING_WIDTH, WORKING_HEIGHT = working_size
+    transform = layout.transform  # レイアウトの座標と処理する画像の座標の変換
 
-SKILL_LETTER_POSITION = [
-    [
-        {"top_x": 847, "top_y": 677, "bottom_x": 882, "bottom_y": 694},
-        {"top_x": 950, "top_y": 677, "bottom_x": 985, "bottom_y": 694},
-        {"top_x": 1053, "top_y": 677, "bottom_x": 1088, "bottom_y": 694},
-    ],
-    [
-        {"top_x": 476, "top_y": 677, "bottom_x": 510, "bottom_y": 694},
-        {"top_x": 579, "top_y": 677, "bottom_x": 613, "bottom_y": 694},
-        {"top_x": 682, "top_y": 677, "bottom_x": 716, "bottom_y": 694},
-    ],
-    [
-        {"top_x": 104, "top_y": 677, "bottom_x": 139, "bottom_y": 694},
-        {"top_x": 207, "top_y": 677, "bottom_x": 242, "bottom_y": 694},
-        {"top_x": 310, "top_y": 677, "bottom_x": 345, "bottom_y": 694},
-    ],
-]  # スキルアイコンの"あと"の文字が表示される位置 → この文字が表示されていればスキル使用不可能として判定する
+    # カードをタップする位置
+    ARQ_CARD_TAP_POSITION = layout.points["arq_card_tap"]  # Ars, Quick, Busterカード
+    NOBLE_PHANTASM_TAP_POSITION = layout.points["noble_phantasm_tap"]  # 宝具カード
 
-SKILL_ICON_TOP_FRAME = [
-    [
-        {"top_x": 854, "top_y": 614, "bottom_x": 922, "bottom_y": 616},
-        {"top_x": 957, "top_y": 614, "bottom_x": 1025, "bottom_y": 616},
-        {"top_x": 1060, "top_y": 614, "bottom_x": 1128, "bottom_y": 616},
-    ],
-    [
-        {"top_x": 482, "top_y": 614, "bottom_x": 551, "bottom_y": 616},
-        {"top_x": 585, "top_y": 614, "bottom_x": 654, "bottom_y": 616},
-        {"top_x": 688, "top_y": 614, "bottom_x": 757, "bottom_y": 616},
-    ],
-    [
-        {"top_x": 111, "top_y": 614, "bottom_x": 179, "bottom_y": 616},
-        {"top_x": 214, "top_y": 614, "bottom_x": 282, "bottom_y": 616},
-        {"top_x": 317, "top_y": 614, "bottom_x": 385, "bottom_y": 616},
-    ],
-]  # スキルアイコン上部の白いライン → このラインが見えていればスキルアイコンが存在していると判定する
+    # スキルアイコンのタップする位置
+    SKILL_ICON_TAP_POSITION = layout.points["skill_icon_tap"]
+    # スキルアイコンの"あと"の文字が表示される位置 → この文字が表示されていればスキル使用不可能として判定する
+    SKILL_LETTER_POSITION = layout.rois["skill_letter"]
+    # スキルアイコン上部の白いライン → このラインが見えていればスキルアイコンが存在していると判定する
+    SKILL_ICON_TOP_FRAME = layout.rois["skill_icon_top_frame"]
+
+    NP_POSITION = layout.rois["np_gauge"]  # NPゲージの座標
+    # NPゲージの左端の暗くなる部分の幅
+    NP_GAUGE_MARGIN = layout.lengths["np_gauge_margin"]
+
+    # 各カードのキャラクタの認識範囲（BRAVE CHAINの判定用）
+    CHARACTOR_POSITION = layout.rois["charactor"]
+    # 各カードの認識範囲（カード種別の判定用）
+    CARD_POSITION = layout.rois["card"]
+
+    # 各画面でタップする位置
+    SUPPORTER_TAP_POSITION = layout.points["supporter_tap"]  # サポートの一番上のキャラクタ
+    # スキルの対象サーヴァント（真ん中, 2人しかいないときの左側, 右側）
+    SKILL_TARGET_TAP_POSITION = layout.points["skill_target_tap"]
+    RESULT_TAP_POSITION = layout.points["result_tap"]  # リザルト画面の"次へ"ボタン
+    APPLE_TAP_POSITION = layout.points["apple_tap"]  # 果実の選択画面
+    APPLE_DECIDE_TAP_POSITION = layout.points["apple_decide_tap"]  # 果実の"決定"ボタン
+
+    # スキルの状態を判定する（skill_scanner.py参照）
+    skill_scanner = SkillPanelScanner(SKILL_LETTER_POSITION, SKILL_ICON_TOP_FRAME)
 
-# 画面判別処理を中断するまでの回数
-MAX_ERROR_COUNT = 5000
+
+set_layout(LAYOUT_PROFILE, (WINDOW_WIDTH, WINDOW_HEIGHT))
 
 # カード種別
 class Card(IntEnum):
@@ -83,6 +171,13 @@ class Card(IntEnum):
     BUSTER = 2
 
 
+# 色相 → カード種別の対応表（どのカード種別の範囲にも入らない色相は-1）
+CARD_HUE_TABLE = np.full(180, Card.UNKNOWN, dtype=np.int64)
+for card_index, hue_ranges in enumerate(CARD_HUE_RANGES):
+    for hue_min, hue_max in hue_ranges:
+        CARD_HUE_TABLE[hue_min:hue_max] = card_index
+
+
 # 画面種別
 class Phase(IntEnum):
     OTHER = -1  # その他（判別不能の場合）
@@ -94,280 +189,230 @@ class Phase(IntEnum):
     USE_APPLE = 5  # 連続出撃の選択画面
 
 
-class TouchController:
-    def __init__(self):
-        self.ser = serial.Serial("/dev/ttyUSB0", 115200, timeout=None)
-
-    def __del__(self):
-        self.ser.close()
-
-    def send_message(self, message):
-        self.ser.write(bytes(message, "UTF-8"))
-        time.sleep(0.2)
-
-    def home(self):
-        self.send_message("HOME\n")
-
-    def tap(self):
-        self.send_message("TAP\n")
-
-    def move(self, destination_image_coordinate):
-        x, y = destination_image_coordinate
-        message = "MOVE," + str(x) + "," + str(y) + "\n"
-        self.send_message(message)
-        time.sleep(0.1)
-
-
-class ScreenCapture(threading.Thread):
-    def __init__(self):
-        super(ScreenCapture, self).__init__()
-
-        # キャプチャの初期設定
-        self.video_source = cv2.VideoCapture(
-            f"ximagesrc xname={WINDOW_NAME} ! videoconvert ! videoscale ! video/x-raw,width={WINDOW_WIDTH},height={WINDOW_HEIGHT} ! appsink"
-            #f"ximagesrc xid={WINDOW_ID} ! videoconvert ! videoscale ! video/x-raw,width={WINDOW_WIDTH},height={WINDOW_HEIGHT} ! appsink"
-        )
-
-    def stop(self):
-        self.stop = True
-
-    def run(self):
-        self.stop = False
-
-        while not self.stop:
-            ret, image_original = self.video_source.read()
-
-            if ret:
-                # キャプチャした画像をリサイズして更新
-                self.image_color = cv2.resize(
-                    image_original, (IMAGE_WIDTH, IMAGE_HEIGHT)
-                )
-
-                # キャプチャした画像を表示
-                cv2.imshow("fgo_auto", self.image_color)
-                cv2.waitKey(1)
-
-    def get_image(self):
-        return self.image_color
-
-
 ##### NPゲージ量の取得 #####
+# 3本のゲージを1つの配列に並べ、列ごとの明度の平均から一括でゲージの長さを求める
+# ゲージが満タンの場合は、バーの色がオーバーチャージの色に変わっている長さから100%を超えた量を求める
 # 戻り値
-#   NPゲージ量を表す配列(ndarray)
-def get_np_gauge(image_color, debug_mode=False):
-    NP_POSITION = [
-        {"top_x": 988, "top_y": 769, "bottom_x": 1144, "bottom_y": 775},
-        {"top_x": 617, "top_y": 769, "bottom_x": 773, "bottom_y": 775},
-        {"top_x": 246, "top_y": 769, "bottom_x": 402, "bottom_y": 775},
-    ]  # NPゲージの座標
-    NP_BRIGHTNESS_THRESHOLD = 6  # 明度の閾値; 閾値以上のpixelはNPゲージのバーが伸びている
-    np_gauge = np.array([0, 0, 0])
-
-    if debug_mode:
-        fig = plt.figure()
-
-    # キャプチャ画像のグレースケール化
-    image_gray = cv2.cvtColor(image_color, cv2.COLOR_BGR2GRAY)
-
-    # NPゲージ量を求める
-    for i in range(3):
-        img_np = image_gray[
-            NP_POSITION[i]["top_y"] : NP_POSITION[i]["bottom_y"],
-            NP_POSITION[i]["top_x"] : NP_POSITION[i]["bottom_x"],
+#   NPゲージ量(%)を表す配列(ndarray; float)
+@timed("get_np_gauge")
+def get_np_gauge(frame, debug_mode=False):
+    # ゲージの大きさを揃えて並べる
+    height = min(roi["bottom_y"] - roi["top_y"] for roi in NP_POSITION)
+    width = min(roi["bottom_x"] - roi["top_x"] for roi in NP_POSITION)
+    img_np = np.stack(
+        [
+            frame.crop(NP_POSITION[i], "np_gauge_" + str(i))[:height, :width]
+            for i in range(3)
         ]
-
-        # 明度の平均値を求める
-        lightness = np.mean(img_np, axis=0)
-
-        # ゲージの画像幅が158pixelなので、閾値を下回ったindex値を元にNPゲージ量を算出する
-        gauge_length = NP_POSITION[i]["bottom_x"] - NP_POSITION[i]["top_x"]
-        for j in range(10, len(lightness)):  # 端部は暗くなるので、開始点近傍は無視
-            # print(lightness[j])
-            if lightness[j] <= NP_BRIGHTNESS_THRESHOLD:
-                f_np_max = False
-                np_gauge[i] = int(100 * j / 158)
-                break
-            elif j == len(lightness) - 1 and lightness[j] > NP_BRIGHTNESS_THRESHOLD:
-                # 最後まで閾値以下にならなければNPゲージ量MAX
-                np_gauge[i] = 100
-
-        if debug_mode:
-            # 　NPゲージ部を抜き出した画像を保存
-            cv2.imwrite("./debug/np_gauge_" + str(i + 1) + ".png", img_np)
-
-            # 明度の平均値をプロット
-            plt.plot(lightness, label="NP gauge " + str(i + 1))
-            plt.legend(
-                bbox_to_anchor=(1, 1), loc="upper right", borderaxespad=0, fontsize=18
-            )
+    )  # 3 x 高さ x 幅
+
+    # 列ごとの明度の平均値を求める
+    lightness = np.mean(img_np, axis=1)  # 3 x 幅
+
+    # 閾値以下になった最初の列までがバーの長さ（端部は暗くなるので、開始点近傍は無視）
+    # 最後まで閾値以下にならなければNPゲージ量MAX
+    dark = lightness <= NP_BRIGHTNESS_THRESHOLD
+    dark[:, :NP_GAUGE_MARGIN] = False
+    full = ~np.any(dark, axis=1)
+    np_gauge = np.where(full, 100.0, 100.0 * np.argmax(dark, axis=1) / width)
+
+    # 満タンのゲージがあれば、オーバーチャージの色に変わっている列の長さを100%に加える
+    if np.any(full):
+        img_color = np.concatenate(
+            [
+                frame.crop(NP_POSITION[i], "np_gauge_" + str(i), "color")[
+                    :height, :width
+                ]
+                for i in range(3)
+            ]
+        )
+        hsv = cv2.cvtColor(img_color, cv2.COLOR_BGR2HSV).reshape(3, height, width, 3)
+        hue = hsv[:, :, :, 0]
+        in_range = np.zeros(hue.shape, dtype=bool)
+        for low, high in NP_OVERCHARGE_HUE_RANGES:
+            in_range |= (hue >= low) & (hue <= high)
+
+        # 色相は赤の前後で0と179に分かれるので、pixelごとに判定してから列の過半数で判定する
+        in_range &= hsv[:, :, :, 1] >= NP_OVERCHARGE_MIN_SATURATION
+        overcharged = np.mean(in_range, axis=1) >= 0.5  # 3 x 幅
+
+        # 端部を除いて左端から続くオーバーチャージの色の列の長さを求める
+        overcharged[:, :NP_GAUGE_MARGIN] = True
+        overcharge_length = np.where(
+            np.all(overcharged, axis=1), width, np.argmin(overcharged, axis=1)
+        )
+        overcharge_length = np.where(
+            overcharge_length > NP_GAUGE_MARGIN, overcharge_length, 0
+        )
+        np_gauge = np.where(full, np_gauge + 100.0 * overcharge_length / width, np_gauge)
 
     if debug_mode:
-        fig.savefig("./debug/np_gauge_lightness.png")
+        # NPゲージ部を抜き出した画像と、明度の平均値のグラフを別スレッドで保存
+        debug_writer = get_debug_writer()
+        for i in range(3):
+            debug_writer.save_image("np_gauge_" + str(i + 1), img_np[i])
+        debug_writer.save_plot(
+            "np_gauge_lightness",
+            lightness,
+            ["NP gauge " + str(i + 1) for i in range(3)],
+        )
         print(np_gauge)
 
     return np_gauge
 
 
-##### 任意画像の位置の認識 #####
-def get_template_image_position(image_color, image_name, roi=None, debug_mode=False):
-    THRESHOLD = 0.80  # 一致度の閾値; 一致度の最大値がこの閾値以上であれば、テンプレートと一致したとみなす
-    TEMPLATE_IMAGE_PATH = "./pict/" + image_name + ".png"
+##### カードのキャラクタ同士の類似度を求める #####
+# 戻り値
+#   5x5の類似度の行列(ndarray)
+#   [i, j]はカードiとカードjの類似度（対称; 対角成分は1）
+def get_card_similarity_matrix(frame):
+    # キャラクタの画像を切り抜いてリスト化
+    img_chara_list = []
+    for i in range(5):
+        img_chara_list.append(frame.crop(CHARACTOR_POSITION[i], "charactor_" + str(i)))
+
+    # 10通りのカードの組ごとに一度だけテンプレートマッチングを行う
+    similarity = np.eye(5)
+    for i, j in CARD_PAIRS:
+        # テンプレートマッチングのターゲットとテンプレートを作成
+        img_target = img_chara_list[i]
+        temp_h, temp_w = img_chara_list[j].shape
+        img_template = img_chara_list[j][
+            int(temp_h * 0.2) : int(temp_h * 0.8),
+            int(temp_w * 0.2) : int(temp_w * 0.8),
+        ]
 
-    # キャプチャ画像のグレースケール化
-    image_gray = cv2.cvtColor(image_color, cv2.COLOR_BGR2GRAY)
+        # 相関係数の最大値を類似度のスコアとして記録
+        ret = cv2.matchTemplate(img_target, img_template, cv2.TM_CCOEFF_NORMED)
+        _, max_coeff, _, _ = cv2.minMaxLoc(ret)
+        similarity[i, j] = similarity[j, i] = max_coeff
 
-    # ROIの設定
-    if roi is not None:
-        image_gray = image_gray[
-            roi["top_y"] : roi["bottom_y"], roi["top_x"] : roi["bottom_x"]
-        ]
+    return similarity
 
-    # テンプレートの画像をグレースケールで読み込む
-    template = cv2.imread(TEMPLATE_IMAGE_PATH, 0)
 
-    # テンプレートマッチング処理
-    result = cv2.matchTemplate(image_gray, template, cv2.TM_CCOEFF_NORMED)
+##### 3枚のカードの組に含まれる2枚のカードの組の類似度 #####
+# 戻り値
+#   CARD_GROUPSの各組の類似度(ndarray; 10x3)
+def get_card_pair_score(similarity):
+    return similarity[CARD_GROUPS[:, [0, 0, 1]], CARD_GROUPS[:, [1, 2, 2]]]
 
-    # 一致度の最大値と位置を取得
-    _, max_val, _, max_loc = cv2.minMaxLoc(result)
-    top_x, top_y = max_loc
-    if roi is not None:
-        top_x += roi["top_x"]
-        top_y += roi["top_y"]
-    width, height = template.shape[::-1]
 
-    if debug_mode:
-        result = image_color.copy()
-        # 検出領域を四角で囲む
-        cv2.rectangle(
-            result, (top_x, top_y), (top_x + width, top_y + height), (255, 0, 0), 2
-        )
+##### 3枚のカードの組のスコアを求める #####
+# 組のスコアは、組に含まれる3つのカードの組の類似度の最小値とする
+# 戻り値
+#   CARD_GROUPSの各組のスコア(ndarray; 10)
+def get_card_group_score(similarity):
+    return np.min(get_card_pair_score(similarity), axis=1)
 
-        # 結果を出力
-        cv2.imwrite("./debug/" + image_name + ".jpg", result)
-        print(
-            "image_name:",
-            image_name,
-            "    max_val:",
-            max_val,
-            "    max_loc:",
-            (top_x, top_y),
-        )
 
-    # 一致度が閾値以上：一致するエリアの中心座標を返す
-    # 一致度が閾値以下：Noneを返す
-    if max_val > THRESHOLD:
-        # タップの位置を求める
-        tap_position = np.array([top_x + int(width / 2), top_y + int(height / 2)])
-        return tap_position
-    else:
-        return None
+##### 3枚のカードの組をBRAVE CHAINに近い順に並べる #####
+# BRAVE CHAINができない場合に、BRAVE CHAINに近い組を選ぶために使う
+# 同じサーヴァントのカードが2枚含まれる組が上位になるよう、3つのカードの組の類似度の平均で並べる
+# 戻り値
+#   3枚のカードの組(ndarray; 10x3), 組の類似度の平均(ndarray; 10)
+#   平均の高い順（同じ平均ならitertools.combinationsの順）
+def get_card_groups(similarity):
+    group_score = np.mean(get_card_pair_score(similarity), axis=1)
+    order = np.argsort(-group_score, kind="stable")
+    return CARD_GROUPS[order], group_score[order]
 
 
 ##### BRAVE CHAINができる組を取得する #####
-def get_brave_chain_combination(image_color, debug_mode=False):
+# 戻り値
+#   BRAVE CHAINができる3枚のカードの組(tuple; できなければNone),
+#   BRAVE CHAINに最も近い3枚のカードの組(tuple; BRAVE CHAINができない場合に選ぶ組)
+@timed("get_brave_chain_combination")
+def get_brave_chain_combination(frame, debug_mode=False):
     THRESHOLD = 0.9  # 一致度の閾値; 一致度の最大値がこの閾値以上であれば、比較対象の画像と一致しているとみなす
-    CHARACTOR_POSITION = [
-        {"top_x": 802, "top_y": 300, "bottom_x": 933, "bottom_y": 380},
-        {"top_x": 607, "top_y": 300, "bottom_x": 738, "bottom_y": 380},
-        {"top_x": 414, "top_y": 300, "bottom_x": 545, "bottom_y": 380},
-        {"top_x": 224, "top_y": 300, "bottom_x": 355, "bottom_y": 380},
-        {"top_x": 33, "top_y": 300, "bottom_x": 164, "bottom_y": 380},
-    ]  # 各カードの認識範囲
 
-    # キャプチャ画像のグレースケール化
-    image_gray = cv2.cvtColor(image_color, cv2.COLOR_BGR2GRAY)
+    similarity = get_card_similarity_matrix(frame)
 
-    # キャラクタの画像を切り抜いてリスト化
-    img_chara_list = []
-    for i in range(5):
-        img_chara_list.append(
-            image_gray[
-                CHARACTOR_POSITION[i]["top_y"] : CHARACTOR_POSITION[i]["bottom_y"],
-                CHARACTOR_POSITION[i]["top_x"] : CHARACTOR_POSITION[i]["bottom_x"],
-            ]
-        )
+    # 類似度のスコアがすべて閾値より高い組み合わせがあればBRAVE CHAINできる組とする
+    valid = get_card_group_score(similarity) > THRESHOLD
+    chain_combination = None
+    if np.any(valid):
+        chain_combination = tuple(int(i) for i in CARD_GROUPS[np.argmax(valid)])
 
-    # カード3枚を比較する組み合わせパターンを作成する
-    index_list = (0, 1, 2, 3, 4)
-    combination_list = list(itertools.combinations(index_list, 3))
+    # BRAVE CHAINができない場合に選ぶ組
+    groups, group_score = get_card_groups(similarity)
+    near_combination = tuple(int(i) for i in groups[0])
 
-    # 各組み合わせパターンごとに類似度を計算
-    chain_combination = None
-    for combination in combination_list:
-        similarity_score = np.array([])
-        for c in list(itertools.combinations(combination, 2)):
-            # テンプレートマッチングのターゲットとテンプレートを作成
-            img_target = img_chara_list[c[0]]
-            temp_w, temp_h = img_chara_list[c[1]].shape[::-1]
-            img_template = img_chara_list[c[1]][
-                int(temp_h * 0.2) : int(temp_h * 0.8),
-                int(temp_w * 0.2) : int(temp_w * 0.8),
-            ]
+    if debug_mode:
+        # 計算結果の表示
+        print(np.round(similarity, 3))
+        for group, score in zip(groups, group_score):
+            print(tuple(int(i) for i in group), round(float(score), 3))
 
-            # テンプレートマッチング処理
-            ret = cv2.matchTemplate(img_target, img_template, cv2.TM_CCOEFF_NORMED)
-            _, max_coeff, _, _ = cv2.minMaxLoc(ret)
+        # 比較に使用した画像を別スレッドで保存
+        for i in range(5):
+            get_debug_writer().save_image(
+                "img_chara_list[" + str(i) + "]",
+                frame.crop(CHARACTOR_POSITION[i], "charactor_" + str(i)),
+            )
 
-            # 相関係数の最大値を類似度のスコアとして記録
-            similarity_score = np.append(similarity_score, max_coeff)
+    return chain_combination, near_combination
 
-        # 類似度のスコアがすべて閾値より高い組み合わせがあればBRAVE CHAINできる組として記録する
-        if np.all([similarity_score > THRESHOLD]):
-            chain_combination = combination
 
-            # デバッグモードでなければBRAVE CHAINできる組を見つけた段階で処理を打ち切る
-            if not debug_mode:
-                break
+##### 色からカード種別を判定する #####
+# 5枚のカードの認識範囲をまとめてHSVに変換し、種別ごとの色相の範囲に入るpixelの数を一括で数える
+# 確信度は色の判定に使えたpixelのうち、最も多い種別のpixelの割合
+# 戻り値
+#   カード種別(ndarray), 確信度(ndarray)
+def get_card_type_by_color(frame):
+    # 認識範囲の大きさを揃えて縦に並べ、1回でHSVに変換する
+    height = min(roi["bottom_y"] - roi["top_y"] for roi in CARD_POSITION)
+    width = min(roi["bottom_x"] - roi["top_x"] for roi in CARD_POSITION)
+    img_cards = np.concatenate(
+        [
+            frame.crop(CARD_POSITION[i], "card_" + str(i), "color")[:height, :width]
+            for i in range(5)
+        ]
+    )
+    hsv = cv2.cvtColor(img_cards, cv2.COLOR_BGR2HSV).reshape(5, height * width, 3)
 
-        if debug_mode:
-            # 計算結果の表示
-            print(combination, similarity_score, np.all([similarity_score > THRESHOLD]))
+    # 彩度・明度が十分なpixelの色相をカード種別に変換し、カードごとに数える
+    colored = (hsv[:, :, 1] >= CARD_COLOR_MIN_SATURATION) & (
+        hsv[:, :, 2] >= CARD_COLOR_MIN_VALUE
+    )
+    hue_class = np.where(colored, CARD_HUE_TABLE[hsv[:, :, 0]], Card.UNKNOWN)
+    counts = np.stack(
+        [np.count_nonzero(hue_class == card_index, axis=1) for card_index in range(3)],
+        axis=1,
+    )  # 5x3: カードごとの各種別のpixel数
 
-            # 比較に使用した画像を保存
-            for i in range(5):
-                cv2.imwrite(
-                    "./debug/img_chara_list[" + str(i) + "].png", img_chara_list[i]
-                )
+    total = np.sum(counts, axis=1)
+    card_type = np.argmax(counts, axis=1)
+    confidence = np.max(counts, axis=1) / np.maximum(total, 1)
 
-    return chain_combination
+    # 色の判定に使えるpixelが少なすぎる場合は判定しない
+    covered = total >= CARD_COLOR_MIN_COVERAGE * height * width
+    card_type = np.where(covered, card_type, Card.UNKNOWN)
+    confidence = np.where(covered, confidence, 0.0)
 
+    return card_type, confidence
 
-##### カード種別を取得する ####
-def get_card_type(image_color, debug_mode=False):
+
+##### テンプレートマッチングでカード種別を判定する #####
+# card_indices: 判定するカードの番号のリスト
+# 戻り値
+#   カード種別(ndarray), 一致度(ndarray)（判定していないカードはUNKNOWN, 0）
+def get_card_type_by_template(frame, card_indices=range(5)):
     THRESHOLD = 0.80  # 一致度の閾値; 一致度の最大値がこの閾値以上であれば、テンプレートと一致しているとみなす
-    ARTS_IMAGE_PATH = "./pict/arts.png"
-    QUICK_IMAGE_PATH = "./pict/quick.png"
-    BUSTER_IMAGE_PATH = "./pict/buster.png"
-    CARD_POSITION = [
-        {"top_x": 1420, "top_y": 450, "bottom_x": 1600, "bottom_y": 700},
-        {"top_x": 1120, "top_y": 450, "bottom_x": 1300, "bottom_y": 700},
-        {"top_x": 820, "top_y": 450, "bottom_x": 1000, "bottom_y": 700},
-        {"top_x": 520, "top_y": 450, "bottom_x": 700, "bottom_y": 700},
-        {"top_x": 220, "top_y": 450, "bottom_x": 400, "bottom_y": 700},
-    ]  # 各カードの認識範囲
     card_type = np.full(5, Card.UNKNOWN)
+    card_score = np.zeros(5)  # 判別したカード種別のテンプレートとの一致度
+
+    # 読み込み済みのテンプレートを取得
+    templates = get_template_registry()
+    template = [
+        templates.get("arts"),
+        templates.get("quick"),
+        templates.get("buster"),
+    ]
 
-    # テンプレートの読み込み
-    template = np.array(
-        [
-            cv2.imread(ARTS_IMAGE_PATH, 0),
-            cv2.imread(QUICK_IMAGE_PATH, 0),
-            cv2.imread(BUSTER_IMAGE_PATH, 0),
-        ]
-    )
-
-    # キャプチャ画像のグレースケール化
-    image_gray = cv2.cvtColor(image_color, cv2.COLOR_BGR2GRAY)
-
-    for i in range(5):
-        img_card = image_gray[
-            CARD_POSITION[i]["top_y"] : CARD_POSITION[i]["bottom_y"],
-            CARD_POSITION[i]["top_x"] : CARD_POSITION[i]["bottom_x"],
-        ]
+    for i in card_indices:
+        img_card = frame.crop(CARD_POSITION[i], "card_" + str(i))
 
         # テンプレートマッチング処理
-        card_dict = {"arts": 0, "quick": 1, "buster": 2}
         for card_index in range(3):
             result = cv2.matchTemplate(
                 img_card, template[card_index], cv2.TM_CCOEFF_NORMED
@@ -375,10 +420,34 @@ def get_card_type(image_color, debug_mode=False):
             _, max_coeff, _, _ = cv2.minMaxLoc(result)
             if max_coeff > THRESHOLD:
                 card_type[i] = card_index
+                card_score[i] = max_coeff
                 break
 
+    return card_type, card_score
+
+
+##### カード種別と一致度を取得する ####
+# 色で判定し、複数の種別の色が混ざっていて確信度が低いカードだけテンプレートマッチングで判定し直す
+# 色で判定できないカードが多すぎる場合はカード選択画面ではないとみなし、
+# テンプレートマッチングをせずにすべてUNKNOWNとする
+def get_card_type_and_score(frame, debug_mode=False):
+    card_type, card_score = get_card_type_by_color(frame)
+
+    uncertain = np.where(card_score < CARD_COLOR_CONFIDENCE)[0]
+    if len(uncertain) > CARD_COLOR_MAX_UNCERTAIN:
+        card_type = np.full(5, Card.UNKNOWN)
+        card_score = np.zeros(5)
+        uncertain = np.array([], dtype=np.int64)
+
+    # 色の判定に使えるpixelが少ないカードはテンプレートマッチングでも判定しない
+    uncertain = uncertain[card_type[uncertain] != Card.UNKNOWN]
+    if len(uncertain) > 0:
+        template_type, template_score = get_card_type_by_template(frame, uncertain)
+        card_type[uncertain] = template_type[uncertain]
+        card_score[uncertain] = template_score[uncertain]
+
     if debug_mode:
-        print(card_type)
+        print(card_type, np.round(card_score, 3), "uncertain:", uncertain)
         print(
             "?:",
             np.count_nonzero(card_type == Card.UNKNOWN),
@@ -389,6 +458,13 @@ def get_card_type(image_color, debug_mode=False):
             ", B:",
             np.count_nonzero(card_type == Card.BUSTER),
         )
+    return card_type, card_score
+
+
+##### カード種別を取得する ####
+@timed("get_card_type")
+def get_card_type(frame, debug_mode=False):
+    card_type, _ = get_card_type_and_score(frame, debug_mode)
     return card_type
 
 
@@ -416,26 +492,51 @@ def get_aqb_chain_combination(card_type, debug_mode=False):
     return (None, None)
 
 
+##### カード選択画面の解析 #####
+# カード種別・NPゲージ量・BRAVE CHAINができる組の判定を、画像認識のスレッドプールで同時に始める
+# Attackボタンをタップした後の待機中に始めておけば、タップ操作の完了を待つ間に解析が進む
+# 各判定結果はFutureで受け取る（result()で結果を得る）
+class CardSelectAnalysis:
+    def __init__(self, frame):
+        pool = get_worker_pool()
+        self.frame = frame
+        self.card_type = pool.submit(get_card_type, frame)
+        self.np_gauge = pool.submit(get_np_gauge, frame)
+        self.brave_chain = pool.submit(get_brave_chain_combination, frame)
+
+
 # カード選択画面での行動を決める
-def select_card(np_gauge, card_type):
+# analysis: カード選択画面の解析結果（CardSelectAnalysis）
+def select_card(device, analysis):
+    tc, sc = device.tc, device.sc
+    np_gauge = analysis.np_gauge.result()
+    card_type = analysis.card_type.result()
+
     # カード選択画面であることが確定したら下記の優先順で戦略を取る
     # 1. 宝具使用
     # 2. Arts, Quick, Busterチェイン使用
     # 3. Braveチェイン使用
-    # 4. ランダム選択
+    # 4. Braveチェインに近い組を選択
 
     ### 1. 宝具を使用可否を検証 ###
     # NPゲージが100%以上のものがあれば宝具を使用する
+    # オーバーチャージしているものから順に使用する
     noble_phantasm_list = np.where(np_gauge >= 100)[0]
+    noble_phantasm_list = noble_phantasm_list[
+        np.argsort(-np_gauge[noble_phantasm_list], kind="stable")
+    ]
     if len(noble_phantasm_list) > 0:
         ### 1. 宝具使用 ###
         print("        宝具を使用します")
         # 宝具カードを選択する
-        time.sleep(1)  # 宝具カードが選択可能になるまでのウェイト
+        # 宝具カードが選択可能になるまで待つ
+        wait_until(sc, screen_settled(), NOBLE_PHANTASM_TIMEOUT)
         for i in noble_phantasm_list:
             print("            宝具カード" + str(i) + "を選択")
-            tc.move(NOBLE_PHANTASM_TAP_POSITION[i])
-            tc.tap()
+        tc.tap_positions(NOBLE_PHANTASM_TAP_POSITION[noble_phantasm_list])
+        device.session_recorder.record_card_strategy(
+            "noble_phantasm", len(noble_phantasm_list)
+        )
 
         """
         # 残りはランダムに通常カードを選択する
@@ -451,8 +552,7 @@ def select_card(np_gauge, card_type):
         # 通常カードは全部タップする（宝具封印対策）
         for i in range(5):
             print("            通常カード" + str(i) + "を選択")
-            tc.move(ARQ_CARD_TAP_POSITION[i])
-            tc.tap()
+        tc.tap_positions(ARQ_CARD_TAP_POSITION)
     else:
         ### 2. Arts, Quick, Busterチェイン使用を検討 ###
         chain_type, combination = get_aqb_chain_combination(card_type)
@@ -462,172 +562,233 @@ def select_card(np_gauge, card_type):
             print("        " + chain_name[chain_type] + "チェインを使用します")
             for i in combination:
                 print("            通常カード" + str(i) + "を選択")
-                tc.move(ARQ_CARD_TAP_POSITION[i])
-                tc.tap()
+            tc.tap_positions(ARQ_CARD_TAP_POSITION[list(combination)])
+            device.session_recorder.record_card_strategy(
+                chain_name[chain_type].lower()
+            )
         else:
             ### 3. Braveチェイン使用を検討 ###
-            combination = get_brave_chain_combination(image_color)
+            combination, near_combination = analysis.brave_chain.result()
             if combination is not None:
                 ### 3. Braveチェイン使用 ###
                 print("        Braveチェインを使用します")
                 for i in combination:
                     print("            通常カード" + str(i) + "を選択")
-                    tc.move(ARQ_CARD_TAP_POSITION[i])
-                    tc.tap()
+                tc.tap_positions(ARQ_CARD_TAP_POSITION[list(combination)])
+                device.session_recorder.record_card_strategy("brave")
             else:
-                ### 4. ランダム選択 ###
-                print("        通常カードをランダム選択します")
-                normal_card_list = random.sample(list(range(5)), 3)
-                for i in sorted(normal_card_list):
+                ### 4. Braveチェインに近い組を選択 ###
+                # 同じサーヴァントのカードが最も揃っている組を選ぶ
+                print("        Braveチェインに近い組を選択します")
+                for i in near_combination:
                     print("            通常カード" + str(i) + "を選択")
-                    tc.move(ARQ_CARD_TAP_POSITION[i])
-                    tc.tap()
+                tc.tap_positions(ARQ_CARD_TAP_POSITION[list(near_combination)])
+                device.session_recorder.record_card_strategy("near_brave")
 
 
-# スキルアイコンが存在するかを判定する
-def check_skill_icon_existence(image_color, roi=None):
-    THRESHOLD = 200  # 平均輝度の閾値; 平均輝度がこの閾値以上であれば、スキルアイコンが存在しているとみなす
+# 利用可能なスキルを見つけて発動する
+# 1回の判定で使用可能なスキルをすべて洗い出し、順番に続けて発動する
+# 戻り値
+#   これ以上使えるスキルがなければTrue（スキルの発動で新たに使えるようになったスキルがあればFalse）
+@timed("use_available_skills")
+def use_available_skills(device, frame, debug_mode=False):
+    tc, sc = device.tc, device.sc
 
-    # キャプチャ画像のグレースケール化
-    image_gray = cv2.cvtColor(image_color, cv2.COLOR_BGR2GRAY)
+    # 9個のスキルの状態を一度に判定し、使用可能なスキルを発動する順に並べる
+    skill_state = skill_scanner.scan(frame)
+    if debug_mode:
+        print(skill_state)
 
-    # ROIの設定
-    if roi is not None:
-        image_gray = image_gray[
-            roi["top_y"] : roi["bottom_y"], roi["top_x"] : roi["bottom_x"]
-        ]
+    planned_skills = []
+    for i in range(3):
+        for j in range(3):
+            # スキルアイコンの存在が確認できた上、"あと"の文字が見つからなければ、スキル使用可能
+            if skill_state[i][j] == SkillState.READY:
+                planned_skills.append((i, j))
+            elif skill_state[i][j] == SkillState.ABSENT:
+                print("サーヴァント", i + 1, "の第", j + 1, "スキルのアイコンが見つかりません")
+
+    for i, j in planned_skills:
+        print("サーヴァント", i + 1, "の第", j + 1, "スキルを使用します")
+        # cv2.imwrite("./debug/capture.png", frame.color)
+        with tc.batch():
+            tc.move(SKILL_ICON_TAP_POSITION[i][j])
+            tc.tap()
+            tc.move(SKILL_TARGET_TAP_POSITION[0])  # 真ん中のサーヴァントを選択
+            tc.tap()
+            tc.move(SKILL_TARGET_TAP_POSITION[1])  # 2人しかいないとき→左側のサーヴァントを選択
+            tc.tap()
+            tc.move(SKILL_TARGET_TAP_POSITION[2])  # 2人しかいないとき→右側のサーヴァントを選択
+            tc.tap()
+            tc.home()
 
-        mean_brightness = np.max(np.mean(image_gray, axis=1))
-        if mean_brightness > THRESHOLD:
-            return True
-        else:
+        # スキル発動のアニメーションが終わり、Attackボタンが表示されるまで待ってから次のスキルを発動する
+        wait_until(sc, screen_changed(frame), SKILL_ANIMATION_TIMEOUT)
+        next_frame = wait_until(
+            sc,
+            all_of(screen_settled(), template_visible("attack")),
+            SKILL_ANIMATION_TIMEOUT,
+        )
+        if next_frame is None:
+            # スキル選択画面に戻らなければ、残りのスキルは画面判別からやり直す
+            print("        スキル選択画面に戻りませんでした")
             return False
-    else:
-        return False
+        frame = next_frame
 
+    if len(planned_skills) == 0:
+        # これ以上使えるスキルはない判定
+        return True
 
-# 利用可能なスキルを見つけて発動する
-def use_available_skills(image_color, debug_mode=False):
+    # すべて発動し終えたら一度だけ確認する
+    # 発動したスキルで新たに使えるようになったスキルがあれば、もう一度発動する
+    skill_state = skill_scanner.scan(frame)
     for i in range(3):
         for j in range(3):
-            pos = get_template_image_position(
-                image_color, "あと", SKILL_LETTER_POSITION[i][j], debug_mode
-            )
-            if pos is None:
-
-                skill_icon_existence = check_skill_icon_existence(
-                    image_color, SKILL_ICON_TOP_FRAME[i][j]
-                )
-
-                # スキルアイコンの存在が確認できた上、"あと"の文字が見つからなければ、スキル使用可能
-                if skill_icon_existence:
-                    print("サーヴァント", i + 1, "の第", j + 1, "スキルを使用します")
-                    # cv2.imwrite("./debug/capture.png", image_color)
-                    tc.move(SKILL_ICON_TAP_POSITION[i][j])
-                    tc.tap()
-                    # time.sleep(0.2)
-                    tc.move(np.array([920, 500]))  # 真ん中のサーヴァントを選択
-                    tc.tap()
-                    # time.sleep(0.2)
-                    tc.move(np.array([550, 500]))  # 2人しかいないとき→左側のサーヴァントを選択
-                    tc.tap()
-                    # time.sleep(0.2)
-                    tc.move(np.array([1280, 500]))  # 2人しかいないとき→右側のサーヴァントを選択
-                    tc.tap()
-                    tc.home()
-                    time.sleep(2)
-
+            if skill_state[i][j] == SkillState.READY:
+                if (i, j) not in planned_skills:
                     return False
-                else:
-                    print("サーヴァント", i + 1, "の第", j + 1, "スキルのアイコンが見つかりません")
+                print("サーヴァント", i + 1, "の第", j + 1, "スキルを使用できませんでした")
 
     # これ以上使えるスキルはない判定
     return True
 
 
-def get_game_phase(image_color, debug_mode=False):
-    # 現在のフェーズがわからなければ、下記の優先順位で確認する
-    # 1. カード選択画面
-    # 2. スキル選択画面
-    # 3. リザルト画面
-    # 4. 連続出撃確認画面
-    # 5. サポート選択画面
-
-    phase = Phase.OTHER
-
-    # 1. カード選択画面か否か
-    card_type = get_card_type(image_color)
-    if np.count_nonzero(card_type == Card.UNKNOWN) <= 2:
+# カード選択画面であるかの確信度を求める
+def detect_card_select(frame):
+    card_type, card_score = get_card_type_and_score(frame)
+    identified = card_type != Card.UNKNOWN
+    if np.count_nonzero(~identified) <= 2:
         # 判別不能カードが2枚以下であればカードが識別できたものとする
-        phase = Phase.CARD_SELECT
-        print("    カード選択画面に移行します")
-
+        # 色だけで判定すると他の画面をカード選択画面と誤判定しうるので、
+        # 確信度の最も高いカード1枚をテンプレートマッチングで確かめる
+        i = int(np.argmax(card_score))
+        template_type, _ = get_card_type_by_template(frame, [i])
+        if template_type[i] != card_type[i]:
+            return None
+        return float(np.mean(card_score[identified]))
     else:
-        # 2. スキル選択画面か否か
-        # roi = {"top_x": 789, "top_y": 391, "bottom_x": 909, "bottom_y": 439}
-        # position = get_template_image_position(image_color, "attack", roi)
-        position = get_template_image_position(image_color, "attack")
-        if position is not None:
-            phase = Phase.SKILL_SELECT
-            print("    スキル選択画面に移行します")
-        else:
-            # 3. リザルト画面か否か
-            # roi = {"top_x": 0, "top_y": 0, "bottom_x": 960, "bottom_y": 270}
-            # position = get_template_image_position(image_color, "result", roi)
-            position = get_template_image_position(image_color, "result")
+        return None
+
+
+# テンプレートが見つかるかで画面を判定する関数を作成する
+def detect_template(*image_names):
+    def detector(frame):
+        confidence = None
+        for image_name in image_names:
+            position, max_val = get_template_match(frame, image_name)
             if position is not None:
-                phase = Phase.RESULT
-                print("    リザルト画面に移行します")
-            else:
-                # 4. 連続出撃確認画面か否か
-                # roi = {"top_x": 562, "top_y": 392, "bottom_x": 700, "bottom_y": 452}
-                # position = get_template_image_position(image_color, "連続出撃", roi)
-                position = get_template_image_position(image_color, "連続出撃")
-                if position is not None:
-                    phase = Phase.END_PROCESS
-                    print("    連続出撃選択画面に移行します")
-                else:
-                    # 5. サポート選択画面か否か
-                    # roi = {"top_x": 696, "top_y": 0, "bottom_x": 960, "bottom_y": 55}
-                    # position = get_template_image_position(image_color, "サポート選択", roi)
-                    position = get_template_image_position(image_color, "サポート選択")
-                    if position is not None:
-                        phase = Phase.SUPPORTER_SELECT
-                        print("    サポート選択画面に移行します")
-                    else:
-                        # 5. 黄金の果実を使用する場面か
-                        golden_apple_position = get_template_image_position(
-                            image_color, "golden_apple"
-                        )
-                        silver_apple_position = get_template_image_position(
-                            image_color, "silver_apple"
-                        )
-                        if (
-                            golden_apple_position is not None
-                            or silver_apple_position is not None
-                        ):
-                            phase = Phase.USE_APPLE
-                            print("    黄金の果実を使用します")
-                        else:
-                            # いずれでもない場合
-                            phase = Phase.OTHER
+                confidence = max(max_val, confidence or 0.0)
+        return confidence
+
+    return detector
+
+
+# 現在のフェーズがわからなければ、下記の画面判定をすべて並列に実行して確信度の最も高いものを選ぶ
+# 確信度が同じ場合は優先順位の高いものを選ぶ
+# テンプレートの探索範囲は学習済みのROIに絞り込まれる（roi_learner.py参照）
+phase_classifier = PhaseClassifier(
+    [
+        # 1. カード選択画面
+        (Phase.CARD_SELECT, detect_card_select),
+        # 2. スキル選択画面
+        (Phase.SKILL_SELECT, detect_template("attack")),
+        # 3. リザルト画面
+        (Phase.RESULT, detect_template("result")),
+        # 4. 連続出撃確認画面
+        (Phase.END_PROCESS, detect_template("連続出撃")),
+        # 5. サポート選択画面
+        (Phase.SUPPORTER_SELECT, detect_template("サポート選択")),
+        # 6. 黄金の果実を使用する場面
+        (Phase.USE_APPLE, detect_template("golden_apple", "silver_apple")),
+    ],
+    Phase.OTHER,
+)
+
+# フェーズの遷移を学習し、次に来る可能性が高いフェーズを予測するインスタンスを作成する
+# 学習前は下記の遷移を仮定する
+def create_phase_transition(path=PHASE_TRANSITION_PATH):
+    return PhaseTransitionModel(
+        [phase for phase, _ in phase_classifier.detectors],
+        prior={
+            Phase.SUPPORTER_SELECT: [Phase.SKILL_SELECT],
+            Phase.SKILL_SELECT: [Phase.CARD_SELECT],
+            Phase.CARD_SELECT: [Phase.SKILL_SELECT, Phase.RESULT],
+            Phase.RESULT: [Phase.END_PROCESS],
+            Phase.END_PROCESS: [Phase.USE_APPLE, Phase.SUPPORTER_SELECT],
+            Phase.USE_APPLE: [Phase.SUPPORTER_SELECT],
+        },
+        path=path,
+    )
+
+
+# wait_untilの条件：指定したフェーズのいずれかの画面になった
+def phase_is(*phases):
+    detectors = dict(phase_classifier.detectors)
+
+    # 指定したフェーズの判定関数だけを順番に実行する（すべての画面判別は行わない）
+    def predicate(frame):
+        for phase in phases:
+            confidence = detectors[phase](frame)
+            if confidence is not None and confidence > 0.0:
+                return True
+        return False
+
+    return predicate
+
+
+PHASE_MESSAGE = {
+    Phase.CARD_SELECT: "    カード選択画面に移行します",
+    Phase.SKILL_SELECT: "    スキル選択画面に移行します",
+    Phase.RESULT: "    リザルト画面に移行します",
+    Phase.END_PROCESS: "    連続出撃選択画面に移行します",
+    Phase.SUPPORTER_SELECT: "    サポート選択画面に移行します",
+    Phase.USE_APPLE: "    黄金の果実を使用します",
+}
+
+
+def get_game_phase(device, frame, debug_mode=False):
+    # 直前に確定したフェーズと経過時間から、次に来る可能性が高いフェーズを先に判定する
+    likely_phases = [
+        phase
+        for phase, probability in device.phase_transition.predict()[
+            :LIKELY_PHASE_COUNT
+        ]
+        if probability >= LIKELY_PHASE_MIN_PROBABILITY
+    ]
+    phase, confidence = phase_classifier.classify(frame, likely_phases)
+
+    if phase != Phase.OTHER:
+        print(PHASE_MESSAGE[phase])
+    elif debug_mode:
+        # 判別できなかった画面を別スレッドで保存（一定間隔で間引く）
+        get_debug_writer().save_image(
+            "unrecognized", frame.color, scale=DEBUG_IMAGE_SCALE, timestamped=True
+        )
 
     return phase
 
 
 # フェーズによって行動を決める
-def select_action(phase, error_counter, image_color):
+def select_action(device, phase, error_counter, frame):
+    tc, sc = device.tc, device.sc
+    phase_transition = device.phase_transition
+    session_recorder = device.session_recorder
+
     if phase == Phase.SUPPORTER_SELECT:  # サポート選択画面の場合
-        tap_position = get_template_image_position(image_color, "サポート選択")
+        tap_position = get_template_image_position(frame, "サポート選択")
         if tap_position is not None:
+            phase_transition.observe(Phase.SUPPORTER_SELECT)
+
             # サポートの一番上のキャラクタを選択する
-            tap_position = np.array([326, 326])
+            tap_position = SUPPORTER_TAP_POSITION
             tc.move(tap_position)
             tc.tap()
             print("        サポートを選択しました")
 
+            # スキル選択画面が表示されるまで待つ
+            wait_until(sc, template_visible("attack"), SUPPORTER_SELECT_TIMEOUT)
+
             # 次のフェーズをセット
-            time.sleep(10)
             print("    スキル選択画面へ移行します")
             phase = Phase.SKILL_SELECT
             error_counter = 0
@@ -637,47 +798,69 @@ def select_action(phase, error_counter, image_color):
     elif phase == Phase.SKILL_SELECT:  # スキル選択画面の場合
 
         # "Attack"ボタンがあればスキル選択画面として判定する
-        tap_position = get_template_image_position(image_color, "attack")
+        tap_position = get_template_image_position(frame, "attack")
         if tap_position is not None:
+            phase_transition.observe(Phase.SKILL_SELECT)
+
             # 利用可能なスキルがあれば全て使用する
-            no_skill_available = use_available_skills(image_color, debug_mode=False)
+            no_skill_available = use_available_skills(device, frame, debug_mode=False)
             # no_skill_available = True
 
             # 使えるスキルがなければAttackボタンを選択する
             if no_skill_available:
 
-                tc.move(tap_position)
-                tc.tap()
-                tc.home()
+                with tc.batch():
+                    tc.move(tap_position)
+                    tc.tap()
+                    tc.home()
                 print("        Attackボタンを選択しました")
 
                 # 次のフェーズをセット
                 print("    カード選択画面へ移行します")
                 phase = Phase.CARD_SELECT
                 error_counter = 0
-                time.sleep(0.5)
+
+                # カード選択画面が表示されるまで待つ
+                # 表示されたらその画面の解析を始めておき、次のカード選択で使う
+                card_frame = wait_until(
+                    sc, phase_is(Phase.CARD_SELECT), CARD_SELECT_TIMEOUT
+                )
+                if card_frame is not None:
+                    device.card_select_analysis = CardSelectAnalysis(card_frame)
         else:
             print("        Attackボタンを認識できませんでした")
             phase = Phase.OTHER
 
-            date = datetime.now().strftime("%Y%m%d_%H%M%S")
-            path = "./debug/" + date + ".png"
-            print("保存しました：" + path)
-            cv2.imwrite(path, image_color)  # ファイル保存
+            # 認識できなかった画面を別スレッドで保存
+            get_debug_writer().save_image(
+                "attack_not_found", frame.color, timestamped=True
+            )
 
     elif phase == Phase.CARD_SELECT:  # カード選択画面の場合
-        card_type = get_card_type(image_color)
+        # Attackボタンをタップした後に始めておいた解析があれば使う
+        # なければ、またはカードを認識できなければ（カードが表示される途中など）この画像を解析する
+        analysis = device.card_select_analysis
+        device.card_select_analysis = None
+        if (
+            analysis is None
+            or np.count_nonzero(analysis.card_type.result() == Card.UNKNOWN) > 2
+        ):
+            analysis = CardSelectAnalysis(frame)
+
+        card_type = analysis.card_type.result()
         if np.count_nonzero(card_type == Card.UNKNOWN) <= 2:
+            phase_transition.observe(Phase.CARD_SELECT)
+
             # NPゲージ量を取得する
-            np_gauge = get_np_gauge(image_color)
+            np_gauge = analysis.np_gauge.result()
             # print("        NPゲージ量を取得しました：", np.sort(np_gauge)[::-1])
-            print("        NPゲージ量を取得しました：", np_gauge[::-1])
+            print("        NPゲージ量を取得しました：", np.round(np_gauge[::-1], 1))
             # 下記の優先順で戦略を取る
             # 1. 宝具使用
             # 2. Arts, Quick, Busterチェイン使用
             # 3. Braveチェイン使用
-            # 4. ランダム選択
-            select_card(np_gauge, card_type)
+            # 4. Braveチェインに近い組を選択
+            select_card(device, analysis)
 
             # 次のフェーズをセット
             # リザルト画面かスキル選択画面かわからないので画面判別処理へ入る
@@ -687,14 +870,36 @@ def select_action(phase, error_counter, image_color):
             print("        カードを認識できませんでした")
             phase = Phase.OTHER
     elif phase == Phase.RESULT:
-        tap_position = get_template_image_position(image_color, "result")
+        tap_position = get_template_image_position(frame, "result")
         if tap_position is not None:
-            # "次へ"ボタンが現れる座標を5回タップする
-            tap_position = np.array([1452, 748])
+            # 他のフェーズからリザルト画面に到達したら1周とみなす
+            # （タップしても連続出撃ボタンが表示されず、同じリザルト画面に戻ってきた場合は数えない）
+            if phase_transition.last_phase != Phase.RESULT:
+                session_recorder.complete_quest()
+                print(
+                    "        周回数：",
+                    session_recorder.quests,
+                    "(",
+                    round(session_recorder.get_quests_per_hour(), 1),
+                    "周/時 )",
+                )
+            phase_transition.observe(Phase.RESULT)
+
+            # "次へ"ボタンが現れる座標を最大5回タップする
+            # 連続出撃ボタンが表示されたらタップをやめる
+            tap_position = RESULT_TAP_POSITION
             tc.move(tap_position)
             for i in range(5):
                 tc.tap()
-                time.sleep(1)
+                next_frame = wait_until(
+                    sc,
+                    any_of(screen_changed(frame), template_visible("連続出撃")),
+                    RESULT_TAP_TIMEOUT,
+                )
+                if next_frame is not None:
+                    frame = next_frame
+                    if template_visible("連続出撃")(frame):
+                        break
 
             # 次のフェーズをセット
             phase = Phase.END_PROCESS
@@ -703,14 +908,22 @@ def select_action(phase, error_counter, image_color):
             print("        リザルト画面を認識できませんでした")
             phase = Phase.OTHER
     elif phase == Phase.END_PROCESS:
-        tap_position = get_template_image_position(image_color, "連続出撃")
+        tap_position = get_template_image_position(frame, "連続出撃")
         if tap_position is not None:
+            phase_transition.observe(Phase.END_PROCESS)
+
             # 連続出撃ボタンを選択する
             tc.move(tap_position)
             tc.tap()
-            time.sleep(1)
             print("        連続出撃ボタンを選択しました")
 
+            # 果実の選択画面かサポート選択画面が表示されるまで待つ
+            wait_until(
+                sc,
+                phase_is(Phase.USE_APPLE, Phase.SUPPORTER_SELECT),
+                END_PROCESS_TIMEOUT,
+            )
+
             # 次のフェーズをセット
             # 黄金の果実を選択するか、サポート選択画面へ移行するかがわからないので、OTHERをセット
             phase = Phase.OTHER
@@ -721,53 +934,73 @@ def select_action(phase, error_counter, image_color):
 
     elif phase == Phase.USE_APPLE:
         # 果実の選択画面であることを確認する
-        golden_apple_position = get_template_image_position(image_color, "golden_apple")
-        silver_apple_position = get_template_image_position(image_color, "silver_apple")
+        golden_apple_position = get_template_image_position(frame, "golden_apple")
+        silver_apple_position = get_template_image_position(frame, "silver_apple")
 
         if golden_apple_position is not None or silver_apple_position is not None:
+            phase_transition.observe(Phase.USE_APPLE)
+
             # (760,400)をタップする
-            tap_position = np.array([1346, 615])
+            tap_position = APPLE_TAP_POSITION
             tc.move(tap_position)
             tc.tap()
 
-            # 画面を更新する
-            image_color = sc.get_image()
+            # 画面が切り替わるまで待って更新する
+            next_frame = wait_until(
+                sc,
+                all_of(
+                    screen_changed(frame),
+                    any_of(
+                        template_visible("golden_apple"),
+                        template_visible("silver_apple"),
+                    ),
+                ),
+                USE_APPLE_TIMEOUT,
+            )
+            if next_frame is not None:
+                frame = next_frame
+            else:
+                frame = FrameContext(sc.get_image())
 
             # 黄金の果実/白銀の果実/赤銅の果実を使用する
             golden_apple_position = get_template_image_position(
-                image_color, "golden_apple"
+                frame, "golden_apple"
             )
             silver_apple_position = get_template_image_position(
-                image_color, "silver_apple"
+                frame, "silver_apple"
             )
             # bronze_apple_position = get_template_image_position(
-            #    image_color, "bronze_apple"
+            #    frame, "bronze_apple"
             # )
 
             if golden_apple_position is not None:
                 # 黄金の果実を選択する
                 tc.move(golden_apple_position)
                 tc.tap()
-                time.sleep(0.1)
+                session_recorder.record_apple("golden")
+                wait_until(sc, screen_changed(frame), USE_APPLE_TIMEOUT)
             if silver_apple_position is not None:
                 # 白銀の果実を選択する
                 tc.move(silver_apple_position)
                 tc.tap()
-                time.sleep(0.1)
+                session_recorder.record_apple("silver")
+                wait_until(sc, screen_changed(frame), USE_APPLE_TIMEOUT)
             # if bronze_apple_position is not None:
             #    # 赤銅の果実を選択する
             #    tc.move(bronze_apple_position)
             #    tc.tap()
-            #    time.sleep(0.1)
+            #    wait_until(sc, screen_changed(frame), USE_APPLE_TIMEOUT)
 
             # "決定"ボタンが現れる座標をタップする
-            tap_position = np.array([1146, 660])
+            tap_position = APPLE_DECIDE_TAP_POSITION
             tc.move(tap_position)
             tc.tap()
             print("        APを回復しました")
 
+            # サポート選択画面が表示されるまで待つ
+            wait_until(sc, template_visible("サポート選択"), AP_RECOVERY_TIMEOUT)
+
             # 次のフェーズをセット
-            time.sleep(4)
             print("    サポート選択画面へ移行します")
             phase = Phase.SUPPORTER_SELECT
             error_counter = 0
@@ -775,71 +1008,240 @@ def select_action(phase, error_counter, image_color):
             tap_position = None
             phase = Phase.OTHER
     elif phase == Phase.OTHER:
-        # 何かウィンドウが開いていてスタックしている？
-        # → 閉じるボタンを探してタップする
-        tap_position = get_template_image_position(image_color, "close")
-        if tap_position is not None:
-            tc.move(tap_position)
-            tc.tap()
+        skip, cached_phase = device.frame_change.lookup(
+            frame, device.get_previous_frame()
+        )
+        if skip:
+            # 前回判別した画面から変化していない、または画面が動いている最中
+            # → 画面判別処理を省略して前回の結果を使う
+            phase = cached_phase if cached_phase is not None else Phase.OTHER
+            error_counter += 1
         else:
-            # フェーズが判別不明になった
-            # → 画面判別処理へ移行する
-            if error_counter == 0:
-                print("画面判別処理中... ( 1 /", MAX_ERROR_COUNT, ")")
+            # 何かウィンドウが開いていてスタックしている？
+            # → 閉じるボタンを探してタップする
+            tap_position = get_template_image_position(frame, "close")
+            if tap_position is not None:
+                tc.move(tap_position)
+                tc.tap()
+                device.frame_change.reset()
             else:
-                print(
-                    "\033[1A\033[2K\033[G画面判別処理中... (",
-                    error_counter + 1,
-                    "/",
-                    MAX_ERROR_COUNT,
-                    ")",
-                )
-
-            phase = get_game_phase(image_color, True)
-            error_counter += 1
+                # フェーズが判別不明になった
+                # → 画面判別処理へ移行する
+                if error_counter == 0:
+                    print("画面判別処理中... ( 1 /", MAX_ERROR_COUNT, ")")
+                else:
+                    print(
+                        "\033[1A\033[2K\033[G画面判別処理中... (",
+                        error_counter + 1,
+                        "/",
+                        MAX_ERROR_COUNT,
+                        ")",
+                    )
+
+                phase = get_game_phase(device, frame, True)
+                device.frame_change.store(frame, phase)
+                error_counter += 1
 
     return phase, error_counter
 
 
+##### 全端末で共有する画像認識の初期設定 #####
+# テンプレート画像を処理する画像の大きさに合わせて一度だけ拡大縮小し、学習済みのROIを読み込む
+# 戻り値
+#   ROIの学習器（learn_roiがTrueなら一致した位置からROIを学習する）
+def setup_recognition(learn_roi=False):
+    get_template_registry().set_scale(*layout.template_scale)
+    configure_pyramid_matching(PYRAMID_LEVELS, PYRAMID_CANDIDATES)
+
+    roi_learner = RoiLearner(learning=learn_roi, transform=transform).load()
+    set_roi_learner(roi_learner)
+    return roi_learner
+
+
+##### 1台の端末の状態 #####
+# 端末ごとに、タッチ操作・画面キャプチャ・フェーズ遷移の学習・画面の変化の検出・周回の記録と、
+# 現在のフェーズを持つ
+# テンプレート画像(template_registry)と画面判別のスレッドプール(phase_classifier)は全端末で共有する
+# tc: TouchController, sc: ScreenCapture（開始済みのもの）
+# phase_transition_path, session_log_path: 学習結果・周回の記録の保存先（Noneなら保存しない）
+class Device:
+    def __init__(
+        self,
+        tc,
+        sc,
+        name="fgo_auto",
+        phase_transition_path=PHASE_TRANSITION_PATH,
+        session_log_path=SESSION_LOG_PATH,
+        preview=None,
+    ):
+        self.name = name
+        self.tc = tc
+        self.sc = sc
+        self.phase_transition = create_phase_transition(phase_transition_path).load()
+
+        # 画面が変化していない間、または動いている最中は画面判別処理を省略する
+        self.frame_change = FrameChangeDetector()
+
+        # 周回数・ターン数・フェーズごとの経過時間などを記録する
+        self.session_recorder = SessionRecorder(session_log_path)
+
+        self.preview = preview  # PreviewWindow（Noneなら表示しない）
+        self.phase = Phase.OTHER
+        self.error_counter = 0
+        self.captured = None  # 処理中の画像のCapturedFrame
+        self.card_select_analysis = None  # 先に始めておいたカード選択画面の解析
+
+    # 1回分の処理を行う
+    # 前回送信したタップ操作が終わるのを待ち、その後にキャプチャされた画像で次のアクションを決める
+    # 戻り値
+    #   画像を取得できたか
+    def step(self):
+        # 前回の処理で送信したタップ操作が終わるまで待つ
+        with span("touch_wait"):
+            self.tc.wait()
+
+        # ポインタを初期位置に戻す（画面は変わらないので、実行中に次の画像の取得を進める）
+        self.tc.home()
+
+        # 前回の処理が終わった後にキャプチャされた画像を取得する
+        with span("capture"):
+            captured = self.sc.get_next_frame(self.sc.latest_seq, CAPTURE_TIMEOUT)
+        if captured is None:
+            print(self.name + "：キャプチャできませんでした")
+            return False
+        self.process(captured)
+        return True
+
+    # キャプチャした画像で次のアクションを決める（replay.pyからも使う）
+    # 戻り値
+    #   処理した画像のFrameContext
+    def process(self, captured):
+        self.captured = captured
+        frame = FrameContext(captured.image)
+
+        # 次のアクションを決める
+        previous_phase = self.phase
+        self.session_recorder.enter_phase(self.phase.name)
+        with span("action:" + self.phase.name):
+            self.phase, self.error_counter = select_action(
+                self, self.phase, self.error_counter, frame
+            )
+
+        # 画面を操作した後に画面判別処理に戻った場合は、以前の画面判別の結果を使い回さない
+        if previous_phase != Phase.OTHER and self.phase == Phase.OTHER:
+            self.frame_change.reset()
+
+        if self.preview is not None:
+            self.preview.show_phase(self.phase.name)
+        return frame
+
+    # 処理中の画像の直前にキャプチャされた画像（リングバッファに残っていなければNone）
+    def get_previous_frame(self):
+        if self.captured is None:
+            return None
+        previous = self.sc.get_frame(self.captured.seq - 1)
+        return FrameContext(previous.image) if previous is not None else None
+
+    # フェーズ遷移の学習結果・周回の記録を保存し、キャプチャを止める
+    def close(self):
+        self.phase_transition.save()
+        self.session_recorder.save()
+        self.sc.stop()
+
+
 if __name__ == "__main__":
+    # 使い方: python fgo_auto.py [--learn-roi] [--headless] [--window ウィンドウ名] [--port シリアルポート]
+    #                            [--layout レイアウト名]
+    # 複数の端末を同時に動かす場合はsupervisor.pyを使う
+    window_name = WINDOW_NAME
+    if "--window" in sys.argv:
+        window_name = sys.argv[sys.argv.index("--window") + 1]
+    port = SERIAL_PORT
+    if "--port" in sys.argv:
+        port = sys.argv[sys.argv.index("--port") + 1]
+
+    # 画面のレイアウトを変換する（--layoutでlayout_profile.pyのレイアウト名を指定する）
+    if "--layout" in sys.argv:
+        set_layout(
+            sys.argv[sys.argv.index("--layout") + 1], (WINDOW_WIDTH, WINDOW_HEIGHT)
+        )
+
+    # テンプレート画像を読み込み、処理する画像の大きさに合わせて拡大縮小する
+    # 学習済みのROIを読み込む（--learn-roiを指定すると一致した位置からROIを学習する）
+    roi_learner = setup_recognition("--learn-roi" in sys.argv)
+
     # 画面制御のインスタンスを作成
-    tc = TouchController()
+    # タップ操作は別スレッドで実行し、操作中も画面の待機・判別処理を進める
+    tc = AsyncTouchController(port, transform)
 
     # 画面キャプチャのインスタンスを生成
-    sc = ScreenCapture()
+    # 処理する画像の大きさでキャプチャし、キャプチャ後のリサイズは行わない
+    sc = ScreenCapture(
+        get_capture_pipeline(WORKING_WIDTH, WORKING_HEIGHT, window_name=window_name)
+    )
     sc.start()
-    time.sleep(1)
 
-    # クエストのフェーズを初期化
-    phase = Phase.OTHER
+    # プレビューを別スレッドで表示する（--headlessを指定すると表示しない）
+    if "--headless" in sys.argv:
+        preview = None
+    else:
+        preview = PreviewWindow(sc, max_fps=PREVIEW_FPS)
+        preview.show_rois("card", CARD_POSITION)
+        preview.show_rois("np_gauge", NP_POSITION)
+        preview.show_rois(
+            "skill_icon", [roi for rois in SKILL_ICON_TOP_FRAME for roi in rois]
+        )
+        add_match_listener(preview.show_match)
+        preview.start()
+
+    # 最初の画像がキャプチャされるまで待つ
+    captured = sc.get_next_frame(0, CAPTURE_TIMEOUT)
+    if captured is None:
+        print("キャプチャできませんでした")
+        sys.exit()
+
+    # 処理ごとの処理時間を記録し、定期的にファイルへ書き出す
+    stage_timer = get_stage_timer()
+
+    # クエストのフェーズを初期化（学習済みのフェーズ遷移を読み込む）
+    device = Device(tc, sc, preview=preview)
     try:
-        error_counter = 0
         # while cv2.waitKey(1) != 27:
         while True:
-            # ポインタを初期位置に戻す
-            tc.home()
-
-            # 画像をキャプチャ
-            image_color = sc.get_image()
-            # cv2.imwrite("./debug/capture.png", image_color)
-
-            # 次のアクションを決める
-            phase, error_counter = select_action(phase, error_counter, image_color)
+            if not device.step():
+                continue
 
             # 画面判別処理を繰り返してもフェーズが判別不明の場合
-            if error_counter >= MAX_ERROR_COUNT:
+            if device.error_counter >= MAX_ERROR_COUNT:
                 print("エラー：現在のフェーズが判別できませんでした")
                 while True:
                     print("中断します(rで再開, eで終了): ", end="")
                     s = input()
                     if s == "r":
-                        error_counter = 0
+                        device.error_counter = 0
                         break
                     elif s == "e":
+                        if roi_learner.learning:
+                            roi_learner.save()
+                        stage_timer.dump()
+                        stage_timer.print_summary()
+                        device.close()
+                        device.session_recorder.print_summary()
+                        get_debug_writer().close()
                         sys.exit()
                         break
-            time.sleep(0.2)
+            with span("sleep"):
+                time.sleep(0.2)
+            stage_timer.dump_if_due()
 
     except KeyboardInterrupt:
+        if roi_learner.learning:
+            roi_learner.save()
+            print("ROIを保存しました：" + roi_learner.path)
+        stage_timer.dump()
+        stage_timer.print_summary()
+        device.close()
+        device.session_recorder.print_summary()
+        get_debug_writer().close()
         print("プログラムを終了します")
         sys.exit()
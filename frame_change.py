@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+
+SIGNATURE_SIZE = (64, 30)  # 画面の変化を調べるために縮小する画像のサイズ(幅, 高さ)
+
+
+##### 画面の変化を検出して冗長な画像認識を省略する #####
+# 縮小したグレースケール画像の差分で画面の変化を判定する
+# 下記の場合は認識処理を省略する
+#   ・前回認識した画面から変化していない → 前回の認識結果を使い回す
+#     （画面全体の平均絶対差分に加えて、縮小画像の1pixel（画面の1ブロック）ごとの差分の最大値も調べる
+#       ボタンが1つ現れただけでは平均絶対差分はほとんど変わらないため）
+#   ・直前にキャプチャされたフレームから大きく変化している（アニメーション・読み込み中） → 画面が落ち着くまで待つ
+# 画面が動き続ける場合に備えて、連続して省略できる回数に上限を設ける
+class FrameChangeDetector:
+    def __init__(
+        self,
+        static_threshold=1.5,
+        local_threshold=24,
+        motion_threshold=8.0,
+        max_skip=25,
+    ):
+        self.static_threshold = static_threshold  # これ以下の平均絶対差分は変化なしとみなす
+        self.local_threshold = local_threshold  # ブロックごとの差分がこれを超えたら変化ありとみなす
+        self.motion_threshold = motion_threshold  # これ以上の差分は動いている最中とみなす(Noneなら判定しない)
+        self.max_skip = max_skip  # 連続して認識処理を省略できる回数
+        self.last_frame = None  # 最後に判定したフレーム
+        self.last_signature = None  # 最後に判定したフレームの縮小画像
+        self.cached_signature = None  # 前回認識したフレームの縮小画像
+        self.cached_result = None  # 前回の認識結果
+        self.skip_count = 0
+
+    @staticmethod
+    def get_signature(frame):
+        return cv2.resize(frame.gray, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def get_difference(signature_1, signature_2):
+        return float(np.mean(cv2.absdiff(signature_1, signature_2)))
+
+    # 縮小画像の1pixel（画面の1ブロック）ごとの差分の最大値
+    @staticmethod
+    def get_local_difference(signature_1, signature_2):
+        return int(np.max(cv2.absdiff(signature_1, signature_2)))
+
+    # 変化していない画面か
+    def is_static(self, signature_1, signature_2):
+        return (
+            self.get_difference(signature_1, signature_2) <= self.static_threshold
+            and self.get_local_difference(signature_1, signature_2)
+            <= self.local_threshold
+        )
+
+    # 認識処理を省略できるか判定する
+    # previous_frame: frameの直前にキャプチャされたフレーム（Noneなら動いている最中かは判定しない）
+    # 戻り値
+    #   省略できるか, 省略する場合に使う前回の認識結果（動いている最中ならNone）
+    def lookup(self, frame, previous_frame=None):
+        signature = self.get_signature(frame)
+        self.last_frame = frame
+        self.last_signature = signature
+
+        if self.skip_count >= self.max_skip:
+            self.skip_count = 0
+            return False, None
+
+        # 前回認識した画面から変化していなければ、前回の認識結果を使い回す
+        if self.cached_signature is not None and self.is_static(
+            signature, self.cached_signature
+        ):
+            self.skip_count += 1
+            return True, self.cached_result
+
+        # 直前にキャプチャされたフレームから大きく変化していれば、画面が落ち着くまで認識しない
+        if (
+            self.motion_threshold is not None
+            and previous_frame is not None
+            and self.get_difference(signature, self.get_signature(previous_frame))
+            >= self.motion_threshold
+        ):
+            self.skip_count += 1
+            return True, None
+
+        self.skip_count = 0
+        return False, None
+
+    # 認識結果を記録する
+    def store(self, frame, result):
+        if frame is self.last_frame:
+            self.cached_signature = self.last_signature
+        else:
+            self.cached_signature = self.get_signature(frame)
+        self.cached_result = result
+
+    # 記録した認識結果を破棄する（画面を操作した後など）
+    def reset(self):
+        self.cached_signature = None
+        self.cached_result = None
+        self.skip_count = 0
@@ -0,0 +1,65 @@
+import cv2
+import threading
+
+
+##### キャプチャ画像1枚分の画像処理結果を保持する #####
+# グレースケール化・HSV変換・ROIの切り抜きを初回要求時に一度だけ行い、以降は使い回す
+class FrameContext:
+    def __init__(self, image_color):
+        self.color = image_color
+        self._gray = None
+        self._hsv = None
+        self._pyramid = []  # グレースケール画像のピラミッド（先頭が原寸）
+        self._crops = {}  # (ROIの名前, 色空間) → 切り抜いた画像
+        self._lock = threading.RLock()
+
+    # グレースケール画像
+    @property
+    def gray(self):
+        if self._gray is None:
+            with self._lock:
+                if self._gray is None:
+                    self._gray = cv2.cvtColor(self.color, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    # HSV画像
+    @property
+    def hsv(self):
+        if self._hsv is None:
+            with self._lock:
+                if self._hsv is None:
+                    self._hsv = cv2.cvtColor(self.color, cv2.COLOR_BGR2HSV)
+        return self._hsv
+
+    # グレースケール画像のピラミッド（段数分だけ1/2に縮小した画像のリスト、先頭が原寸）
+    def pyramid(self, levels):
+        if len(self._pyramid) < levels:
+            with self._lock:
+                if not self._pyramid:
+                    self._pyramid.append(self.gray)
+                while len(self._pyramid) < levels:
+                    self._pyramid.append(cv2.pyrDown(self._pyramid[-1]))
+        return self._pyramid[:levels]
+
+    @property
+    def shape(self):
+        return self.color.shape
+
+    # ROIで切り抜いた画像を取得する
+    # 名前を指定した場合は切り抜いた結果をキャッシュする
+    # color_space: "gray", "color", "hsv"のいずれか
+    def crop(self, roi, name=None, color_space="gray"):
+        if name is not None and (name, color_space) in self._crops:
+            return self._crops[(name, color_space)]
+
+        if color_space == "gray":
+            image = self.gray
+        elif color_space == "hsv":
+            image = self.hsv
+        else:
+            image = self.color
+
+        cropped = image[roi["top_y"] : roi["bottom_y"], roi["top_x"] : roi["bottom_x"]]
+        if name is not None:
+            self._crops[(name, color_space)] = cropped
+        return cropped
@@ -0,0 +1,256 @@
+import threading
+
+import numpy as np
+
+from coordinate_transform import CoordinateTransform
+
+
+##### 画面のレイアウト #####
+# タップ位置・ROIを、画面の幅・高さを1とする正規化座標で定義する
+# name: レイアウトの名前
+# size: 座標を測った画像の大きさ(幅, 高さ); タッチ操作デバイスにはこの大きさの座標で送信する
+# template_scale: テンプレート画像(pict/)をsizeの画像に合わせるための倍率(横, 縦)
+# points: 名前 → タップ位置(x, y)の配列（入れ子も可）
+# rois: 名前 → ROI(top_x, top_y, bottom_x, bottom_y)の配列（入れ子も可）
+# lengths: 名前 → 画面の幅を1とする長さ
+# サーヴァント・カードごとの配列は、どのレイアウトでも画面の右から順に並べる
+# （レイアウトを切り替えても、同じ番号が同じ位置のサーヴァント・カードを指すように）
+class LayoutProfile:
+    def __init__(
+        self, name, size, template_scale=(1.0, 1.0), points=None, rois=None, lengths=None
+    ):
+        self.name = name
+        self.size = size
+        self.template_scale = template_scale
+        self.points = {key: np.array(value) for key, value in (points or {}).items()}
+        self.rois = {key: np.array(value) for key, value in (rois or {}).items()}
+        self.lengths = dict(lengths or {})
+
+    # 処理する画像の大きさ(幅, 高さ)の座標に変換する
+    def compile(self, working_size):
+        return CompiledLayout(self, working_size)
+
+
+##### 処理する画像の大きさに変換したレイアウト #####
+# 起動時に一度だけ変換し、画像認識・タップ操作では変換済みの配列をそのまま使う
+#   points: 名前 → タップ位置の配列(ndarray; int)
+#   roi_arrays: 名前 → ROIの配列(ndarray; int; 最後の次元が(top_x, top_y, bottom_x, bottom_y))
+#   rois: 名前 → ROIの辞書({"top_x", "top_y", "bottom_x", "bottom_y"})のリスト（入れ子はそのまま）
+#   lengths: 名前 → 長さ(pixel)
+#   transform: sizeの座標と処理する画像の座標を変換するCoordinateTransform
+#   template_scale: テンプレート画像を処理する画像に合わせるための倍率(横, 縦)
+class CompiledLayout:
+    def __init__(self, profile, working_size):
+        self.profile = profile
+        self.working_size = working_size
+        self.transform = CoordinateTransform(profile.size, working_size)
+        self.template_scale = (
+            profile.template_scale[0] * self.transform.scale_x,
+            profile.template_scale[1] * self.transform.scale_y,
+        )
+
+        width, height = working_size
+        self.points = {
+            key: np.rint(value * [width, height]).astype(int)
+            for key, value in profile.points.items()
+        }
+        self.roi_arrays = {
+            key: np.rint(value * [width, height, width, height]).astype(int)
+            for key, value in profile.rois.items()
+        }
+        self.rois = {
+            key: self.to_roi_dicts(value) for key, value in self.roi_arrays.items()
+        }
+        self.lengths = {
+            key: int(round(value * width)) for key, value in profile.lengths.items()
+        }
+
+    @staticmethod
+    def to_roi_dicts(array):
+        if array.ndim == 1:
+            top_x, top_y, bottom_x, bottom_y = map(int, array)
+            return {
+                "top_x": top_x,
+                "top_y": top_y,
+                "bottom_x": bottom_x,
+                "bottom_y": bottom_y,
+            }
+        return [CompiledLayout.to_roi_dicts(roi) for roi in array]
+
+    # 指定した名前のタップ位置・ROI・長さがすべて定義されているか確かめる
+    def require(self, points=(), rois=(), lengths=()):
+        for names, defined in [
+            (points, self.points),
+            (rois, self.rois),
+            (lengths, self.lengths),
+        ]:
+            for name in names:
+                if name not in defined:
+                    raise KeyError(
+                        "レイアウト "
+                        + self.profile.name
+                        + " に "
+                        + name
+                        + " が定義されていません"
+                    )
+
+
+# iPhone X系（1823x842で作成したテンプレート画像・座標）
+IPHONE_X = LayoutProfile(
+    "iphone_x",
+    (1823, 842),
+    points={
+        # Ars, Quick, Busterカードのタップする位置
+        "arq_card_tap": [
+            [0.836533, 0.655582],
+            [0.66429, 0.655582],
+            [0.499726, 0.655582],
+            [0.337356, 0.655582],
+            [0.170049, 0.655582],
+        ],
+        # 宝具カードのタップする位置
+        "noble_phantasm_tap": [
+            [0.650576, 0.255344],
+            [0.499726, 0.255344],
+            [0.354909, 0.255344],
+        ],
+        # スキルアイコンのタップする位置
+        "skill_icon_tap": [
+            [[0.485464, 0.774347], [0.541964, 0.774347], [0.60011, 0.774347]],
+            [[0.280856, 0.774347], [0.338453, 0.774347], [0.395502, 0.774347]],
+            [[0.077894, 0.774347], [0.136039, 0.774347], [0.194185, 0.774347]],
+        ],
+        # スキルの対象サーヴァント（真ん中, 2人しかいないときの左側, 右側）
+        "skill_target_tap": [
+            [0.504663, 0.593824],
+            [0.3017, 0.593824],
+            [0.702139, 0.593824],
+        ],
+        "supporter_tap": [0.178826, 0.387173],  # サポートの一番上のキャラクタ
+        "result_tap": [0.796489, 0.888361],  # リザルト画面の"次へ"ボタン
+        "apple_tap": [0.738343, 0.730404],  # 果実の選択画面
+        "apple_decide_tap": [0.628634, 0.783848],  # 果実の"決定"ボタン
+    },
+    rois={
+        # スキルアイコンの"あと"の文字が表示される位置
+        "skill_letter": [
+            [
+                [0.464619, 0.804038, 0.483818, 0.824228],
+                [0.521119, 0.804038, 0.540318, 0.824228],
+                [0.577619, 0.804038, 0.596818, 0.824228],
+            ],
+            [
+                [0.261108, 0.804038, 0.279759, 0.824228],
+                [0.317608, 0.804038, 0.336259, 0.824228],
+                [0.374109, 0.804038, 0.392759, 0.824228],
+            ],
+            [
+                [0.057049, 0.804038, 0.076248, 0.824228],
+                [0.113549, 0.804038, 0.132748, 0.824228],
+                [0.170049, 0.804038, 0.189248, 0.824228],
+            ],
+        ],
+        # スキルアイコン上部の白いライン
+        "skill_icon_top_frame": [
+            [
+                [0.468459, 0.729216, 0.50576, 0.731591],
+                [0.524959, 0.729216, 0.56226, 0.731591],
+                [0.581459, 0.729216, 0.61876, 0.731591],
+            ],
+            [
+                [0.264399, 0.729216, 0.302249, 0.731591],
+                [0.3209, 0.729216, 0.358749, 0.731591],
+                [0.3774, 0.729216, 0.41525, 0.731591],
+            ],
+            [
+                [0.060889, 0.729216, 0.09819, 0.731591],
+                [0.117389, 0.729216, 0.15469, 0.731591],
+                [0.173889, 0.729216, 0.21119, 0.731591],
+            ],
+        ],
+        # NPゲージ
+        "np_gauge": [
+            [0.541964, 0.913302, 0.627537, 0.920428],
+            [0.338453, 0.913302, 0.424026, 0.920428],
+            [0.134942, 0.913302, 0.220516, 0.920428],
+        ],
+        # 各カードのキャラクタの認識範囲（BRAVE CHAINの判定用）
+        "charactor": [
+            [0.439934, 0.356295, 0.511794, 0.451306],
+            [0.332968, 0.356295, 0.404827, 0.451306],
+            [0.227098, 0.356295, 0.298958, 0.451306],
+            [0.122874, 0.356295, 0.194734, 0.451306],
+            [0.018102, 0.356295, 0.089962, 0.451306],
+        ],
+        # 各カードの認識範囲（カード種別の判定用）
+        "card": [
+            [0.778936, 0.534442, 0.877674, 0.831354],
+            [0.614372, 0.534442, 0.71311, 0.831354],
+            [0.449808, 0.534442, 0.548546, 0.831354],
+            [0.285244, 0.534442, 0.383982, 0.831354],
+            [0.12068, 0.534442, 0.219419, 0.831354],
+        ],
+    },
+    lengths={
+        "np_gauge_margin": 0.005485,  # NPゲージの左端の暗くなる部分の幅
+    },
+)
+
+# iPhone 7系（960x540; test/のサンプル画像）
+# スキルの判定に使う位置のみ測定済み
+IPHONE_7 = LayoutProfile(
+    "iphone_7",
+    (960, 540),
+    template_scale=(540 / 842, 540 / 842),
+    rois={
+        "skill_letter": [
+            [
+                [0.523958, 0.831481, 0.55, 0.855556],
+                [0.592708, 0.831481, 0.61875, 0.855556],
+                [0.661458, 0.831481, 0.6875, 0.855556],
+            ],
+            [
+                [0.275, 0.831481, 0.302083, 0.855556],
+                [0.34375, 0.831481, 0.370833, 0.855556],
+                [0.4125, 0.831481, 0.439583, 0.855556],
+            ],
+            [
+                [0.028125, 0.831481, 0.055208, 0.855556],
+                [0.096875, 0.831481, 0.123958, 0.855556],
+                [0.165625, 0.831481, 0.192708, 0.855556],
+            ],
+        ],
+        "skill_icon_top_frame": [
+            [
+                [0.53125, 0.757407, 0.576042, 0.762963],
+                [0.598958, 0.757407, 0.644792, 0.762963],
+                [0.66875, 0.757407, 0.713542, 0.762963],
+            ],
+            [
+                [0.283333, 0.757407, 0.328125, 0.762963],
+                [0.352083, 0.757407, 0.396875, 0.762963],
+                [0.420833, 0.757407, 0.465625, 0.762963],
+            ],
+            [
+                [0.035417, 0.757407, 0.080208, 0.762963],
+                [0.104167, 0.757407, 0.148958, 0.762963],
+                [0.172917, 0.757407, 0.217708, 0.762963],
+            ],
+        ],
+    },
+)
+
+LAYOUT_PROFILES = {profile.name: profile for profile in [IPHONE_X, IPHONE_7]}
+
+# 変換済みのレイアウト（レイアウトの名前, 処理する画像の大きさ） → CompiledLayout
+_compiled_layouts = {}
+_compiled_layouts_lock = threading.Lock()
+
+
+# レイアウトを処理する画像の大きさに変換する（同じ組み合わせは一度だけ変換する）
+def get_layout(name, working_size):
+    key = (name, tuple(working_size))
+    with _compiled_layouts_lock:
+        if key not in _compiled_layouts:
+            _compiled_layouts[key] = LAYOUT_PROFILES[name].compile(working_size)
+        return _compiled_layouts[key]
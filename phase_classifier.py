@@ -0,0 +1,63 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from stage_timer import timed
+
+# 画像認識処理を実行するスレッドプール（全モジュールで共有する）
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = ThreadPoolExecutor(
+                max_workers=os.cpu_count() or 4, thread_name_prefix="recognition"
+            )
+        return _worker_pool
+
+
+##### 画面判別処理を並列に実行する #####
+# detectors: (フェーズ, 判定関数)のリスト（優先順位の高い順）
+#   判定関数はFrameContextを受け取り、そのフェーズである確信度(0～1)を返す
+#   そのフェーズでなければNoneを返す
+# OpenCVの処理中はGILが解放されるため、判定関数をスレッドプールで同時に実行する
+class PhaseClassifier:
+    def __init__(self, detectors, default_phase, executor=None):
+        self.detectors = detectors
+        self.default_phase = default_phase
+        self.executor = executor if executor is not None else get_worker_pool()
+
+    # 戻り値
+    #   確信度が最も高いフェーズ, 確信度
+    # 備考
+    #   確信度が同じ場合は優先順位の高いフェーズを返す
+    #   いずれのフェーズでもなければ(default_phase, 0.0)を返す
+    #   likely_phasesを指定した場合は、そのフェーズを先に順番に判定し、
+    #   該当するものがあればその時点で返す。該当しなければ残りを並列に判定する
+    @timed("classify")
+    def classify(self, frame, likely_phases=None):
+        detectors = self.detectors
+        if likely_phases:
+            detector_dict = dict(self.detectors)
+            for phase in likely_phases:
+                confidence = detector_dict[phase](frame)
+                if confidence is not None and confidence > 0.0:
+                    return phase, confidence
+            detectors = [
+                (phase, detector)
+                for phase, detector in self.detectors
+                if phase not in likely_phases
+            ]
+
+        futures = [self.executor.submit(detector, frame) for _, detector in detectors]
+
+        best_phase, best_confidence = self.default_phase, 0.0
+        for (phase, _), future in zip(detectors, futures):
+            confidence = future.result()
+            if confidence is not None and confidence > best_confidence:
+                best_phase, best_confidence = phase, confidence
+
+        return best_phase, best_confidence
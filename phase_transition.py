@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+
+# 学習したフェーズ遷移の保存先
+PHASE_TRANSITION_PATH = "./phase_transition.json"
+
+# 直前のフェーズが確定してからの経過時間の区切り(秒)
+ELAPSED_BUCKETS = [5, 30, 120]
+
+
+##### フェーズ遷移の学習と次のフェーズの予測 #####
+# 確定したフェーズの遷移を(直前のフェーズ, 経過時間の区分)ごとに数え、次のフェーズの確率を求める
+# 学習結果はメインループでは書き出さず、終了時にsaveで保存する
+# phases: 対象とするフェーズ（IntEnumのメンバ）のリスト
+# prior: 学習前に仮定する遷移 {遷移元のフェーズ: [遷移先のフェーズ, ...]}
+class PhaseTransitionModel:
+    def __init__(self, phases, prior=None, path=PHASE_TRANSITION_PATH, prior_weight=2):
+        self.phases = list(phases)
+        self.path = path
+        self.counts = {}  # "遷移元のフェーズ名/経過時間の区分" → {遷移先のフェーズ名: 回数}
+        self.prior = {}  # 遷移元のフェーズ名 → {遷移先のフェーズ名: 回数}
+        self.last_phase = None  # 最後に確定したフェーズ
+        self.last_time = None  # 最後にフェーズが確定した時刻
+        self.lock = threading.Lock()
+
+        if prior is not None:
+            for from_phase, to_phases in prior.items():
+                self.prior[from_phase.name] = {
+                    to_phase.name: prior_weight for to_phase in to_phases
+                }
+
+    # 保存済みの学習結果を読み込む
+    def load(self):
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.counts = json.load(f)
+        return self
+
+    # 学習結果を保存する
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            counts = json.dumps(self.counts, ensure_ascii=False, indent=4)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(counts)
+
+    @staticmethod
+    def get_elapsed_bucket(elapsed):
+        for i, limit in enumerate(ELAPSED_BUCKETS):
+            if elapsed < limit:
+                return i
+        return len(ELAPSED_BUCKETS)
+
+    # フェーズが確定したことを記録する
+    # 直前に確定したフェーズと異なれば遷移として数える
+    def observe(self, phase, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.last_phase is not None and self.last_phase != phase:
+                bucket = self.get_elapsed_bucket(now - self.last_time)
+                key = self.last_phase.name + "/" + str(bucket)
+                to_counts = self.counts.setdefault(key, {})
+                to_counts[phase.name] = to_counts.get(phase.name, 0) + 1
+            self.last_phase = phase
+            self.last_time = now
+
+    # 次のフェーズの確率を求める
+    # 戻り値
+    #   (フェーズ, 確率)のリスト（確率の高い順、同じ確率ならphasesの順）
+    def predict(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.last_phase is None:
+                return [(phase, 1.0 / len(self.phases)) for phase in self.phases]
+
+            bucket = self.get_elapsed_bucket(now - self.last_time)
+            learned = self.counts.get(self.last_phase.name + "/" + str(bucket), {})
+            prior = self.prior.get(self.last_phase.name, {})
+
+        # 学習した回数に事前の仮定を加え、全フェーズに1回ずつ加えて平滑化する
+        weights = [
+            learned.get(phase.name, 0) + prior.get(phase.name, 0) + 1
+            for phase in self.phases
+        ]
+        total = sum(weights)
+        probabilities = [
+            (phase, weight / total) for phase, weight in zip(self.phases, weights)
+        ]
+
+        return sorted(probabilities, key=lambda p: -p[1])
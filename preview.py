@@ -0,0 +1,128 @@
+import cv2
+import threading
+import time
+
+# 重ねて表示する図形の色(BGR)
+ROI_COLOR = (255, 200, 0)  # ROI
+MATCH_COLOR = (0, 0, 255)  # 一致したテンプレート
+PHASE_COLOR = (0, 255, 0)  # 現在のフェーズ
+
+
+##### キャプチャ画像のプレビュー #####
+# キャプチャとは別のスレッドで、最新のキャプチャ画像に認識結果を重ねて表示する
+# 表示はmax_fps回/秒までに抑え、キャプチャの処理速度に影響しないようにする
+# 重ねて表示するもの
+#   ・ROI（show_roisで設定したもの; 消去するまで表示し続ける）
+#   ・一致したテンプレートの領域（show_matchで設定したもの; match_lifetime秒で消える）
+#   ・現在のフェーズ（show_phaseで設定したもの）
+class PreviewWindow(threading.Thread):
+    def __init__(self, capture, window_name="fgo_auto", max_fps=10, match_lifetime=1.0):
+        super(PreviewWindow, self).__init__(daemon=True)
+        self.capture = capture  # ScreenCapture
+        self.window_name = window_name
+        self.max_fps = max_fps  # 1秒あたりの表示回数の上限
+        self.match_lifetime = match_lifetime  # 一致したテンプレートの領域を表示する時間(秒)
+
+        self.rois = {}  # ROIの名前 → ROIのリスト
+        self.matches = {}  # テンプレート名 → (top_x, top_y, 幅, 高さ, 一致度, 時刻)
+        self.phase = None  # 現在のフェーズの名前
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    # ROIを表示する（roisにNoneを渡すと消去する）
+    def show_rois(self, name, rois):
+        with self.lock:
+            if rois is None:
+                self.rois.pop(name, None)
+            else:
+                self.rois[name] = list(rois)
+
+    # 一致したテンプレートの領域を表示する（template_matching.add_match_listenerに渡せる形）
+    def show_match(self, image_name, top_x, top_y, width, height, max_val):
+        with self.lock:
+            self.matches[image_name] = (
+                top_x,
+                top_y,
+                width,
+                height,
+                max_val,
+                time.time(),
+            )
+
+    # 現在のフェーズを表示する
+    def show_phase(self, phase_name):
+        with self.lock:
+            self.phase = phase_name
+
+    # キャプチャ画像に認識結果を重ねた画像を作成する
+    def draw(self, image):
+        image = image.copy()  # キャプチャ画像は読み取り専用なので複製して描画する
+        now = time.time()
+        with self.lock:
+            for rois in self.rois.values():
+                for roi in rois:
+                    cv2.rectangle(
+                        image,
+                        (roi["top_x"], roi["top_y"]),
+                        (roi["bottom_x"], roi["bottom_y"]),
+                        ROI_COLOR,
+                        1,
+                    )
+
+            for image_name, match in list(self.matches.items()):
+                top_x, top_y, width, height, max_val, matched = match
+                if now - matched > self.match_lifetime:
+                    del self.matches[image_name]
+                    continue
+                cv2.rectangle(
+                    image,
+                    (top_x, top_y),
+                    (top_x + width, top_y + height),
+                    MATCH_COLOR,
+                    2,
+                )
+                # 日本語のテンプレート名は表示できないので一致度のみ表示する
+                cv2.putText(
+                    image,
+                    "{:.2f}".format(max_val),
+                    (top_x, max(0, top_y - 4)),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.6,
+                    MATCH_COLOR,
+                    2,
+                )
+
+            if self.phase is not None:
+                cv2.putText(
+                    image,
+                    self.phase,
+                    (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0,
+                    PHASE_COLOR,
+                    2,
+                )
+        return image
+
+    def run(self):
+        seq = 0
+        interval = 1.0 / self.max_fps
+        while not self.stopped:
+            started = time.time()
+
+            # 前回表示した後にキャプチャされた画像を待つ
+            captured = self.capture.get_next_frame(seq, 1.0)
+            if captured is not None:
+                seq = captured.seq
+                cv2.imshow(self.window_name, self.draw(captured.image))
+            cv2.waitKey(1)
+
+            # 表示回数の上限を超えないように待つ
+            wait = interval - (time.time() - started)
+            if wait > 0:
+                time.sleep(wait)
+
+        cv2.destroyWindow(self.window_name)
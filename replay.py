@@ -0,0 +1,225 @@
+import cv2
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+import fgo_auto
+from screen_capture import ScreenCapture
+from stage_timer import get_stage_timer
+from touch_controller import AsyncTouchController
+
+# 再生の設定
+REPLAY_FPS = 10  # 1秒あたりに再生する画像の数
+TOUCH_LATENCY = 0.05  # タッチ操作1コマンドあたりの模擬的な実行時間(秒)
+
+
+##### 録画した画像の再生 #####
+# 画像のディレクトリ(*.png, *.jpg)または動画ファイルを、ScreenCaptureの入力として1枚ずつ返す
+# 実機のキャプチャと同じように、fps枚/秒の間隔で画像を返す
+# image_size: 再生する画像をリサイズする大きさ(幅, 高さ)
+class ReplaySource:
+    def __init__(self, path, fps=REPLAY_FPS, loop=False, image_size=None):
+        if os.path.isdir(path):
+            self.paths = sorted(
+                glob.glob(os.path.join(path, "*.png"))
+                + glob.glob(os.path.join(path, "*.jpg"))
+            )
+            self.video = None
+        else:
+            self.paths = None
+            self.video = cv2.VideoCapture(path)
+        self.interval = 1.0 / fps
+        self.loop = loop
+        self.image_size = image_size
+        self.index = 0  # 次に返す画像の番号
+        self.names = []  # 返した画像の名前（ScreenCaptureの通し番号 - 1 の順）
+        self.finished = False  # すべての画像を返し終えたか
+        self.next_time = None
+
+    def read(self):
+        # 再生の間隔を空ける
+        now = time.time()
+        if self.next_time is not None and now < self.next_time:
+            time.sleep(self.next_time - now)
+        self.next_time = max(now, self.next_time or now) + self.interval
+
+        image = self.read_image()
+        if image is None and self.loop and self.index > 0:
+            self.rewind()
+            image = self.read_image()
+        if image is None:
+            self.finished = True
+            return False, None
+
+        if self.image_size is not None:
+            image = cv2.resize(image, self.image_size)
+        return True, image
+
+    def read_image(self):
+        if self.paths is not None:
+            if self.index >= len(self.paths):
+                return None
+            image = cv2.imread(self.paths[self.index])
+            name = os.path.basename(self.paths[self.index])
+        else:
+            ret, image = self.video.read()
+            if not ret:
+                return None
+            name = str(self.index)
+        self.index += 1
+        self.names.append(name)
+        return image
+
+    def rewind(self):
+        self.index = 0
+        if self.video is not None:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+
+##### タッチ操作デバイスの代替 #####
+# 実機のファームウェアと同じように、受け取ったコマンド1行ごとに"OK"を返し、
+# 1コマンドあたりlatency秒で順番に実行し終えたことにして"DONE"を返す
+# fgo_auto.pyと同じAsyncTouchControllerにシリアル通信のオブジェクトとして渡す
+class MockSerial:
+    def __init__(self, latency=TOUCH_LATENCY, verbose=False):
+        self.latency = latency  # 1コマンドあたりの実行時間(秒)
+        self.verbose = verbose  # Trueならコマンドを表示する
+        self.timeout = None  # readlineで応答を待つ時間の上限(秒)
+        self.replies = deque()  # (応答を返す時刻, 応答)
+        self.busy_until = 0.0  # 受け取ったコマンドをすべて実行し終える時刻
+        self.commands = []  # (時刻, コマンド)のリスト（PINGは含めない）
+
+    def write(self, data):
+        now = time.time()
+        for message in data.decode("UTF-8").splitlines():
+            if message != "PING":
+                self.commands.append((now, message))
+                if self.verbose:
+                    print("        [touch]", message)
+            self.busy_until = max(self.busy_until, now) + self.latency
+            self.replies.append((now, b"OK"))
+            self.replies.append((self.busy_until, b"DONE"))
+        return len(data)
+
+    # 次の応答を返す（timeout秒以内に返す応答がなければ、timeout秒待ってからb""を返す）
+    def readline(self):
+        timeout = self.timeout if self.timeout is not None else 0.0
+        wait = self.replies[0][0] - time.time() if self.replies else np.inf
+        if wait > timeout:
+            time.sleep(timeout)
+            return b""
+        if wait > 0:
+            time.sleep(wait)
+        _, reply = self.replies.popleft()
+        return reply + b"\n"
+
+    def reset_input_buffer(self):
+        self.replies = deque(
+            (ready_time, reply)
+            for ready_time, reply in self.replies
+            if ready_time > time.time()
+        )
+
+    def close(self):
+        pass
+
+
+##### 録画した画像でfgo_auto.pyの処理を実行する #####
+# labels: 画像の名前 → 正解のフェーズ名（指定した場合は画面判別の正解率を求める）
+# 戻り値
+#   集計結果の辞書
+def run_replay(
+    path,
+    fps=REPLAY_FPS,
+    latency=TOUCH_LATENCY,
+    labels=None,
+    max_loops=None,
+    verbose=False,
+):
+    # テンプレート画像・ROIを実機と同じ設定にする
+    fgo_auto.setup_recognition()
+
+    source = ReplaySource(
+        path, fps, image_size=(fgo_auto.WORKING_WIDTH, fgo_auto.WORKING_HEIGHT)
+    )
+    serial = MockSerial(latency, verbose)
+    tc = AsyncTouchController(serial, fgo_auto.transform)
+    sc = ScreenCapture(source)
+    sc.start()
+
+    # 再生中はフェーズ遷移の学習結果・周回の記録を保存しない
+    device = fgo_auto.Device(
+        tc, sc, name="replay", phase_transition_path=None, session_log_path=None
+    )
+
+    action_times = []
+    correct = 0
+    labeled = 0
+    last_seq = 0  # 最後に処理した画像の通し番号
+    started = time.time()
+    while max_loops is None or len(action_times) < max_loops:
+        tc.wait()
+        tc.home()
+
+        # すべての画像を再生し、最後の画像まで処理し終えていれば終了する
+        if source.finished and sc.latest_seq <= last_seq:
+            break
+        captured = sc.get_next_frame(last_seq, 1.0 + source.interval)
+        if captured is None:
+            if source.finished:
+                break
+            continue
+        last_seq = captured.seq
+
+        # 次のアクションを決める
+        action_started = time.time()
+        frame = device.process(captured)
+        action_times.append(time.time() - action_started)
+
+        # 画面判別の結果を正解と比べる
+        name = source.names[captured.seq - 1]
+        if labels is not None and name in labels:
+            labeled += 1
+            classified, _ = fgo_auto.phase_classifier.classify(frame)
+            if classified.name == labels[name]:
+                correct += 1
+            elif verbose:
+                print("        [replay]", name, classified.name, "!=", labels[name])
+    elapsed = time.time() - started
+    tc.wait()
+    tc.close()
+    sc.stop()
+
+    action_ms = np.array(action_times) * 1000
+    return {
+        "frames": len(source.names),
+        "loops": len(action_times),
+        "loops_per_second": len(action_times) / elapsed if elapsed > 0 else 0.0,
+        "action_ms_median": float(np.median(action_ms)) if len(action_ms) else None,
+        "action_ms_p95": float(np.percentile(action_ms, 95)) if len(action_ms) else None,
+        "commands": len(serial.commands),
+        "taps": sum(1 for _, command in serial.commands if command == "TAP"),
+        "labeled": labeled,
+        "accuracy": correct / labeled if labeled else None,
+        "session": device.session_recorder.summary(),
+    }
+
+
+if __name__ == "__main__":
+    # 使い方: python replay.py 画像のディレクトリまたは動画ファイル [正解のフェーズ名のJSON]
+    # 正解のフェーズ名のJSONは {"画像の名前": "CARD_SELECT", ...} の形式
+    # （動画ファイルの場合、画像の名前はフレーム番号）
+    labels = None
+    if len(sys.argv) >= 3:
+        with open(sys.argv[2], encoding="utf-8") as f:
+            labels = json.load(f)
+
+    result = run_replay(sys.argv[1], labels=labels, verbose=True)
+    for key, value in result.items():
+        print(key + ":", value)
+    get_stage_timer().print_summary()
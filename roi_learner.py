@@ -0,0 +1,176 @@
+import cv2
+import glob
+import json
+import os
+import sys
+import threading
+
+from frame_context import FrameContext
+from template_matching import THRESHOLD, match_template
+
+# 学習したROIの保存先
+LEARNED_ROI_PATH = "./learned_roi.json"
+
+# ROIを学習する対象のテンプレート（画面判別に使用するもの）
+PHASE_TEMPLATE_NAMES = [
+    "attack",
+    "result",
+    "連続出撃",
+    "サポート選択",
+    "golden_apple",
+    "silver_apple",
+    "close",
+]
+
+
+##### テンプレートが一致した位置からROIを学習する #####
+# テンプレートごとに一致した領域の外接矩形を記録し、余白を付けたものをROIとして使う
+# 外接矩形は基準の画像サイズの座標で保存するので、処理する画像の大きさを変えても学習結果を使い回せる
+# ROIで見つからなかった場合の全体の探索は、学習中か、連続してfallback_every回見つからなかった場合に限る
+# （画面判別ではテンプレートが見つからない場合がほとんどなので、毎回全体を探索すると遅くなる）
+# transform: 基準の画像サイズから処理する画像サイズへのCoordinateTransform（Noneなら同じ大きさ）
+class RoiLearner:
+    def __init__(
+        self,
+        path=LEARNED_ROI_PATH,
+        padding=24,
+        learning=False,
+        transform=None,
+        fallback_every=10,
+    ):
+        self.path = path
+        self.padding = padding  # ROIの上下左右に付ける余白(pixel)
+        self.learning = learning  # Trueなら一致した位置を記録する
+        self.transform = transform
+        self.fallback_every = fallback_every  # ROIで見つからなかった回数がこの倍数なら全体を探索する
+        self.bounds = {}  # テンプレート名 → 一致領域の外接矩形 [top_x, top_y, bottom_x, bottom_y]
+        self.miss_counts = {}  # テンプレート名 → ROIで連続して見つからなかった回数
+        self.lock = threading.Lock()
+
+    # 保存済みの学習結果を読み込む
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.bounds = {
+                    name: list(bound) for name, bound in json.load(f).items()
+                }
+        return self
+
+    # 学習結果を保存する
+    def save(self):
+        with self.lock:
+            bounds = dict(self.bounds)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(bounds, f, ensure_ascii=False, indent=4)
+
+    # テンプレートが一致した領域を記録する
+    def record(self, image_name, top_x, top_y, width, height):
+        if not self.learning:
+            return
+
+        if self.transform is not None:
+            # 基準の画像サイズの座標に戻して記録する
+            top_x, top_y = map(int, self.transform.to_reference((top_x, top_y)))
+            width = int(round(width / self.transform.scale_x))
+            height = int(round(height / self.transform.scale_y))
+
+        with self.lock:
+            bound = self.bounds.get(image_name)
+            if bound is None:
+                self.bounds[image_name] = [top_x, top_y, top_x + width, top_y + height]
+            else:
+                bound[0] = min(bound[0], top_x)
+                bound[1] = min(bound[1], top_y)
+                bound[2] = max(bound[2], top_x + width)
+                bound[3] = max(bound[3], top_y + height)
+
+    # ROIで見つかったことを記録する
+    def record_hit(self, image_name):
+        with self.lock:
+            self.miss_counts.pop(image_name, None)
+
+    # ROIで見つからなかったことを記録し、全体を探索すべきか判定する
+    def record_miss(self, image_name):
+        if self.learning:
+            return True
+        with self.lock:
+            count = self.miss_counts.get(image_name, 0) + 1
+            self.miss_counts[image_name] = count
+        return count % self.fallback_every == 0
+
+    # 学習済みのROIを取得する（未学習ならNone）
+    def get_roi(self, image_name, image_shape):
+        bound = self.bounds.get(image_name)
+        if bound is None:
+            return None
+
+        image_height, image_width = image_shape[:2]
+        roi = {
+            "top_x": bound[0] - self.padding,
+            "top_y": bound[1] - self.padding,
+            "bottom_x": bound[2] + self.padding,
+            "bottom_y": bound[3] + self.padding,
+        }
+        if self.transform is not None:
+            roi = self.transform.roi(roi)
+        return {
+            "top_x": max(0, roi["top_x"]),
+            "top_y": max(0, roi["top_y"]),
+            "bottom_x": min(image_width, roi["bottom_x"]),
+            "bottom_y": min(image_height, roi["bottom_y"]),
+        }
+
+
+##### 録画した画像群からROIを学習する #####
+# テンプレート画像は処理する画像の大きさに合わせて拡大縮小しておくこと（fgo_auto.setup_recognition参照）
+# roi_learnerのtransformで、一致した位置を基準の画像サイズの座標に戻して記録する
+# 処理する画像と大きさの異なる画像は、処理する画像の大きさにリサイズしてから探す
+def learn_from_images(image_paths, roi_learner, image_names=PHASE_TEMPLATE_NAMES):
+    learning = roi_learner.learning
+    roi_learner.learning = True
+    for path in image_paths:
+        image_color = cv2.imread(path)
+        if image_color is None:
+            continue
+        if roi_learner.transform is not None:
+            working_size = tuple(roi_learner.transform.working_size)
+            if image_color.shape[1::-1] != working_size:
+                image_color = cv2.resize(image_color, working_size)
+
+        # 学習済みのROIに頼らず全体から探す
+        frame = FrameContext(image_color)
+        for image_name in image_names:
+            max_val, (top_x, top_y), width, height = match_template(frame, image_name)
+            if max_val > THRESHOLD:
+                roi_learner.record(image_name, top_x, top_y, width, height)
+    roi_learner.learning = learning
+
+    return roi_learner
+
+
+if __name__ == "__main__":
+    # 使い方: python roi_learner.py [--layout レイアウト名] 画像のディレクトリ [画像のディレクトリ ...]
+    import fgo_auto
+
+    arguments = sys.argv[1:]
+    if "--layout" in arguments:
+        index = arguments.index("--layout")
+        fgo_auto.set_layout(
+            arguments[index + 1], (fgo_auto.WINDOW_WIDTH, fgo_auto.WINDOW_HEIGHT)
+        )
+        del arguments[index : index + 2]
+
+    image_paths = []
+    for directory in arguments:
+        image_paths += sorted(glob.glob(os.path.join(directory, "*.png")))
+        image_paths += sorted(glob.glob(os.path.join(directory, "*.jpg")))
+
+    # fgo_auto.pyと同じように、テンプレート画像を処理する画像の大きさに合わせて拡大縮小し、
+    # レイアウトの座標変換を設定したROIの学習器で学習する
+    roi_learner = fgo_auto.setup_recognition(learn_roi=True)
+    learn_from_images(image_paths, roi_learner)
+    roi_learner.save()
+
+    for image_name, bound in roi_learner.bounds.items():
+        print(image_name, bound)
+    print("ROIを保存しました：" + roi_learner.path)
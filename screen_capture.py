@@ -0,0 +1,105 @@
+import cv2
+import threading
+import time
+from collections import deque, namedtuple
+
+# キャプチャした画像1枚分の情報
+#   seq: 通し番号（1から始まり、キャプチャするたびに1増える）
+#   timestamp: キャプチャした時刻(time.time())
+#   image: キャプチャした画像（読み取り専用）
+CapturedFrame = namedtuple("CapturedFrame", ["seq", "timestamp", "image"])
+
+
+# ウィンドウをキャプチャするGStreamerのパイプラインを作成する
+# window_idを指定した場合はウィンドウID、それ以外はウィンドウ名でキャプチャ対象を指定する
+def get_capture_pipeline(width, height, window_name=None, window_id=None):
+    if window_id is not None:
+        source = f"ximagesrc xid={window_id}"
+    else:
+        source = f"ximagesrc xname={window_name}"
+    return (
+        f"{source} ! videoconvert ! videoscale"
+        f" ! video/x-raw,width={width},height={height} ! appsink"
+    )
+
+
+##### 画面キャプチャ #####
+# キャプチャした画像を通し番号・時刻付きでリングバッファに保持する
+# get_next_frameで、指定した通し番号より後にキャプチャされた画像を待つことができる
+# キャプチャのスレッドでは画像の取得のみを行う（表示はpreview.PreviewWindowを使う）
+class ScreenCapture(threading.Thread):
+    def __init__(self, video_source, image_size=None, buffer_size=8):
+        super(ScreenCapture, self).__init__(daemon=True)
+
+        # キャプチャの初期設定
+        if isinstance(video_source, str):
+            video_source = cv2.VideoCapture(video_source)
+        self.video_source = video_source
+        self.image_size = image_size  # キャプチャした画像をリサイズする大きさ(幅, 高さ)
+
+        self.frames = deque(maxlen=buffer_size)  # 最近キャプチャした画像のリングバッファ
+        self.latest_seq = 0  # 最後にキャプチャした画像の通し番号
+        self.condition = threading.Condition()
+        self.stopped = False
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def run(self):
+        while not self.stopped:
+            ret, image_original = self.video_source.read()
+            timestamp = time.time()
+
+            if ret:
+                # キャプチャした画像をリサイズする
+                if self.image_size is not None:
+                    image_color = cv2.resize(image_original, self.image_size)
+                else:
+                    image_color = image_original
+
+                # 利用側で書き換えられないよう読み取り専用にする
+                image_color.flags.writeable = False
+
+                # リングバッファに追加して、待っているスレッドに通知する
+                with self.condition:
+                    self.latest_seq += 1
+                    self.frames.append(
+                        CapturedFrame(self.latest_seq, timestamp, image_color)
+                    )
+                    self.condition.notify_all()
+
+    # 最後にキャプチャした画像のCapturedFrameを取得する（まだキャプチャしていなければNone）
+    def get_latest_frame(self):
+        with self.condition:
+            return self.frames[-1] if self.frames else None
+
+    # 最後にキャプチャした画像を取得する（まだキャプチャしていなければNone）
+    def get_image(self):
+        captured = self.get_latest_frame()
+        return captured.image if captured is not None else None
+
+    # 指定した通し番号の画像のCapturedFrameを取得する（リングバッファに残っていなければNone）
+    def get_frame(self, seq):
+        with self.condition:
+            for captured in self.frames:
+                if captured.seq == seq:
+                    return captured
+        return None
+
+    # 通し番号がafter_seqより後の画像がキャプチャされるまで待ち、その最新の画像を取得する
+    # timeout秒以内にキャプチャされなければNoneを返す（timeout=Noneなら無期限に待つ）
+    def get_next_frame(self, after_seq=0, timeout=None):
+        with self.condition:
+            captured = self.condition.wait_for(
+                lambda: self.latest_seq > after_seq or self.stopped, timeout
+            )
+            if not captured or self.latest_seq <= after_seq:
+                return None
+            return self.frames[-1]
+
+    # リングバッファに残っている画像を古い順に取得する
+    def get_frames(self):
+        with self.condition:
+            return list(self.frames)
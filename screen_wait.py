@@ -0,0 +1,98 @@
+import time
+
+from frame_change import FrameChangeDetector
+from frame_context import FrameContext
+from stage_timer import timed
+from template_matching import get_template_image_position
+
+
+##### 画面が条件を満たすまで待つ #####
+# 呼び出した後に新しくキャプチャされた画像が届くたびに条件を判定し、満たした時点ですぐに戻る
+# capture: ScreenCapture
+# predicate: FrameContextを受け取り、条件を満たせばTrueを返す関数
+# timeout: 待つ時間の上限(秒)
+# poll: 条件を判定する最小の間隔(秒)
+# 戻り値
+#   条件を満たしたキャプチャ画像のFrameContext（タイムアウトした場合はNone）
+@timed("wait_until")
+def wait_until(capture, predicate, timeout, poll=0.05):
+    deadline = time.time() + timeout
+    seq = capture.latest_seq
+    while True:
+        captured = capture.get_next_frame(seq, max(0.0, deadline - time.time()))
+        if captured is None:
+            return None
+
+        seq = captured.seq
+        evaluated = time.time()
+        frame = FrameContext(captured.image)
+        if predicate(frame):
+            return frame
+
+        # 条件の判定が頻繁になりすぎないように間隔を空ける
+        wait = min(poll - (time.time() - evaluated), deadline - time.time())
+        if wait > 0:
+            time.sleep(wait)
+
+
+##### wait_untilの条件 #####
+# テンプレートが見つかる
+def template_visible(image_name, roi=None):
+    def predicate(frame):
+        return get_template_image_position(frame, image_name, roi) is not None
+
+    return predicate
+
+
+# テンプレートが見つからない
+def template_invisible(image_name, roi=None):
+    def predicate(frame):
+        return get_template_image_position(frame, image_name, roi) is None
+
+    return predicate
+
+
+# 基準の画面から変化した
+def screen_changed(reference_frame, threshold=4.0):
+    reference_signature = FrameChangeDetector.get_signature(reference_frame)
+
+    def predicate(frame):
+        signature = FrameChangeDetector.get_signature(frame)
+        difference = FrameChangeDetector.get_difference(signature, reference_signature)
+        return difference > threshold
+
+    return predicate
+
+
+# 画面の動きが止まった（連続するキャプチャ画像の差分が閾値以下になった）
+def screen_settled(threshold=1.5):
+    previous_signature = None
+
+    def predicate(frame):
+        nonlocal previous_signature
+        signature = FrameChangeDetector.get_signature(frame)
+        settled = previous_signature is not None and (
+            FrameChangeDetector.get_difference(signature, previous_signature)
+            <= threshold
+        )
+        previous_signature = signature
+        return settled
+
+    return predicate
+
+
+# いずれかの条件を満たした
+def any_of(*predicates):
+    def predicate(frame):
+        return any(p(frame) for p in predicates)
+
+    return predicate
+
+
+# すべての条件を満たした
+# 直前の判定結果を使う条件（screen_settled）は毎回判定されるよう先頭に置くこと
+def all_of(*predicates):
+    def predicate(frame):
+        return all(p(frame) for p in predicates)
+
+    return predicate
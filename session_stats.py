@@ -0,0 +1,156 @@
+import json
+import time
+
+# 周回の記録を書き出すファイル（1行に1周分、終了時に1行でセッション全体の集計を書き出す）
+SESSION_LOG_PATH = "./session_log.jsonl"
+
+# カード選択の戦略の名前
+CARD_STRATEGIES = ["noble_phantasm", "arts", "quick", "buster", "brave", "near_brave"]
+
+# 画面判別処理（復帰中）とみなすフェーズの名前
+RECOVERY_PHASE = "OTHER"
+
+
+##### 周回の記録 #####
+# クエストの周回数・1周あたりのターン数・フェーズごとの経過時間・使用した果実・カード選択の戦略を記録する
+# フェーズごとの経過時間は、メインループでenter_phaseを呼ぶたびに、前回呼んだときのフェーズに加算する
+# 1周終わるごとにその周の記録をファイルに1行追記する
+class SessionRecorder:
+    def __init__(self, path=SESSION_LOG_PATH):
+        self.path = path  # Noneならファイルに書き出さない
+        now = time.time()
+        self.started = now
+        self.quests = 0  # 周回数
+        self.turns = 0  # 全体のターン数（カードを選択した回数）
+        self.apples = {"golden": 0, "silver": 0}  # 使用した果実の数
+        self.card_strategies = dict.fromkeys(CARD_STRATEGIES, 0)  # 戦略 → 使用した回数
+        self.noble_phantasms = 0  # 使用した宝具の数
+        self.phase_time = {}  # フェーズの名前 → 経過時間(秒)
+        self.recoveries = 0  # 画面判別処理に入った回数
+
+        # 現在の周の記録
+        self.quest_started = now
+        self.quest_turns = 0
+        self.quest_phase_time = {}
+
+        self.current_phase = None
+        self.phase_started = now
+
+    # メインループで処理するフェーズを記録する
+    def enter_phase(self, phase_name, now=None):
+        if now is None:
+            now = time.time()
+        if self.current_phase is not None:
+            elapsed = now - self.phase_started
+            self.phase_time[self.current_phase] = (
+                self.phase_time.get(self.current_phase, 0.0) + elapsed
+            )
+            self.quest_phase_time[self.current_phase] = (
+                self.quest_phase_time.get(self.current_phase, 0.0) + elapsed
+            )
+        if phase_name == RECOVERY_PHASE and self.current_phase != RECOVERY_PHASE:
+            self.recoveries += 1
+        self.current_phase = phase_name
+        self.phase_started = now
+
+    # カード選択の戦略を記録する（1回のカード選択を1ターンとして数える）
+    def record_card_strategy(self, strategy, noble_phantasms=0):
+        self.card_strategies[strategy] += 1
+        self.noble_phantasms += noble_phantasms
+        self.turns += 1
+        self.quest_turns += 1
+
+    # 果実の使用を記録する
+    def record_apple(self, kind):
+        self.apples[kind] += 1
+
+    # 1周終わったことを記録し、その周の記録をファイルに追記する
+    def complete_quest(self, now=None):
+        if now is None:
+            now = time.time()
+        self.enter_phase(self.current_phase, now)
+        self.quests += 1
+        self.append(
+            {
+                "event": "quest",
+                "time": round(now, 1),
+                "quest": self.quests,
+                "duration_s": round(now - self.quest_started, 1),
+                "turns": self.quest_turns,
+                "phase_s": {
+                    name: round(elapsed, 1)
+                    for name, elapsed in self.quest_phase_time.items()
+                },
+            }
+        )
+        self.quest_started = now
+        self.quest_turns = 0
+        self.quest_phase_time = {}
+
+    # 1時間あたりの周回数
+    def get_quests_per_hour(self, now=None):
+        if now is None:
+            now = time.time()
+        elapsed = now - self.started
+        return self.quests * 3600 / elapsed if elapsed > 0 else 0.0
+
+    # セッション全体の集計結果
+    def summary(self, now=None):
+        if now is None:
+            now = time.time()
+        self.enter_phase(self.current_phase, now)
+        return {
+            "elapsed_s": round(now - self.started, 1),
+            "quests": self.quests,
+            "quests_per_hour": round(self.get_quests_per_hour(now), 2),
+            "turns_per_quest": (
+                round(self.turns / self.quests, 2) if self.quests else None
+            ),
+            "apples": dict(self.apples),
+            "card_strategies": dict(self.card_strategies),
+            "noble_phantasms": self.noble_phantasms,
+            "phase_s": {
+                name: round(elapsed, 1) for name, elapsed in self.phase_time.items()
+            },
+            "recoveries": self.recoveries,
+            "recovery_s": round(self.phase_time.get(RECOVERY_PHASE, 0.0), 1),
+        }
+
+    # セッション全体の集計結果をファイルに追記する
+    def save(self):
+        record = {"event": "session", "time": round(time.time(), 1)}
+        record.update(self.summary())
+        self.append(record)
+
+    def append(self, record):
+        if self.path is None:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    # 集計結果を表示する（フェーズは経過時間の長い順）
+    def print_summary(self):
+        summary = self.summary()
+        print("周回数：", summary["quests"], "(", summary["quests_per_hour"], "周/時 )")
+        print("1周あたりのターン数：", summary["turns_per_quest"])
+        print(
+            "使用した果実：",
+            "黄金",
+            summary["apples"]["golden"],
+            "/ 白銀",
+            summary["apples"]["silver"],
+        )
+        print(
+            "カード選択：",
+            summary["card_strategies"],
+            "宝具",
+            summary["noble_phantasms"],
+        )
+        print("フェーズごとの経過時間(秒)：")
+        for name, elapsed in sorted(
+            summary["phase_s"].items(), key=lambda item: item[1], reverse=True
+        ):
+            print("    {:<18} {:>10.1f}".format(name, elapsed))
+        print(
+            "画面判別処理：", summary["recoveries"], "回", summary["recovery_s"], "秒"
+        )
@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+from enum import IntEnum
+
+from stage_timer import timed
+from template_matching import THRESHOLD
+from template_registry import get_template_registry
+
+# スキルアイコン上部の白いラインの平均輝度の閾値; これより明るければスキルアイコンが存在しているとみなす
+ICON_BRIGHTNESS_THRESHOLD = 200
+
+# スキル使用不可能のときに表示される文字のテンプレート名
+COOLDOWN_TEMPLATE_NAME = "あと"
+
+
+# スキルの状態
+class SkillState(IntEnum):
+    ABSENT = 0  # スキルアイコンが存在しない
+    READY = 1  # スキル使用可能
+    COOLDOWN = 2  # スキル使用不可能（"あと"の文字が表示されている）
+
+
+##### 3x3のROIを1回で切り抜く #####
+# ROIの左上から同じ大きさ(height, width)で切り抜いた画像をまとめて取得する
+# 戻り値
+#   切り抜いた画像(ndarray; ROIの数 x height x width)
+def crop_cells(image, top_x, top_y, height, width):
+    rows = top_y[:, None] + np.arange(height)  # ROIの数 x height
+    columns = top_x[:, None] + np.arange(width)  # ROIの数 x width
+    rows = np.clip(rows, 0, image.shape[0] - 1)
+    columns = np.clip(columns, 0, image.shape[1] - 1)
+    return image[rows[:, :, None], columns[:, None, :]]
+
+
+##### スキルパネルの一括判定 #####
+# 9個のスキルの状態を、1枚のグレースケール画像から一度に判定する
+#   ・スキルアイコン上部の白いラインが見えていればスキルアイコンが存在する
+#   ・"あと"の文字が見つかればスキル使用不可能
+#     9個の文字の位置を横に並べた1枚の画像に対して、1回のテンプレートマッチングで判定する
+# letter_positions: "あと"の文字が表示される位置のROI(3x3)
+# icon_top_frames: スキルアイコン上部の白いラインのROI(3x3)
+# letter_scale: テンプレートの拡大縮小率（テンプレートを作成した画像と大きさが異なる場合に指定する）
+class SkillPanelScanner:
+    def __init__(self, letter_positions, icon_top_frames, letter_scale=1.0):
+        self.letter_positions = np.array(
+            [
+                [roi["top_x"], roi["top_y"], roi["bottom_x"], roi["bottom_y"]]
+                for rois in letter_positions
+                for roi in rois
+            ]
+        )
+        self.icon_top_frames = np.array(
+            [
+                [roi["top_x"], roi["top_y"], roi["bottom_x"], roi["bottom_y"]]
+                for rois in icon_top_frames
+                for roi in rois
+            ]
+        )
+        self.shape = (len(letter_positions), len(letter_positions[0]))
+        self.letter_scale = letter_scale
+
+    # スキルアイコンが存在するかを判定する
+    # 戻り値
+    #   スキルアイコンが存在するか(ndarray; 9), 白いラインの平均輝度(ndarray; 9)
+    def check_icons(self, image_gray):
+        top_x, top_y, bottom_x, bottom_y = self.icon_top_frames.T
+        icons = crop_cells(
+            image_gray,
+            top_x,
+            top_y,
+            int(np.min(bottom_y - top_y)),
+            int(np.min(bottom_x - top_x)),
+        )
+        brightness = np.max(np.mean(icons, axis=2), axis=1)
+        return brightness > ICON_BRIGHTNESS_THRESHOLD, brightness
+
+    # "あと"の文字が表示されているかを判定する
+    # 戻り値
+    #   文字が見つかったか(ndarray; 9), 一致度(ndarray; 9)
+    def check_letters(self, image_gray):
+        template = get_template_registry().get_scaled(
+            COOLDOWN_TEMPLATE_NAME, self.letter_scale
+        )
+        template_height, template_width = template.shape
+
+        # 大きさの異なるROIは最も大きいROIに、テンプレートより小さいROIはテンプレートの大きさに、
+        # それぞれ右下に広げて大きさを揃える
+        top_x, top_y, bottom_x, bottom_y = self.letter_positions.T
+        height = max(int(np.max(bottom_y - top_y)), template_height)
+        width = max(int(np.max(bottom_x - top_x)), template_width)
+        letters = crop_cells(image_gray, top_x, top_y, height, width)
+
+        # 横に並べた1枚の画像でテンプレートマッチングし、ROIをまたがない位置の最大値をROIごとに求める
+        mosaic = np.ascontiguousarray(letters.transpose(1, 0, 2)).reshape(
+            height, len(letters) * width
+        )
+        result = cv2.matchTemplate(mosaic, template, cv2.TM_CCOEFF_NORMED)
+        result = np.pad(result, ((0, 0), (0, template_width - 1)))
+        result = result.reshape(result.shape[0], len(letters), width)
+        score = np.max(result[:, :, : width - template_width + 1], axis=(0, 2))
+        return score > THRESHOLD, score
+
+    # スキルの状態を判定する
+    # 戻り値
+    #   スキルの状態(ndarray; 3x3, SkillStateの値)
+    @timed("skill_scan")
+    def scan(self, frame):
+        image_gray = frame.gray
+        icon_exists, _ = self.check_icons(image_gray)
+        cooldown, _ = self.check_letters(image_gray)
+
+        state = np.where(
+            icon_exists,
+            np.where(cooldown, SkillState.COOLDOWN, SkillState.READY),
+            SkillState.ABSENT,
+        )
+        return state.reshape(self.shape)
@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+# 処理時間を書き出すファイル（1行に1回分の集計結果をJSONで書き出す）
+STAGE_TIMING_PATH = "./stage_timing.jsonl"
+DUMP_INTERVAL = 60  # 集計結果を書き出す間隔(秒)
+HISTORY_SIZE = 1000  # 処理ごとに保持する直近の処理時間の数
+
+# ヒストグラムの区切り(ミリ秒); 最後の区間は最後の区切り以上のすべてを数える
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+##### 処理ごとの処理時間の計測 #####
+# キャプチャ・画像認識・シリアル通信・待機などの処理時間を、処理の名前ごとに記録する
+# 直近HISTORY_SIZE回分の処理時間からヒストグラムと中央値・95パーセンタイルを求める
+# 画像認識はスレッドプールから同時に呼ばれるため、記録はロックして行う
+class StageTimer:
+    def __init__(
+        self,
+        path=STAGE_TIMING_PATH,
+        dump_interval=DUMP_INTERVAL,
+        history_size=HISTORY_SIZE,
+    ):
+        self.path = path  # Noneならファイルに書き出さない
+        self.dump_interval = dump_interval
+        self.history_size = history_size
+        self.samples = {}  # 処理の名前 → 直近の処理時間(ミリ秒)のdeque
+        self.counts = {}  # 処理の名前 → 起動してからの回数
+        self.totals = {}  # 処理の名前 → 起動してからの合計時間(秒)
+        self.last_dump = time.time()
+        self.lock = threading.Lock()
+
+    # 処理時間(秒)を記録する
+    def record(self, stage, elapsed):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.history_size)
+                self.counts[stage] = 0
+                self.totals[stage] = 0.0
+            self.samples[stage].append(elapsed * 1000)
+            self.counts[stage] += 1
+            self.totals[stage] += elapsed
+
+    # withブロックの処理時間を記録する
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    # 処理の名前ごとの集計結果
+    # 戻り値
+    #   処理の名前 → {"count": 回数, "total_s": 合計時間, "median_ms", "p95_ms", "max_ms": 直近の処理時間の統計,
+    #                 "histogram": HISTOGRAM_BUCKETS_MS で区切った直近の処理時間の度数}
+    def summary(self):
+        with self.lock:
+            samples = {
+                stage: np.array(values) for stage, values in self.samples.items()
+            }
+            counts = dict(self.counts)
+            totals = dict(self.totals)
+
+        bins = [0] + HISTOGRAM_BUCKETS_MS + [np.inf]
+        result = {}
+        for stage in sorted(samples):
+            values = samples[stage]
+            histogram, _ = np.histogram(values, bins=bins)
+            result[stage] = {
+                "count": counts[stage],
+                "total_s": round(totals[stage], 3),
+                "median_ms": round(float(np.median(values)), 3),
+                "p95_ms": round(float(np.percentile(values, 95)), 3),
+                "max_ms": round(float(np.max(values)), 3),
+                "histogram": histogram.tolist(),
+            }
+        return result
+
+    # 集計結果をファイルに1行追記する
+    def dump(self):
+        self.last_dump = time.time()
+        if self.path is None:
+            return
+        record = {"time": round(self.last_dump, 3), "stages": self.summary()}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    # 前回書き出してからdump_interval秒経っていれば書き出す
+    def dump_if_due(self):
+        if time.time() - self.last_dump >= self.dump_interval:
+            self.dump()
+
+    # 集計結果を合計時間の長い順に表示する
+    def print_summary(self):
+        summary = self.summary()
+        print(
+            "{:<28} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+                "処理", "回数", "合計(秒)", "中央値(ms)", "95%(ms)", "最大(ms)"
+            )
+        )
+        for stage, result in sorted(
+            summary.items(), key=lambda item: item[1]["total_s"], reverse=True
+        ):
+            print(
+                "{:<28} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                    stage,
+                    result["count"],
+                    result["total_s"],
+                    result["median_ms"],
+                    result["p95_ms"],
+                    result["max_ms"],
+                )
+            )
+
+
+# 全モジュールで共有する処理時間の計測インスタンス
+_stage_timer = None
+_stage_timer_lock = threading.Lock()
+
+
+def get_stage_timer():
+    global _stage_timer
+    with _stage_timer_lock:
+        if _stage_timer is None:
+            _stage_timer = StageTimer()
+        return _stage_timer
+
+
+# withブロックの処理時間を共有の計測インスタンスに記録する
+def span(stage):
+    return get_stage_timer().span(stage)
+
+
+# 関数の処理時間を共有の計測インスタンスに記録するデコレータ
+def timed(stage):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,132 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import fgo_auto
+from debug_writer import get_debug_writer
+from phase_transition import PHASE_TRANSITION_PATH
+from screen_capture import ScreenCapture, get_capture_pipeline
+from session_stats import SESSION_LOG_PATH
+from stage_timer import get_stage_timer, span
+from touch_controller import SERIAL_PORT, AsyncTouchController
+
+# 端末の処理を止めるときに、実行中の処理が終わるのを待つ時間の上限(秒)
+STOP_TIMEOUT = 30
+
+
+# 端末ごとの保存先のパス（例: ./phase_transition.json → ./phase_transition_端末名.json）
+def get_device_path(path, name):
+    root, extension = os.path.splitext(path)
+    return root + "_" + name + extension
+
+
+##### 複数端末の同時制御 #####
+# 端末ごとに専用のスレッドでfgo_auto.Deviceの状態遷移を独立に進める
+# テンプレート画像と画面判別のスレッドプールは全端末で共有する
+# 画像認識の処理(OpenCV)はGILを解放するので、端末のスレッドと共有のスレッドプールで複数のコアに分散する
+# configs: 端末の設定のリスト
+#   {"name": 端末名, "window_name": キャプチャするウィンドウ名, "port": シリアルポート}
+#   ウィンドウ名の代わりに"window_id"（ウィンドウID）、"source"（cv2.VideoCaptureに渡す文字列）も指定できる
+class DeviceSupervisor:
+    def __init__(self, configs):
+        self.configs = configs
+        self.devices = []
+        self.threads = []
+        self.stopped = False
+
+    # 設定から端末を作成する
+    def create_device(self, config):
+        name = config["name"]
+        tc = AsyncTouchController(
+            port=config.get("port", SERIAL_PORT), transform=fgo_auto.transform
+        )
+        if "source" in config:
+            source = config["source"]
+        else:
+            source = get_capture_pipeline(
+                fgo_auto.WORKING_WIDTH,
+                fgo_auto.WORKING_HEIGHT,
+                window_name=config.get("window_name"),
+                window_id=config.get("window_id"),
+            )
+        sc = ScreenCapture(source)
+        sc.start()
+        return fgo_auto.Device(
+            tc,
+            sc,
+            name=name,
+            phase_transition_path=get_device_path(PHASE_TRANSITION_PATH, name),
+            session_log_path=get_device_path(SESSION_LOG_PATH, name),
+        )
+
+    # すべての端末の処理を開始する
+    def start(self):
+        for config in self.configs:
+            device = self.create_device(config)
+            thread = threading.Thread(
+                target=self.run_device, args=(device,), name=device.name, daemon=True
+            )
+            self.devices.append(device)
+            self.threads.append(thread)
+            thread.start()
+
+    # 1台の端末の処理を繰り返す
+    # 画面判別処理を繰り返してもフェーズが判別不明の場合は、その端末だけ処理を止める
+    def run_device(self, device):
+        if device.sc.get_next_frame(0, fgo_auto.CAPTURE_TIMEOUT) is None:
+            print(device.name + "：キャプチャできませんでした")
+            return
+
+        while not self.stopped:
+            if not device.step():
+                continue
+            if device.error_counter >= fgo_auto.MAX_ERROR_COUNT:
+                print(device.name + "：エラー：現在のフェーズが判別できませんでした")
+                break
+            with span("sleep"):
+                time.sleep(0.2)
+
+    # 処理中の端末があるか
+    def is_running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    # すべての端末の処理を止め、周回の記録を保存する
+    def stop(self):
+        self.stopped = True
+        for thread in self.threads:
+            thread.join(STOP_TIMEOUT)
+        for device in self.devices:
+            device.tc.wait(STOP_TIMEOUT)
+            device.close()
+
+
+if __name__ == "__main__":
+    # 使い方: python supervisor.py 端末の設定のJSON
+    # 端末の設定のJSONは [{"name": "ipad", "window_name": "rpiplay", "port": "/dev/ttyUSB0"}, ...] の形式
+    with open(sys.argv[1], encoding="utf-8") as f:
+        configs = json.load(f)
+
+    # テンプレート画像の拡大縮小・学習済みのROIの読み込みは全端末で一度だけ行う
+    fgo_auto.setup_recognition()
+
+    supervisor = DeviceSupervisor(configs)
+    supervisor.start()
+
+    stage_timer = get_stage_timer()
+    try:
+        while supervisor.is_running():
+            time.sleep(1)
+            stage_timer.dump_if_due()
+    except KeyboardInterrupt:
+        pass
+
+    supervisor.stop()
+    stage_timer.dump()
+    stage_timer.print_summary()
+    for device in supervisor.devices:
+        print("----- " + device.name + " -----")
+        device.session_recorder.print_summary()
+    get_debug_writer().close()
+    print("プログラムを終了します")
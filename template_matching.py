@@ -0,0 +1,232 @@
+import cv2
+import numpy as np
+
+from debug_writer import IMAGE_SCALE as DEBUG_IMAGE_SCALE, get_debug_writer
+from stage_timer import span
+from template_registry import get_template_registry
+
+THRESHOLD = 0.80  # 一致度の閾値; 一致度の最大値がこの閾値以上であれば、テンプレートと一致したとみなす
+
+# ピラミッドを用いたテンプレートマッチングの設定（configure_pyramid_matching参照）
+PYRAMID_MIN_TEMPLATE_SIZE = 8  # 縮小後のテンプレートの幅・高さの最小値(pixel)
+_pyramid_levels = 1  # ピラミッドの段数; 1なら縮小せずに全体を探索する
+_pyramid_candidates = 3  # 縮小画像で見つけた候補のうち、原寸で詳細に探索する数
+_pyramid_margin = 2  # 詳細探索で候補の周囲に取る余白(縮小画像のpixel)
+
+# 学習済みのROIを管理するインスタンス（roi_learner.RoiLearner）
+_roi_learner = None
+
+
+# テンプレートが一致したときに呼び出す関数のリスト
+_match_listeners = []
+
+
+# テンプレート探索に使うROIの学習器を設定する
+def set_roi_learner(roi_learner):
+    global _roi_learner
+    _roi_learner = roi_learner
+
+
+# テンプレートが一致したときに呼び出す関数を追加する（プレビューへの表示など）
+# listener(テンプレート名, top_x, top_y, 幅, 高さ, 一致度)の形で呼び出される
+def add_match_listener(listener):
+    _match_listeners.append(listener)
+
+
+# ピラミッドを用いたテンプレートマッチングの精度と速度のバランスを設定する
+# levels: ピラミッドの段数; 大きいほど高速だが、小さなテンプレートや細かい模様を見逃しやすい
+# candidates: 原寸で詳細に探索する候補数; 大きいほど見逃しにくいが低速になる
+# margin: 詳細探索で候補の周囲に取る余白(縮小画像のpixel)
+def configure_pyramid_matching(levels=1, candidates=3, margin=2):
+    global _pyramid_levels, _pyramid_candidates, _pyramid_margin
+    _pyramid_levels = max(1, levels)
+    _pyramid_candidates = max(1, candidates)
+    _pyramid_margin = max(0, margin)
+
+
+##### テンプレートマッチング処理 #####
+# 戻り値
+#   一致度の最大値, 一致した領域の左上座標(x, y), テンプレートの幅, 高さ
+def match_template(frame, image_name, roi=None):
+    if _pyramid_levels > 1:
+        return match_template_pyramid(
+            frame,
+            image_name,
+            roi,
+            _pyramid_levels,
+            _pyramid_candidates,
+            _pyramid_margin,
+        )
+    else:
+        return match_template_exact(frame, image_name, roi)
+
+
+##### 全体を探索するテンプレートマッチング処理 #####
+def match_template_exact(frame, image_name, roi=None):
+    # キャプチャ画像のグレースケール画像を取得
+    image_gray = frame.gray
+
+    # ROIの設定
+    if roi is not None:
+        image_gray = frame.crop(roi)
+
+    # 読み込み済みのグレースケールのテンプレート画像を取得する
+    template = get_template_registry().get(image_name)
+
+    # テンプレートマッチング処理
+    result = cv2.matchTemplate(image_gray, template, cv2.TM_CCOEFF_NORMED)
+
+    # 一致度の最大値と位置を取得
+    _, max_val, _, max_loc = cv2.minMaxLoc(result)
+    top_x, top_y = max_loc
+    if roi is not None:
+        top_x += roi["top_x"]
+        top_y += roi["top_y"]
+    width, height = template.shape[::-1]
+
+    return max_val, (top_x, top_y), width, height
+
+
+##### ピラミッドを用いた高速なテンプレートマッチング処理 #####
+# 縮小画像と縮小テンプレートで候補を探し、原寸では候補の周囲だけを探索する
+# 戻り値はmatch_template_exactと同じ
+def match_template_pyramid(frame, image_name, roi=None, levels=3, candidates=3, margin=2):
+    template_pyramid = get_template_registry().get_pyramid(image_name, levels)
+    template = template_pyramid[0]
+    height, width = template.shape
+
+    # 縮小後のテンプレートが小さくなりすぎない段数まで縮小する
+    level = 0
+    while level + 1 < levels and (
+        min(template_pyramid[level + 1].shape) >= PYRAMID_MIN_TEMPLATE_SIZE
+    ):
+        level += 1
+    if level == 0:
+        return match_template_exact(frame, image_name, roi)
+
+    # 探索対象のピラミッドを取得
+    if roi is None:
+        image_pyramid = frame.pyramid(level + 1)
+        offset_x, offset_y = 0, 0
+    else:
+        image_pyramid = [frame.crop(roi)]
+        for _ in range(level):
+            image_pyramid.append(cv2.pyrDown(image_pyramid[-1]))
+        offset_x, offset_y = roi["top_x"], roi["top_y"]
+    image_gray = image_pyramid[0]
+    image_coarse = image_pyramid[level]
+    template_coarse = template_pyramid[level]
+    coarse_height, coarse_width = template_coarse.shape
+    if (
+        image_coarse.shape[0] < coarse_height
+        or image_coarse.shape[1] < coarse_width
+    ):
+        return match_template_exact(frame, image_name, roi)
+
+    # 縮小画像でテンプレートマッチング処理を行い、一致度の高い順に候補を取り出す
+    result = cv2.matchTemplate(image_coarse, template_coarse, cv2.TM_CCOEFF_NORMED)
+    scale = 2**level
+    best_val, best_loc = -1.0, (0, 0)
+    for _ in range(candidates):
+        _, coarse_val, _, (coarse_x, coarse_y) = cv2.minMaxLoc(result)
+        if coarse_val <= -1.0:
+            break
+
+        # 同じ場所が再び候補にならないように、候補の周囲を塗りつぶす
+        result[
+            max(0, coarse_y - coarse_height // 2) : coarse_y + coarse_height // 2 + 1,
+            max(0, coarse_x - coarse_width // 2) : coarse_x + coarse_width // 2 + 1,
+        ] = -1.0
+
+        # 原寸の画像で候補の周囲だけを探索する
+        window_top_x = max(0, (coarse_x - margin) * scale)
+        window_top_y = max(0, (coarse_y - margin) * scale)
+        window_bottom_x = min(
+            image_gray.shape[1], (coarse_x + margin + 1) * scale + width
+        )
+        window_bottom_y = min(
+            image_gray.shape[0], (coarse_y + margin + 1) * scale + height
+        )
+        window = image_gray[window_top_y:window_bottom_y, window_top_x:window_bottom_x]
+        if window.shape[0] < height or window.shape[1] < width:
+            continue
+        fine = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, (top_x, top_y) = cv2.minMaxLoc(fine)
+        if max_val > best_val:
+            best_val = max_val
+            best_loc = (window_top_x + top_x, window_top_y + top_y)
+
+    return best_val, (best_loc[0] + offset_x, best_loc[1] + offset_y), width, height
+
+
+##### 任意画像の位置と一致度の認識 #####
+# ROIを指定しない場合、学習済みのROIがあればその範囲だけを探索する
+# ROIで見つからなかった場合は、ROIの学習中か、連続して何度も見つからなかった場合だけ全体を探索する
+# （RoiLearner.record_miss参照）
+# 戻り値
+#   一致するエリアの中心座標（一致しなければNone）, 一致度の最大値
+def get_template_match(
+    frame, image_name, roi=None, debug_mode=False, use_learned_roi=True
+):
+    max_val = None
+
+    with span("match:" + image_name):
+        # 学習済みのROIで探索
+        if roi is None and use_learned_roi and _roi_learner is not None:
+            learned_roi = _roi_learner.get_roi(image_name, frame.shape)
+            if learned_roi is not None:
+                max_val, (top_x, top_y), width, height = match_template(
+                    frame, image_name, learned_roi
+                )
+                if max_val > THRESHOLD:
+                    _roi_learner.record_hit(image_name)
+                elif _roi_learner.record_miss(image_name):
+                    # 見つからなければ全体の探索に切り替える
+                    max_val = None
+
+        if max_val is None:
+            max_val, (top_x, top_y), width, height = match_template(
+                frame, image_name, roi
+            )
+
+    if debug_mode:
+        # 検出領域を四角で囲んだ画像を別スレッドで保存する
+        get_debug_writer().save_image(
+            image_name,
+            frame.color,
+            [(top_x, top_y, top_x + width, top_y + height)],
+            scale=DEBUG_IMAGE_SCALE,
+        )
+        print(
+            "image_name:",
+            image_name,
+            "    max_val:",
+            max_val,
+            "    max_loc:",
+            (top_x, top_y),
+        )
+
+    # 一致度が閾値以上：一致するエリアの中心座標を返す
+    # 一致度が閾値以下：Noneを返す
+    if max_val > THRESHOLD:
+        # 一致した位置をROIの学習に使う
+        if roi is None and _roi_learner is not None:
+            _roi_learner.record(image_name, top_x, top_y, width, height)
+        for listener in _match_listeners:
+            listener(image_name, top_x, top_y, width, height, max_val)
+
+        # タップの位置を求める
+        tap_position = np.array([top_x + int(width / 2), top_y + int(height / 2)])
+        return tap_position, max_val
+    else:
+        return None, max_val
+
+
+##### 任意画像の位置の認識 #####
+def get_template_image_position(
+    frame, image_name, roi=None, debug_mode=False, use_learned_roi=True
+):
+    tap_position, _ = get_template_match(
+        frame, image_name, roi, debug_mode, use_learned_roi
+    )
+    return tap_position
@@ -0,0 +1,127 @@
+import cv2
+import glob
+import os
+import threading
+
+# テンプレート画像の格納場所（実行時のカレントディレクトリによらず、このファイルと同じ場所のpict/）
+TEMPLATE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pict")
+
+
+##### テンプレート画像の管理 #####
+# 起動時にpict/以下のテンプレート画像をすべてグレースケールで読み込んで保持する
+# 拡大縮小した画像・マスク・ピラミッドなどの派生画像も初回要求時に作成してキャッシュする
+# 処理する画像の大きさが基準と異なる場合は、set_scaleで起動時に一度だけテンプレート画像を拡大縮小する
+# 拡大縮小した画像は倍率ごとにキャッシュし、同じ倍率（レイアウト）に戻すときは作り直さない
+class TemplateRegistry:
+    def __init__(self, directory=TEMPLATE_DIRECTORY):
+        self.directory = directory
+        self.templates = {}  # テンプレート名 → グレースケール画像
+        self.masks = {}  # テンプレート名 → マスク画像(アルファチャンネル)
+        self.originals = {}  # テンプレート名 → (原寸のグレースケール画像, 原寸のマスク画像)
+        self.scale = (1.0, 1.0)  # 原寸に対するテンプレート画像の倍率(横, 縦)
+        self.derived = {}  # (種別, テンプレート名, パラメータ) → 派生画像
+        self.scaled_sets = {}  # 倍率(横, 縦) → (templates, masks, derived)
+        self.lock = threading.Lock()
+
+        for path in sorted(glob.glob(os.path.join(directory, "*.png"))):
+            image_name = os.path.splitext(os.path.basename(path))[0]
+            image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            if image is None:
+                continue
+
+            # グレースケール化して保持
+            if image.ndim == 2:
+                self.templates[image_name] = image
+            elif image.shape[2] == 4:
+                self.templates[image_name] = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+                self.masks[image_name] = image[:, :, 3].copy()
+            else:
+                self.templates[image_name] = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            self.originals[image_name] = (
+                self.templates[image_name],
+                self.masks.get(image_name),
+            )
+
+    def __contains__(self, image_name):
+        return image_name in self.templates
+
+    def names(self):
+        return list(self.templates.keys())
+
+    # グレースケールのテンプレート画像を取得する
+    def get(self, image_name):
+        try:
+            return self.templates[image_name]
+        except KeyError:
+            raise KeyError(
+                "テンプレート画像が見つかりません: "
+                + os.path.join(self.directory, image_name + ".png")
+            )
+
+    # テンプレート画像のマスクを取得する（アルファチャンネルが無い場合はNone）
+    def get_mask(self, image_name):
+        self.get(image_name)
+        return self.masks.get(image_name)
+
+    # すべてのテンプレート画像を原寸から指定倍率(横, 縦)に拡大縮小する
+    # 以降get, get_mask, get_scaled, get_pyramidは拡大縮小後の画像を基準にする
+    def set_scale(self, scale_x, scale_y):
+        with self.lock:
+            self.scaled_sets[self.scale] = (self.templates, self.masks, self.derived)
+            self.scale = (scale_x, scale_y)
+            if self.scale in self.scaled_sets:
+                self.templates, self.masks, self.derived = self.scaled_sets[self.scale]
+                return
+
+            self.templates, self.masks, self.derived = {}, {}, {}
+            for image_name, (template, mask) in self.originals.items():
+                self.templates[image_name] = self.resize(template, scale_x, scale_y)
+                if mask is not None:
+                    self.masks[image_name] = self.resize(mask, scale_x, scale_y)
+
+    @staticmethod
+    def resize(image, scale_x, scale_y):
+        if scale_x == 1.0 and scale_y == 1.0:
+            return image
+        height, width = image.shape[:2]
+        size = (max(1, round(width * scale_x)), max(1, round(height * scale_y)))
+        interpolation = (
+            cv2.INTER_AREA if scale_x * scale_y < 1.0 else cv2.INTER_LINEAR
+        )
+        return cv2.resize(image, size, interpolation=interpolation)
+
+    # 指定倍率に拡大縮小したテンプレート画像を取得する
+    def get_scaled(self, image_name, scale):
+        if scale == 1.0:
+            return self.get(image_name)
+
+        key = ("scaled", image_name, round(scale, 6))
+        with self.lock:
+            if key not in self.derived:
+                self.derived[key] = self.resize(self.get(image_name), scale, scale)
+            return self.derived[key]
+
+    # テンプレート画像のピラミッド（段数分だけ1/2に縮小した画像のリスト）を取得する
+    # 戻り値の先頭が原寸の画像
+    def get_pyramid(self, image_name, levels):
+        key = ("pyramid", image_name, levels)
+        with self.lock:
+            if key not in self.derived:
+                pyramid = [self.get(image_name)]
+                for _ in range(levels - 1):
+                    pyramid.append(cv2.pyrDown(pyramid[-1]))
+                self.derived[key] = pyramid
+            return self.derived[key]
+
+
+# 全モジュールで共有するテンプレート画像の管理インスタンス
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_template_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TemplateRegistry()
+        return _registry
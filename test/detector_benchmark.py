@@ -0,0 +1,137 @@
+import cv2
+import glob
+import json
+import numpy as np
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fgo_auto
+from frame_context import FrameContext
+from template_matching import configure_pyramid_matching, get_template_image_position
+from template_registry import get_template_registry
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT_DIRECTORY, "test", "benchmark_baseline.json")
+
+BENCHMARK_REPEAT = 30  # 1枚の画像あたりに計測する回数
+ALLOCATION_REPEAT = 3  # 1枚の画像あたりにメモリ確保量を計測する回数
+REGRESSION_RATIO = 1.2  # 基準値に対してこの倍率を超えて遅くなれば性能低下とみなす
+
+
+# 計測対象の検出処理
+# 画像ごとの処理結果のキャッシュが効かないよう、毎回新しいFrameContextを渡す
+DETECTORS = [
+    ("get_template_image_position", lambda f: get_template_image_position(f, "attack")),
+    ("get_card_type", lambda f: fgo_auto.get_card_type(f)),
+    ("get_np_gauge", lambda f: fgo_auto.get_np_gauge(f)),
+    ("get_brave_chain_combination", lambda f: fgo_auto.get_brave_chain_combination(f)),
+    ("skill_scanner.scan", lambda f: fgo_auto.skill_scanner.scan(f)),
+    ("phase_classifier.classify", lambda f: fgo_auto.phase_classifier.classify(f)),
+]
+
+
+# test/のサンプル画像を処理する画像の大きさで読み込む
+def load_sample_images():
+    images = []
+    for path in sorted(glob.glob(os.path.join(ROOT_DIRECTORY, "test", "*.png"))):
+        image_color = cv2.imread(path)
+        images.append(
+            cv2.resize(image_color, (fgo_auto.WORKING_WIDTH, fgo_auto.WORKING_HEIGHT))
+        )
+    return images
+
+
+##### 検出処理の処理時間とメモリ確保量を計測する #####
+# 戻り値
+#   {"median_ms": 処理時間の中央値, "p95_ms": 処理時間の95パーセンタイル, "peak_kb": 1回あたりのメモリ確保量の最大値}
+def measure(detector, images, repeat=BENCHMARK_REPEAT):
+    # 初回のみの処理（テンプレートの縮小など）を計測から除く
+    for image in images:
+        detector(FrameContext(image))
+
+    elapsed = []
+    for _ in range(repeat):
+        for image in images:
+            frame = FrameContext(image)
+            started = time.perf_counter()
+            detector(frame)
+            elapsed.append(time.perf_counter() - started)
+
+    peaks = []
+    tracemalloc.start()
+    for _ in range(ALLOCATION_REPEAT):
+        for image in images:
+            frame = FrameContext(image)
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            detector(frame)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - baseline)
+    tracemalloc.stop()
+
+    elapsed_ms = np.array(elapsed) * 1000
+    return {
+        "median_ms": float(np.median(elapsed_ms)),
+        "p95_ms": float(np.percentile(elapsed_ms, 95)),
+        "peak_kb": float(np.max(peaks)) / 1024,
+    }
+
+
+def run_benchmark(repeat=BENCHMARK_REPEAT):
+    # 実機と同じ設定にする
+    get_template_registry().set_scale(*fgo_auto.layout.template_scale)
+    configure_pyramid_matching(fgo_auto.PYRAMID_LEVELS, fgo_auto.PYRAMID_CANDIDATES)
+
+    images = load_sample_images()
+    return {name: measure(detector, images, repeat) for name, detector in DETECTORS}
+
+
+# 計測結果を基準値と比べて表示する
+# 戻り値
+#   性能が低下した検出処理の名前のリスト
+def report(results, baseline=None):
+    regressions = []
+    print(
+        "{:<30} {:>10} {:>10} {:>10} {:>10}".format(
+            "detector", "median_ms", "p95_ms", "peak_kb", "vs_base"
+        )
+    )
+    for name, result in results.items():
+        ratio = ""
+        if baseline is not None and name in baseline:
+            ratio_value = result["median_ms"] / baseline[name]["median_ms"]
+            ratio = "{:.2f}x".format(ratio_value)
+            if ratio_value > REGRESSION_RATIO:
+                ratio += " !"
+                regressions.append(name)
+        print(
+            "{:<30} {:>10.2f} {:>10.2f} {:>10.1f} {:>10}".format(
+                name, result["median_ms"], result["p95_ms"], result["peak_kb"], ratio
+            )
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    # 使い方: python test/detector_benchmark.py [--save-baseline]
+    #   --save-baseline: 計測結果を基準値として保存する
+    results = run_benchmark()
+
+    baseline = None
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    regressions = report(results, baseline)
+    if regressions:
+        print("性能が低下しました：", ", ".join(regressions))
+
+    if "--save-baseline" in sys.argv:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+        print("基準値を保存しました：" + BASELINE_PATH)
+
+    sys.exit(1 if regressions else 0)
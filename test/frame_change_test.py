@@ -0,0 +1,85 @@
+import cv2
+import glob
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_change import FrameChangeDetector
+from frame_context import FrameContext
+
+# 処理する画像の大きさ（fgo_auto.pyのWINDOW_WIDTH x WINDOW_HEIGHT）
+WORKING_WIDTH = 1728
+WORKING_HEIGHT = 798
+TEMPLATE_SCALE = WORKING_HEIGHT / 842  # テンプレート画像(1823x842の画像から作成)の倍率
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 待っている間に現れるボタン（box_opener.pyとfgo_auto.pyの画面判別処理で探すもの）
+BUTTON_NAMES = ["open_box", "リセット", "close", "連続出撃"]
+
+
+def load_samples():
+    return [
+        cv2.resize(cv2.imread(path), (WORKING_WIDTH, WORKING_HEIGHT))
+        for path in sorted(glob.glob(os.path.join(ROOT_DIRECTORY, "test", "*.png")))
+    ]
+
+
+def load_template(image_name):
+    template = cv2.imread(
+        os.path.join(ROOT_DIRECTORY, "pict", image_name + ".png"), cv2.IMREAD_GRAYSCALE
+    )
+    return cv2.resize(
+        template,
+        None,
+        fx=TEMPLATE_SCALE,
+        fy=TEMPLATE_SCALE,
+        interpolation=cv2.INTER_AREA,
+    )
+
+
+# 画像の中央にテンプレートを貼り付ける
+def paste_template(image_color, template):
+    height, width = template.shape[:2]
+    top_x = (image_color.shape[1] - width) // 2
+    top_y = (image_color.shape[0] - height) // 2
+    image_pasted = image_color.copy()
+    image_pasted[top_y : top_y + height, top_x : top_x + width] = cv2.cvtColor(
+        template, cv2.COLOR_GRAY2BGR
+    )
+    return image_pasted
+
+
+# ボタンが現れたら、前回の認識結果を使い回さないこと
+def test_button_appearance_is_not_skipped():
+    for image_color in load_samples():
+        for image_name in BUTTON_NAMES:
+            template = load_template(image_name)
+            detector = FrameChangeDetector()
+            detector.store(FrameContext(image_color), "cached")
+            skip, _ = detector.lookup(
+                FrameContext(paste_template(image_color, template))
+            )
+            assert not skip, image_name
+
+
+# 圧縮ノイズ程度の違いしかなければ、前回の認識結果を使い回すこと
+def test_static_screen_is_skipped():
+    for image_color in load_samples():
+        _, encoded = cv2.imencode(".jpg", image_color, [cv2.IMWRITE_JPEG_QUALITY, 60])
+        detector = FrameChangeDetector()
+        detector.store(FrameContext(image_color), "cached")
+        assert detector.lookup(FrameContext(cv2.imdecode(encoded, 1))) == (
+            True,
+            "cached",
+        )
+
+
+# 動いている最中かは、直前にキャプチャされたフレームと比べて判定すること
+def test_motion_uses_previous_capture():
+    image_color = load_samples()[0]
+    frame = FrameContext(image_color)
+    detector = FrameChangeDetector()
+    assert detector.lookup(frame) == (False, None)
+    assert detector.lookup(frame, FrameContext(image_color)) == (False, None)
+    assert detector.lookup(frame, FrameContext(255 - image_color)) == (True, None)
@@ -0,0 +1,44 @@
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fgo_auto
+from frame_context import FrameContext
+
+ORANGE = (0, 165, 255)  # 満タンの通常のバーの色(BGR)
+RED = (0, 0, 255)  # オーバーチャージ中のバーの色(BGR)
+WRAPPED_RED = (40, 0, 255)  # 色相が179側の赤(BGR)
+
+
+# 3本のNPゲージを指定した色で塗った画像を作成する
+# bars: ゲージごとの(色, 塗る割合)のリスト（左から順に重ねて塗る）
+def make_frame(bars):
+    image_color = np.zeros(
+        (fgo_auto.WORKING_HEIGHT, fgo_auto.WORKING_WIDTH, 3), dtype=np.uint8
+    )
+    for roi, segments in zip(fgo_auto.NP_POSITION, bars):
+        width = roi["bottom_x"] - roi["top_x"]
+        for color, ratio in segments:
+            bottom_x = roi["top_x"] + int(round(width * ratio))
+            image_color[roi["top_y"] : roi["bottom_y"], roi["top_x"] : bottom_x] = color
+    return FrameContext(image_color)
+
+
+# 満タンの通常のバーはオーバーチャージとみなさないこと
+def test_full_orange_bar_is_100_percent():
+    np_gauge = fgo_auto.get_np_gauge(make_frame([[(ORANGE, 1.0)]] * 3))
+    assert np.allclose(np_gauge, 100.0)
+
+
+def test_overcharge_bar():
+    np_gauge = fgo_auto.get_np_gauge(
+        make_frame(
+            [
+                [(RED, 1.0)],
+                [(ORANGE, 1.0), (WRAPPED_RED, 0.5)],
+                [(ORANGE, 0.5)],
+            ]
+        )
+    )
+    assert np.allclose(np_gauge, [200.0, 150.0, 50.0], atol=2.0), np_gauge
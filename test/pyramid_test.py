@@ -0,0 +1,96 @@
+import cv2
+import glob
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_context import FrameContext
+from template_matching import (
+    THRESHOLD,
+    match_template_exact,
+    match_template_pyramid,
+)
+from template_registry import get_template_registry
+
+IMAGE_WIDTH = 1823
+IMAGE_HEIGHT = 842
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYRAMID_SETTINGS = [(2, 3), (3, 3), (3, 5)]  # (ピラミッドの段数, 詳細探索する候補数)
+
+
+# test/のサンプル画像と、pict/のテンプレートを貼り付けた画像を作成する
+def make_sample_frames():
+    rng = np.random.default_rng(0)
+
+    samples = []
+    for path in sorted(glob.glob(os.path.join(ROOT_DIRECTORY, "test", "*.png"))):
+        image_color = cv2.resize(cv2.imread(path), (IMAGE_WIDTH, IMAGE_HEIGHT))
+        samples.append((os.path.basename(path), image_color))
+
+    frames = [(sample_name, None, image_color) for sample_name, image_color in samples]
+    for i, image_name in enumerate(get_template_registry().names()):
+        # テンプレートごとにサンプル画像を切り替えて、ランダムな位置に貼り付ける
+        sample_name, image_color = samples[i % len(samples)]
+        template = cv2.imread(os.path.join(ROOT_DIRECTORY, "pict", image_name + ".png"))
+        height, width = template.shape[:2]
+        top_x = int(rng.integers(0, IMAGE_WIDTH - width))
+        top_y = int(rng.integers(0, IMAGE_HEIGHT - height))
+        image_pasted = image_color.copy()
+        image_pasted[top_y : top_y + height, top_x : top_x + width] = template
+        frames.append((sample_name, (image_name, top_x, top_y), image_pasted))
+    return frames
+
+
+# ピラミッドを用いた探索が全体の探索と同じ結果になるか確認する
+# 戻り値
+#   ピラミッドの設定 → 結果が一致しなかった組み合わせのリスト
+def check_pyramid_agreement(settings=PYRAMID_SETTINGS):
+    templates = get_template_registry()
+    mismatches = {setting: [] for setting in settings}
+    for sample_name, pasted, image_color in make_sample_frames():
+        frame = FrameContext(image_color)
+        for image_name in templates.names():
+            exact_val, exact_loc, _, _ = match_template_exact(frame, image_name)
+            exact_found = exact_val > THRESHOLD
+            for levels, candidates in settings:
+                fast_val, fast_loc, _, _ = match_template_pyramid(
+                    frame, image_name, None, levels, candidates
+                )
+                fast_found = fast_val > THRESHOLD
+
+                # 全体の探索と判定結果・位置が一致すること
+                # 貼り付けたテンプレートは必ず見つかること
+                agreed = exact_found == fast_found and (
+                    not exact_found
+                    or np.max(np.abs(np.subtract(exact_loc, fast_loc))) <= 1
+                )
+                if pasted is not None and pasted[0] == image_name:
+                    agreed = agreed and fast_found
+                if not agreed:
+                    mismatches[(levels, candidates)].append(
+                        (sample_name, pasted, image_name, exact_val, fast_val, fast_loc)
+                    )
+    return mismatches
+
+
+def test_pyramid_matching_agrees_with_exact_matching():
+    # テンプレート画像が読み込めていなければ何も比較されないので、先に確かめる
+    assert len(get_template_registry().names()) > 0
+    for setting, mismatch_list in check_pyramid_agreement().items():
+        assert mismatch_list == [], setting
+
+
+if __name__ == "__main__":
+    for (levels, candidates), mismatch_list in check_pyramid_agreement().items():
+        print(
+            "levels:",
+            levels,
+            "    candidates:",
+            candidates,
+            "    mismatches:",
+            len(mismatch_list),
+        )
+        for mismatch in mismatch_list:
+            print("    ", mismatch)
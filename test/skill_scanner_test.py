@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_context import FrameContext
+from layout_profile import get_layout
+from skill_scanner import SkillPanelScanner, SkillState
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# サンプル画像(960x540)のレイアウト（layout_profile.py参照）
+LAYOUT = get_layout("iphone_7", (960, 540))
+
+A = SkillState.ABSENT
+R = SkillState.READY
+C = SkillState.COOLDOWN
+
+# サンプル画像ごとのスキルの状態（右のサーヴァントから順）
+EXPECTED_STATES = {
+    "skill_sample_1.png": [[R, R, R], [R, R, R], [R, R, R]],
+    "skill_sample_2.png": [[C, C, C], [C, C, C], [C, C, C]],
+    "skill_sample_3.png": [[R, C, R], [R, C, R], [R, C, R]],
+    "skill_sample_4.png": [[C, C, C], [A, A, A], [A, A, A]],
+}
+
+
+# サンプル画像のスキルの状態を判定する
+# 戻り値
+#   サンプル画像名 → (判定結果, 期待する結果)
+def scan_samples():
+    # テンプレート画像(1823x842の画像から作成)をサンプル画像の大きさに合わせる
+    scanner = SkillPanelScanner(
+        LAYOUT.rois["skill_letter"],
+        LAYOUT.rois["skill_icon_top_frame"],
+        letter_scale=LAYOUT.template_scale[1],
+    )
+    results = {}
+    for sample_name, expected in EXPECTED_STATES.items():
+        image_color = cv2.imread(os.path.join(ROOT_DIRECTORY, "test", sample_name))
+        results[sample_name] = (scanner.scan(FrameContext(image_color)), expected)
+    return results
+
+
+def test_skill_panel_scanner():
+    for sample_name, (state, expected) in scan_samples().items():
+        assert np.array_equal(state, expected), sample_name
+
+
+if __name__ == "__main__":
+    for sample_name, (state, expected) in scan_samples().items():
+        print(sample_name, np.array_equal(state, expected))
+        print(state)
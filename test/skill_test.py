@@ -1,118 +1,40 @@
 import cv2
 import numpy as np
+import os
+import sys
 
-SKILL_LETTER_POSITION = [
-    [
-        {"top_x": 27, "top_y": 449, "bottom_x": 53, "bottom_y": 462},
-        {"top_x": 93, "top_y": 449, "bottom_x": 119, "bottom_y": 462},
-        {"top_x": 159, "top_y": 449, "bottom_x": 185, "bottom_y": 462},
-    ],
-    [
-        {"top_x": 264, "top_y": 449, "bottom_x": 290, "bottom_y": 462},
-        {"top_x": 330, "top_y": 449, "bottom_x": 356, "bottom_y": 462},
-        {"top_x": 396, "top_y": 449, "bottom_x": 422, "bottom_y": 462},
-    ],
-    [
-        {"top_x": 503, "top_y": 449, "bottom_x": 528, "bottom_y": 462},
-        {"top_x": 569, "top_y": 449, "bottom_x": 594, "bottom_y": 462},
-        {"top_x": 635, "top_y": 449, "bottom_x": 660, "bottom_y": 462},
-    ],
-]  # スキルアイコンの"あと"の文字が表示される位置 → この文字が表示されていればスキル使用不可能として判定する
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_context import FrameContext
+from layout_profile import get_layout
+from template_matching import get_template_image_position
 
+# サンプル画像(960x540)のレイアウト（layout_profile.py参照）
+layout = get_layout("iphone_7", (960, 540))
 
-SKILL_ICON_TOP_FRAME = [
-    [
-        {"top_x": 34, "top_y": 409, "bottom_x": 77, "bottom_y": 412},
-        {"top_x": 100, "top_y": 409, "bottom_x": 143, "bottom_y": 412},
-        {"top_x": 166, "top_y": 409, "bottom_x": 209, "bottom_y": 412},
-    ],
-    [
-        {"top_x": 272, "top_y": 409, "bottom_x": 315, "bottom_y": 412},
-        {"top_x": 338, "top_y": 409, "bottom_x": 381, "bottom_y": 412},
-        {"top_x": 404, "top_y": 409, "bottom_x": 447, "bottom_y": 412},
-    ],
-    [
-        {"top_x": 510, "top_y": 409, "bottom_x": 553, "bottom_y": 412},
-        {"top_x": 575, "top_y": 409, "bottom_x": 619, "bottom_y": 412},
-        {"top_x": 642, "top_y": 409, "bottom_x": 685, "bottom_y": 412},
-    ],
-]  # スキルアイコン上部の白いライン → このラインが見えていればスキルアイコンが存在していると判定する
-
-##### 任意画像の位置の認識 #####
-def get_template_image_position(image_color, image_name, roi=None, debug_mode=False):
-    THRESHOLD = 0.80  # 一致度の閾値; 一致度の最大値がこの閾値以上であれば、テンプレートと一致したとみなす
-    TEMPLATE_IMAGE_PATH = "./pict/" + image_name + ".png"
-
-    # キャプチャ画像のグレースケール化
-    image_gray = cv2.cvtColor(image_color, cv2.COLOR_BGR2GRAY)
-
-    # ROIの設定
-    if roi is not None:
-        image_gray = image_gray[
-            roi["top_y"] : roi["bottom_y"], roi["top_x"] : roi["bottom_x"]
-        ]
-
-    # テンプレートの画像をグレースケールで読み込む
-    template = cv2.imread(TEMPLATE_IMAGE_PATH, 0)
-
-    # テンプレートマッチング処理
-    result = cv2.matchTemplate(image_gray, template, cv2.TM_CCOEFF_NORMED)
-
-    # 一致度の最大値と位置を取得
-    _, max_val, _, max_loc = cv2.minMaxLoc(result)
-    top_x, top_y = max_loc
-    if roi is not None:
-        top_x += roi["top_x"]
-        top_y += roi["top_y"]
-    width, height = template.shape[::-1]
-
-    if debug_mode:
-        result = image_color.copy()
-        # 検出領域を四角で囲む
-        cv2.rectangle(
-            result, (top_x, top_y), (top_x + width, top_y + height), (255, 0, 0), 2
-        )
-
-        # 結果を出力
-        cv2.imwrite("./debug/" + image_name + ".jpg", result)
-        print(
-            "image_name:",
-            image_name,
-            "    max_val:",
-            max_val,
-            "    max_loc:",
-            (top_x, top_y),
-        )
-
-    # 一致度が閾値以上：一致するエリアの中心座標を返す
-    # 一致度が閾値以下：Noneを返す
-    if max_val > THRESHOLD:
-        # タップの位置を求める
-        tap_position = np.array([top_x + int(width / 2), top_y + int(height / 2)])
-        return tap_position
-    else:
-        return None
+# スキルアイコンの"あと"の文字が表示される位置 → この文字が表示されていればスキル使用不可能として判定する
+SKILL_LETTER_POSITION = layout.rois["skill_letter"]
 
+# スキルアイコン上部の白いライン → このラインが見えていればスキルアイコンが存在していると判定する
+SKILL_ICON_TOP_FRAME = layout.rois["skill_icon_top_frame"]
 
 # 画像の読み込み
-image_color = cv2.imread("./test/skill_sample_4.png")
+frame = FrameContext(
+    cv2.imread(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "skill_sample_4.png")
+    )
+)
 
 # しきい値指定によるフィルタリング
 # image_gray = cv2.cvtColor(image_color, cv2.COLOR_BGR2GRAY)
 # _, image_binary = cv2.threshold(image_gray, 100, 255, cv2.THRESH_BINARY)
 
 
-def check_skill_icon_existence(image_color, roi=None, debug_mode=False):
+def check_skill_icon_existence(frame, roi=None, debug_mode=False):
     THRESHOLD = 200  # 平均輝度の閾値; 平均輝度がこの閾値以上であれば、スキルアイコンが存在しているとみなす
 
-    # キャプチャ画像のグレースケール化
-    image_gray = cv2.cvtColor(image_color, cv2.COLOR_BGR2GRAY)
-
     # ROIの設定
     if roi is not None:
-        image_gray = image_gray[
-            roi["top_y"] : roi["bottom_y"], roi["top_x"] : roi["bottom_x"]
-        ]
+        image_gray = frame.crop(roi)
 
         mean_brightness = np.max(np.mean(image_gray, axis=1))
         if mean_brightness > THRESHOLD:
@@ -123,12 +45,12 @@ def check_skill_icon_existence(image_color, roi=None, debug_mode=False):
 
 for i in range(3):
     for j in range(3):
-        check_skill_icon_existence(image_color, SKILL_ICON_TOP_FRAME[i][j])
+        check_skill_icon_existence(frame, SKILL_ICON_TOP_FRAME[i][j])
 """
 for i in range(3):
     for j in range(3):
         pos = get_template_image_position(
-            image_color, "あと", SKILL_LETTER_POSITION[i][j], False
+            frame, "あと", SKILL_LETTER_POSITION[i][j], False
         )
         if pos is None:
             # "あと"の文字が見つからなければ、スキル使用可能
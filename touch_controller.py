@@ -0,0 +1,240 @@
+import queue
+import serial
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from stage_timer import timed
+
+# タッチ操作デバイスの接続先
+SERIAL_PORT = "/dev/ttyUSB0"
+BAUD_RATE = 115200
+
+# 応答を返すファームウェアの場合
+#   コマンド1行ごとに、受け付けたら"OK"、実行し終えたら"DONE"を1行で返す
+#   （実行できなければ"ERR"を返す）
+#   コマンドは送信した順に実行されるため、応答もコマンドを送信した順に返る
+ACK_TIMEOUT = 2.0  # 1コマンドの応答を待つ時間の上限(秒)
+PROBE_TIMEOUT = 0.5  # 起動時に応答を返すファームウェアか確かめるときに待つ時間(秒)
+
+# 応答を返さない従来のファームウェアの場合
+#   コマンドを送信した後、実行し終えるまでの時間を一定時間待って見積もる
+LEGACY_COMMAND_WAIT = 0.2  # 各コマンドの後に待つ時間(秒)
+LEGACY_MOVE_WAIT = 0.1  # MOVEコマンドの後に追加で待つ時間(秒)
+
+
+##### タッチ操作デバイスの制御 #####
+# タップ位置は処理する画像の座標で受け取り、基準の画像サイズの座標に戻して送信する
+# batch()の中で送ったコマンドはまとめて1回で書き込み、すべての"DONE"が返るまで待つ
+# port: シリアルポート名、またはシリアル通信のオブジェクト（serial.Serialと同じwrite, readline,
+#       reset_input_buffer, close, timeoutを持つもの; 再生・試験用）
+# acknowledged: Trueなら応答を待つ、Falseなら一定時間待つ、Noneなら起動時に判定する
+class TouchController:
+    def __init__(
+        self,
+        port=SERIAL_PORT,
+        transform=None,
+        acknowledged=None,
+        ack_timeout=ACK_TIMEOUT,
+        legacy_move_wait=LEGACY_MOVE_WAIT,
+    ):
+        if isinstance(port, str):
+            self.ser = serial.Serial(port, BAUD_RATE, timeout=ack_timeout)
+        else:
+            self.ser = port
+            self.ser.timeout = ack_timeout
+        self.transform = transform  # 処理する画像の座標を変換するCoordinateTransform
+        self.ack_timeout = ack_timeout
+        self.legacy_move_wait = legacy_move_wait
+        self.pending = None  # batch()の中で送信を保留しているコマンド
+        self.batch_depth = 0
+        self.last_result = None  # 最後に送信したコマンドの結果
+
+        if acknowledged is None:
+            acknowledged = self.probe()
+        self.acknowledged = acknowledged
+
+    def __del__(self):
+        self.ser.close()
+
+    # 応答を返すファームウェアか確かめる
+    def probe(self):
+        self.ser.reset_input_buffer()
+        self.ser.timeout = PROBE_TIMEOUT
+        self.ser.write(b"PING\n")
+        reply = self.ser.readline().strip()
+        self.ser.timeout = self.ack_timeout
+        if reply != b"OK":
+            self.ser.reset_input_buffer()
+            return False
+
+        # PINGの"DONE"まで読んでおく（最初に送信するコマンドの応答と数え間違えないように）
+        _, failure = self.read_replies(1)
+        if failure is not None:
+            self.ser.reset_input_buffer()
+        return True
+
+    # コマンドcount個分の応答("DONE"または"ERR")を読む（"OK"は読み捨てる）
+    # 戻り値
+    #   応答を読んだコマンドの数, 最初に失敗した応答（すべて"DONE"ならNone、応答がなければb""）
+    def read_replies(self, count):
+        finished = 0
+        failure = None
+        while finished < count:
+            reply = self.ser.readline().strip()
+            if reply == b"OK":
+                continue
+            if reply == b"":
+                return finished, failure if failure is not None else b""
+            finished += 1
+            if reply != b"DONE" and failure is None:
+                failure = reply
+        return finished, failure
+
+    # 応答の読み取りを送信したコマンドと同期し直す
+    # 応答を読んでいないコマンドがoutstanding個残っている状態でPINGを送信し、
+    # 残りのコマンドとPINGの応答をすべて読み捨てる
+    # 戻り値
+    #   PINGの応答まで読み終えたか（応答が途切れた場合は受信済みの応答を捨ててFalse）
+    def synchronize(self, outstanding):
+        self.ser.write(b"PING\n")
+        finished, _ = self.read_replies(outstanding + 1)
+        if finished < outstanding + 1:
+            self.ser.reset_input_buffer()
+            return False
+        return True
+
+    # コマンドを送信する（batch()の中では送信を保留してNoneを返す）
+    def send_message(self, message):
+        if self.pending is not None:
+            self.pending.append(message)
+            return None
+        self.last_result = self.send_messages([message])
+        return self.last_result
+
+    # 複数のコマンドを送信し、実行し終えるまで待つ
+    # 戻り値
+    #   すべてのコマンドを実行し終えたか（応答がない・エラーが返った場合はFalse）
+    @timed("serial")
+    def send_messages(self, messages):
+        if len(messages) == 0:
+            return True
+
+        if not self.acknowledged:
+            # 従来のファームウェア：1コマンドずつ送信して一定時間待つ
+            for message in messages:
+                self.ser.write(bytes(message, "UTF-8"))
+                time.sleep(LEGACY_COMMAND_WAIT)
+                if message.startswith("MOVE"):
+                    time.sleep(self.legacy_move_wait)
+            return True
+
+        # まとめて1回で書き込み、コマンドの数だけ"DONE"が返るまで待つ
+        self.ser.write(bytes("".join(messages), "UTF-8"))
+        finished, failure = self.read_replies(len(messages))
+        if failure is None:
+            return True
+
+        if failure == b"":
+            print("タッチ操作デバイスから応答がありません")
+        else:
+            print("タッチ操作デバイスがエラーを返しました：", failure)
+        # 残りのコマンドの応答が次に送信するコマンドの応答と混ざらないようにする
+        if not self.synchronize(len(messages) - finished):
+            print("タッチ操作デバイスの応答を同期し直せませんでした")
+        return False
+
+    # withブロック内のコマンドをまとめて送信する（入れ子にした場合は一番外側でまとめて送信する）
+    @contextmanager
+    def batch(self):
+        if self.batch_depth == 0:
+            self.pending = []
+        self.batch_depth += 1
+        succeeded = False
+        try:
+            yield self
+            succeeded = True
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                messages = self.pending
+                self.pending = None
+                # 途中で例外が発生した場合は送信しない
+                if succeeded:
+                    self.last_result = self.send_messages(messages)
+
+    def home(self):
+        return self.send_message("HOME\n")
+
+    def tap(self):
+        return self.send_message("TAP\n")
+
+    def move(self, destination_image_coordinate):
+        if self.transform is not None:
+            destination_image_coordinate = self.transform.to_reference(
+                destination_image_coordinate
+            )
+        x, y = destination_image_coordinate
+        message = "MOVE," + str(x) + "," + str(y) + "\n"
+        return self.send_message(message)
+
+    # 指定した位置を順番にタップする
+    def tap_positions(self, positions):
+        with self.batch():
+            for position in positions:
+                self.move(position)
+                self.tap()
+        return self.last_result
+
+    # 送信済みのコマンドがすべて実行し終わるまで待つ（同期制御では送信時に待っているので何もしない）
+    def wait(self, timeout=None):
+        return True
+
+
+##### タッチ操作デバイスの非同期制御 #####
+# コマンドをキューに入れてすぐに戻り、専用のスレッドで順番にシリアル通信する
+# 操作中も画像認識を進められるよう、各メソッドは完了を表すFutureを返す
+#   future.result()でTouchController.send_messagesの戻り値（実行し終えたか）を得られる
+# 前の操作の結果を画面で確認する前には、wait()で送信済みのコマンドが実行し終わるまで待つこと
+class AsyncTouchController(TouchController):
+    def __init__(self, *args, **kwargs):
+        super(AsyncTouchController, self).__init__(*args, **kwargs)
+        self.queue = queue.Queue()
+        self.last_result = Future()
+        self.last_result.set_result(True)
+        self.writer = threading.Thread(target=self.write_messages, daemon=True)
+        self.writer.start()
+
+    # コマンドをキューに入れる
+    def send_messages(self, messages):
+        future = Future()
+        self.queue.put((messages, future))
+        return future
+
+    # キューに入ったコマンドを順番に送信する
+    def write_messages(self):
+        while True:
+            messages, future = self.queue.get()
+            if messages is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(TouchController.send_messages(self, messages))
+            except Exception as e:
+                future.set_exception(e)
+
+    # 送信済みのコマンドがすべて実行し終わるまで待つ
+    # 戻り値
+    #   最後のコマンドを実行し終えたか（timeout秒以内に終わらなければFalse）
+    def wait(self, timeout=None):
+        try:
+            return self.last_result.result(timeout)
+        except FutureTimeoutError:
+            return False
+
+    # キューに残ったコマンドを送信し終えたら送信用のスレッドを終了する
+    def close(self):
+        self.queue.put((None, None))
+        self.writer.join()